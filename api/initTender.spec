@@ -6,7 +6,12 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    # The same optional and lazily imported modules as tender.spec, for the app this launcher starts.
+    hiddenimports=[
+        'PIL.Image', 'PyPDF2', 'PyPDF2.generic', 'pypandoc',
+        'pikepdf', 'brotli',
+        'python_multipart', 'python_multipart.multipart', 'multipart', 'multipart.multipart',
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
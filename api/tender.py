@@ -1,27 +1,52 @@
 from fastapi import (
-    FastAPI, Form, UploadFile, Request, HTTPException, Depends, status, Response, BackgroundTasks # Added BackgroundTasks
+    FastAPI, Form, Request, HTTPException, Depends, status, Response, BackgroundTasks # Added BackgroundTasks
 )
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
-from typing import List
+from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Callable, List, Optional, Tuple
+from contextlib import closing
+import asyncio
+import json
 import shutil
+import sys
+import time
 import os
 import tempfile
-from PIL import Image
-from PyPDF2 import PdfMerger # Corrected: PdfWriter is preferred for new code, but PdfMerger is what you used and works.
-import pypandoc
+import threading
+import zipfile
 import logging
-from pathlib import Path
 import secrets 
-import uvicorn
 
+# The subsystems live in tenderflow/ next to this file, importable however the
+# app is started: uvicorn api.tender:app, tender:app, Vercel or the PyInstaller build.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# pylint: disable=wrong-import-position
+from tenderflow.lazy import LAZY_MODULES
+from tenderflow.config import (
+    BATCH_TTL_SECONDS, CACHE_DIR, JOB_MAX_QUEUED, JOB_TTL_SECONDS, JOBS_DIR, LAZY_STARTUP, MASTERS_DIR,
+    MERGE_ENGINE, OPTIMIZE_OUTPUT, PAGE_MAX_AGE, PIPELINE_RETRY_AFTER, RESULT_CACHE_DIR, SERVER_TIMING,
+    STATIC_DIR, STREAM_OUTPUT, TEMP_BYTES_PER_INPUT_BYTE,
+    TEMP_CONVERTED_BYTES_PER_INPUT_BYTE, UPLOAD_CHUNK_BYTES, WARMUP_ON_STARTUP,
+)
+from tenderflow.scratch import ScratchDir, temp_storage
+from tenderflow.metrics import directory_bytes, metrics, StageTimer
+from tenderflow.pandoc import pandoc_service
+from tenderflow.cache import result_cache, result_cache_key
+from tenderflow.masters import master_library
+from tenderflow.ingest import ingest_multipart, kind_from_filename, MultipartIngest
+from tenderflow.uploads import parse_upload_checksum, upload_sessions
+from tenderflow.pipeline import build_tender_pdf, conversion_scheduler, PdfChunkStream, pipeline, write_tender_pdf_stream
+from tenderflow.jobs import job_runner, job_store
+from tenderflow.projects import tender_projects
+from tenderflow.batches import (
+    batch_store, BatchSlots, convert_batch_lots, parse_batch_manifest, resolve_batch_inputs, spool_batch_masters,
+    zip_member_chunks, ZipStreamBuffer,
+)
+from tenderflow.frontend import etag_matches, pages, StaticAssets
+# pylint: enable=wrong-import-position
 
-app = FastAPI()
 
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), "uploads")
-STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+app = FastAPI()
 
 
 logging.basicConfig(level=logging.INFO)
@@ -30,51 +55,77 @@ logging.basicConfig(level=logging.INFO)
 VALID_USERNAME = "crm"
 VALID_PASSWORD = "Inst@2025"
 
-def is_image(filename): return filename.lower().endswith((".jpg", ".jpeg", ".png"))
-def is_word(filename): return filename.lower().endswith(".docx")
 
-# --- Helper function for cleanup ---
-def cleanup_temp_dir(temp_dir_path: str):
-    logging.info(f"Cleaning up temporary directory: {temp_dir_path}")
-    try:
-        # Delete all files within the directory first
-        for f_path in Path(temp_dir_path).glob("*"):
-            try:
-                f_path.unlink()
-                logging.info(f"Deleted temporary file: {f_path}")
-            except OSError as e:
-                logging.error(f"Error deleting temporary file {f_path}: {e}")
-       
-        Path(temp_dir_path).rmdir()
-        logging.info(f"Removed temporary directory: {temp_dir_path}")
-    except OSError as e:
-        logging.error(f"Error removing temporary directory {temp_dir_path}: {e}")
-    except Exception as e:
-        logging.error(f"Unexpected error during cleanup of {temp_dir_path}: {e}")
-
-
-def convert_image_to_pdf(image_path):
-    img = Image.open(image_path)
-    # Ensure RGB for saving as PDF if it's RGBA or P (palette)
-    if img.mode == 'RGBA' or img.mode == 'P':
-        img = img.convert("RGB")
-    temp_pdf_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    img.save(temp_pdf_file.name)
-    temp_pdf_file.close() # Close the file handle
-    return temp_pdf_file.name
-
-def convert_word_to_pdf(docx_path):
-    temp_pdf_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    output_path = temp_pdf_file.name
-    temp_pdf_file.close() # Close the file handle before pandoc tries to write to it.
-    try:
-        pypandoc.convert_file(docx_path, 'pdf', outputfile=output_path)
-        return output_path
-    except Exception as e:
-        
-        if os.path.exists(output_path):
-            os.unlink(output_path)
-        raise HTTPException(status_code=500, detail=f"Word to PDF conversion failed for {Path(docx_path).name}: {e}")
+# --- Lifecycle ---
+@app.on_event("startup")
+def sweep_temp_storage():
+    temp_storage.sweep()
+
+
+@app.on_event("shutdown")
+def shutdown_pipeline():
+    pipeline.shutdown()
+    conversion_scheduler.shutdown()
+    pandoc_service.shutdown()
+
+
+@app.on_event("startup")
+def start_job_runner():
+    # Lazily started instances pick up queued jobs once POST /jobs starts the runner.
+    if not LAZY_STARTUP:
+        job_runner.ensure_started()
+
+
+@app.on_event("shutdown")
+def stop_job_runner():
+    job_runner.stop()
+
+
+app.mount("/static", StaticAssets(directory=STATIC_DIR), name="static")
+
+
+@app.on_event("startup")
+def render_pages():
+    pages.render_all()
+
+
+# --- Warmup ---
+warmup_lock = threading.Lock()
+warmed_up = threading.Event()
+
+
+def warmup() -> dict:
+    """Pay the first tender's one-off costs now: imports, rendered pages and pandoc workers.
+
+    Only the first call does any work; reports the modules it had to import
+    and how long it took.
+    """
+    with warmup_lock:
+        if warmed_up.is_set():
+            return {"imported": [], "seconds": 0.0}
+        report = _warmup()
+        warmed_up.set()
+        return report
+
+
+def _warmup() -> dict:
+    started = time.perf_counter()
+    imported = [module._name for module in LAZY_MODULES if module._name not in sys.modules]
+    for module in LAZY_MODULES:
+        module._load()
+    pages.render_all()
+    if pandoc_service.enabled:
+        pandoc_service.warmup()
+    seconds = time.perf_counter() - started
+    logging.info("Warmup finished in %.3fs (imported: %s)", seconds, ", ".join(imported) or "nothing")
+    return {"imported": imported, "seconds": round(seconds, 3)}
+
+
+@app.on_event("startup")
+def warm_up_on_startup():
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=warmup, name="tender-warmup", daemon=True).start()
+
 
 def check_authentication(request: Request):
     auth_cookie = request.cookies.get("authenticated")
@@ -86,193 +137,17 @@ def check_authentication(request: Request):
         )
 
 @app.get("/", response_class=HTMLResponse)
-async def login_page():
-    return HTMLResponse("""
-    <html>
-    <head>
-        <title>Login - Tender Generator</title>
-        <style>
-            body {
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                background: linear-gradient(135deg, #6B73FF 0%, #000DFF 100%);
-                display: flex;
-                height: 100vh;
-                justify-content: center;
-                align-items: center;
-                margin: 0;
-                color: white;
-            }
-            .login-card {
-                background: rgba(255,255,255,0.15);
-                backdrop-filter: blur(10px);
-                padding: 2rem 3rem;
-                border-radius: 15px;
-                box-shadow: 0 8px 20px rgba(0,0,0,0.3);
-                width: 320px;
-                text-align: center;
-                border: 1px solid rgba(255,255,255,0.3);
-            }
-            h2 {
-                margin-bottom: 1.5rem;
-                color: #ffffff;
-                text-shadow: 0 0 8px rgba(255,255,255,0.8); /* Glow effect */
-                font-family: 'Roboto', sans-serif;  /* Modern font */
-                letter-spacing: 0.5px;
-            }
-            input[type=text], input[type=password] {
-                width: 100%;
-                padding: 12px 15px;
-                margin: 10px 0 20px 0;
-                border: none;
-                border-radius: 8px;
-                font-size: 1rem;
-                outline: none;
-                background-color: rgba(255,255,255,0.8); /* Slightly lighter input fields */
-                color: #333;
-                box-sizing: border-box; /* Ensure padding doesn't add to width */
-            }
-            input[type=text]:focus, input[type=password]:focus {
-                box-shadow: 0 0 12px 3px rgba(0, 149, 237, 0.5); /* Focus glow */
-                background-color: rgba(255,255,255,0.95);
-            }
-            button {
-                background: linear-gradient(to right, #667eea, #764ba2); /* Gradient button */
-                color: white;
-                border: none;
-                padding: 12px 20px;
-                width: 100%;
-                border-radius: 8px;
-                font-size: 1.1rem;
-                cursor: pointer;
-                transition: all 0.3s ease;
-                font-weight: 500; /* Medium font weight */
-                box-shadow: 0 4px 12px rgba(0,0,0,0.2);
-                letter-spacing: 1px;
-            }
-            button:hover {
-                background: linear-gradient(to right, #6a11cb, #2575fc);
-                transform: translateY(-2px);
-                box-shadow: 0 6px 15px rgba(0,0,0,0.3);
-            }
-            .error {
-                color: #ff4c4c;
-                margin-bottom: 15px;
-                font-weight: 500;
-                text-shadow: 1px 1px 2px rgba(0,0,0,0.3);
-            }
-        </style>
-        <link href="https://fonts.googleapis.com/css2?family=Roboto:wght@400;500;700&display=swap" rel="stylesheet">
-    </head>
-    <body>
-        <div class="login-card">
-            <h2>Tender Generator Login</h2>
-            <form method="post" action="/login">
-                <input name="username" type="text" placeholder="Username" required autocomplete="off">
-                <input name="password" type="password" placeholder="Password" required autocomplete="off">
-                <button type="submit">Login</button>
-            </form>
-        
-                        </div>
-    </body>
-    </html>
-    """)
+async def login_page(request: Request):
+    return pages.response(request, "login", f"public, max-age={PAGE_MAX_AGE}")
 
 @app.post("/login", response_class=HTMLResponse) 
-async def login(response: Response, username: str = Form(...), password: str = Form(...)):
+async def login(request: Request, username: str = Form(...), password: str = Form(...)):
     if username == VALID_USERNAME and password == VALID_PASSWORD:
         redirect_response = RedirectResponse(url="/upload", status_code=status.HTTP_302_FOUND)
         redirect_response.set_cookie(key="authenticated", value="true", httponly=True, max_age=3600, samesite="lax") # 1 hour session
         return redirect_response
     else:
-        return HTMLResponse("""
-        <html>
-        <head>
-            <title>Login Failed</title>
-            <style>
-                body {
-                    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                    background: linear-gradient(135deg, #6B73FF 0%, #000DFF 100%);
-                    display: flex;
-                    height: 100vh;
-                    justify-content: center;
-                    align-items: center;
-                    margin: 0;
-                    color: white;
-                }
-                .login-card {
-                    background: rgba(255,255,255,0.15);
-                    backdrop-filter: blur(10px);
-                    padding: 2rem 3rem;
-                    border-radius: 15px;
-                    box-shadow: 0 8px 20px rgba(0,0,0,0.3);
-                    width: 320px;
-                    text-align: center;
-                    border: 1px solid rgba(255,255,255,0.3);
-                }
-                h2 {
-                    margin-bottom: 1.5rem;
-                    color: white;
-                    text-shadow: 0 0 8px rgba(255,255,255,0.8); /* Glow effect */
-                    font-family: 'Roboto', sans-serif;  /* Modern font */
-                    letter-spacing: 0.5px;
-                }
-                input[type=text], input[type=password] {
-                    width: 100%;
-                    padding: 12px 15px;
-                    margin: 10px 0 20px 0;
-                    border: none;
-                    border-radius: 8px;
-                    font-size: 1rem;
-                    outline: none;
-                    background-color: rgba(255,255,255,0.8); /* Slightly lighter input fields */
-                    color: #333;
-                    box-sizing: border-box;
-                }
-                input[type=text]:focus, input[type=password]:focus {
-                    box-shadow: 0 0 12px 3px rgba(0, 149, 237, 0.5); /* Focus glow */
-                    background-color: rgba(255,255,255,0.95);
-                }
-                button {
-                    background: linear-gradient(to right, #667eea, #764ba2); /* Gradient button */
-                    color: white;
-                    border: none;
-                    padding: 12px 20px;
-                    width: 100%;
-                    border-radius: 8px;
-                    font-size: 1.1rem;
-                    cursor: pointer;
-                    transition: all 0.3s ease;
-                    font-weight: 500; /* Medium font weight */
-                    box-shadow: 0 4px 12px rgba(0,0,0,0.2);
-                    letter-spacing: 1px;
-                }
-                button:hover {
-                    background: linear-gradient(to right, #6a11cb, #2575fc);
-                    transform: translateY(-2px);
-                    box-shadow: 0 6px 15px rgba(0,0,0,0.3);
-                }
-                .error {
-                    color: #ff4c4c; /* Brighter red for error */
-                    margin-bottom: 15px;
-                    font-weight: 500;
-                    text-shadow: 1px 1px 2px rgba(0,0,0,0.3); /* Subtle shadow for readability */
-                }
-            </style>
-            <link href="https://fonts.googleapis.com/css2?family=Roboto:wght@400;500;700&display=swap" rel="stylesheet">
-        </head>
-        <body>
-            <div class="login-card">
-                <h2>Tender Generator Login</h2>
-                <div class="error">Invalid username or password</div>
-                <form method="post" action="/login">
-                    <input name="username" type="text" placeholder="Username" required autocomplete="off">
-                    <input name="password" type="password" placeholder="Password" required autocomplete="off">
-                    <button type="submit">Login</button>
-                </form>
-            </div>
-        </body>
-        </html>
-        """, status_code=401) 
+        return pages.response(request, "login_failed", "no-store", status_code=401)
 
 @app.get("/logout")
 async def logout():
@@ -282,217 +157,734 @@ async def logout():
 
 @app.get("/upload", response_class=HTMLResponse)
 async def upload_form(request: Request, _ = Depends(check_authentication)): 
-    return HTMLResponse(content=f"""
-    <html>
-    <head>
-        <title>Tender Generator</title>
-        <style>
-            body {{
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                margin: 0;
-                padding: 0;
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                height: 100vh;
-                color: #333;
-                /* Professional office environment background */
-                background: linear-gradient(135deg, #e6ebf1, #cbd4db); /* Soft blue-gray gradient */
-                /* optionally add a subtle texture or pattern here if desired */
-            }}
-            .container {{
-                background: white;
-                border-radius: 20px;
-                padding: 3rem 3.5rem 5rem 3.5rem; /* extra bottom padding to fit logout button */
-                width: 500px;
-                box-shadow: 0 12px 40px rgba(0, 0, 0, 0.15);
-                position: relative;
-            }}
-            h1 {{
-                font-weight: 800;
-                font-size: 2.5rem;
-                margin-bottom: 2rem;
-                text-align: center;
-                color: #D72631;
-                font-family: 'Montserrat', sans-serif;
-                letter-spacing: -0.02em;
-            }}
-            label {{
-                font-weight: 600;
-                display: block;
-                margin: 1.2rem 0 0.5rem 0;
-                color: #555;
-            }}
-            input[type=file] {{
-                width: 100%;
-                padding: 12px 15px;
-                border-radius: 12px;
-                border: 1px solid #ddd;
-                font-size: 1.1rem;
-                cursor: pointer;
-                transition: all 0.3s ease;
-                background-color: #fff;
-                color: #333;
-                box-sizing: border-box;
-            }}
-            input[type=file]:hover {{
-                border-color: #D72631;
-                box-shadow: 0 2px 5px rgba(0, 0, 0, 0.1);
-            }}
-            button[type=submit] {{ /* Target specifically the submit button */
-                margin-top: 2.5rem;
-                width: 100%;
-                background-color: #D72631;
-                color: white;
-                font-size: 1.3rem;
-                font-weight: 700;
-                padding: 15px 0;
-                border: none;
-                border-radius: 15px;
-                cursor: pointer;
-                transition: background-color 0.3s ease, transform 0.2s ease;
-                font-family: 'Roboto', sans-serif;
-                letter-spacing: 0.5px;
-                box-shadow: 0 5px 10px rgba(0, 0, 0, 0.1);
-            }}
-            button[type=submit]:hover {{ /* Target specifically the submit button */
-                background-color: #c8232b;
-                transform: translateY(-2px);
-                box-shadow: 0 7px 12px rgba(0, 0, 0, 0.15);
-            }}
-            .logout-btn {{
-                position: absolute;
-                bottom: 20px; /* move to bottom inside container */
-                left: 50%; /* center horizontally */
-                transform: translateX(-50%);
-                background-color: #4CAF50;
-                color: white;
-                border: none;
-                padding: 8px 14px; /* smaller padding */
-                border-radius: 10px;
-                cursor: pointer;
-                font-weight: 600;
-                font-size: 0.85rem; /* smaller font */
-                transition: background-color 0.3s ease, transform 0.2s ease;
-                font-family: 'Roboto', sans-serif;
-                box-shadow: 0 3px 6px rgba(0, 0, 0, 0.1);
-                width: auto; /* Allow button to size to content */
-                min-width: 100px; /* Ensure minimum width */
-                margin-top: 1rem; /* Add some margin from the submit button */
-            }}
-            .logout-btn:hover {{
-                background-color: #45a049;
-                transform: translate(-50%, -2px);
-                box-shadow: 0 5px 8px rgba(0, 0, 0, 0.15);
-            }}
-        </style>
-        <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@400;700&family=Roboto:wght@400;500;700&display=swap" rel="stylesheet">
-    </head>
-    <body>
-        <div class="container">
-            <form action="/upload" method="post" enctype="multipart/form-data">
-                
-                <h1>📄 Tender Generator</h1>
-
-                <label for="master_file">Master PDF File:</label>
-                <input type="file" name="master_file" id="master_file" accept=".pdf" required>
-
-                <label for="lot_files">Lot Files (PDF, JPG, PNG, DOCX):</label>
-                <input type="file" name="lot_files" id="lot_files" accept=".pdf,.jpg,.jpeg,.png,.docx" multiple required>
-
-                <button type="submit">Generate Tender Document</button>
-                                   
-                <button type="button" class="logout-btn" onclick="window.location.href='/logout'">Logout</button>
-            </form>
-        </div>
-    </body>
-    </html>
-    """)
+    # Revalidated on every visit so a logged-out browser is sent back to the login page.
+    return pages.response(request, "upload", "private, no-cache")
+
+
+async def ingest_tender_inputs(request: Request, dest_dir: str):
+    """Stream a tender upload into dest_dir; returns (master_path, master_sha256, lot_paths, master_snapshot).
+
+    Fields: master_file (PDF), master_id or master_upload_id, and one or more
+    lots, each a lot_files part or a lot_upload_id field, in the order given.
+    master_snapshot is the library's parsed copy of a master_id master (see
+    MasterLibrary) for the paged engine to start from, otherwise None.
+    """
+    ingest = await ingest_multipart(request, dest_dir)
+
+    master_id = ingest.field("master_id")
+    master_upload_id = ingest.field("master_upload_id")
+    master_files = ingest.files_for("master_file")
+    master_snapshot = None
+    if master_upload_id:
+        master = await run_in_threadpool(upload_sessions.checkout, master_upload_id, dest_dir, "master-upload")
+        if master.kind != "pdf":
+            raise HTTPException(status_code=400, detail="Master file must be a PDF and have a filename.")
+        master_path, master_sha256 = master.path, master.sha256
+    elif master_id:
+        master_path = os.path.join(dest_dir, f"master-{master_id}.pdf")
+        master_snapshot = await run_in_threadpool(master_library.checkout, master_id, master_path)
+        if master_snapshot is None:
+            raise HTTPException(status_code=404, detail=f"Unknown master_id: {master_id}")
+        master_sha256 = master_id # master ids are content hashes
+        if MERGE_ENGINE != "paged":
+            master_snapshot = None
+    elif master_files:
+        master_path = master_files[0].path
+        master_sha256 = master_files[0].sha256
+    else:
+        raise HTTPException(status_code=400, detail="Master file must be a PDF and have a filename.")
+
+    lot_paths = await ingested_lots(ingest, dest_dir)
+    if not lot_paths:
+        raise HTTPException(status_code=400, detail="At least one lot file is required.")
+    return master_path, master_sha256, lot_paths, master_snapshot
+
+
+async def ingested_lots(ingest: MultipartIngest, dest_dir: str) -> List[Tuple[str, str, Optional[str]]]:
+    """(filename, path, sha256) of every lot_files part and lot_upload_id field, in body order."""
+    lot_paths = []
+    for index, (field_name, value) in enumerate(ingest.parts):
+        if field_name == "lot_upload_id":
+            value = await run_in_threadpool(upload_sessions.checkout, value, dest_dir, f"upload{index:03d}")
+        elif field_name != "lot_files":
+            continue
+        lot_paths.append((value.filename, value.path, value.sha256))
+    for ingested in ingest.files:
+        metrics.inc("tender_input_bytes_total", ingested.size, kind=ingested.kind)
+    return lot_paths
+
+
+def request_scratch_bytes(request: Request) -> int:
+    """Scratch space a tender upload is expected to need; 0 if the body size is unknown."""
+    try:
+        return TEMP_BYTES_PER_INPUT_BYTE * max(0, int(request.headers.get("content-length", "0")))
+    except ValueError:
+        return 0
+
+
+def converted_bytes(filename: str, size: int) -> int:
+    """Expected size of the PDF an input of this name and size turns into."""
+    return size * TEMP_CONVERTED_BYTES_PER_INPUT_BYTE.get(kind_from_filename(filename), 1)
+
+
+def tender_scratch_bytes(master_path: str, lot_paths: List[Tuple[str, str, Optional[str]]]) -> int:
+    """Scratch space a tender needs once its inputs are on disk: inputs, converted lots and the output."""
+    master_bytes = os.path.getsize(master_path)
+    lot_bytes = [(os.path.getsize(path), converted_bytes(filename, os.path.getsize(path))) for filename, path, _ in lot_paths]
+    return 2 * master_bytes + sum(size + 2 * converted for size, converted in lot_bytes)
+
+
+def batch_scratch_bytes(inputs: dict, outputs: List[dict]) -> int:
+    """Scratch space a batch needs once its inputs are on disk.
+
+    Every input is converted once, and every output adds about the size of
+    the converted inputs it uses.
+    """
+    sizes = {ref: os.path.getsize(path) for ref, (_, path, _) in inputs.items()}
+    converted = {ref: converted_bytes(inputs[ref][0], size) for ref, size in sizes.items()}
+    return sum(sizes.values()) + sum(converted.values()) + sum(
+        converted[output["master"]] + sum(converted[ref] for ref in output["lots"]) for output in outputs
+    )
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that calls on_close however it ends.
+
+    That includes a client gone before the body started, when neither the
+    body generator's cleanup nor a BackgroundTask would run.
+    """
+    def __init__(self, content, on_close: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+async def stream_tender_pdf(master_path: str, lot_paths: List[Tuple[str, str, Optional[str]]],
+                            master_snapshot: Optional[dict], scratch: ScratchDir, filename: str,
+                            timer: StageTimer, result_key: str = None) -> StreamingResponse:
+    """Merge the tender straight into the response body, which starts at once.
+
+    Owns one pipeline slot and scratch, both released once the last byte is
+    sent or the client disconnects. With result_key the PDF is also stored
+    in result_cache and the key is sent as ETag up front. Conversion, merge
+    and write stages are recorded when the stream ends, so Server-Timing
+    only covers the ingest.
+    """
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if SERVER_TIMING:
+        headers["Server-Timing"] = timer.server_timing()
+    if result_key is not None:
+        headers["ETag"] = f'"{result_key}"'
+    sink = PdfChunkStream()
+    pipeline.submit_in_thread(
+        write_tender_pdf_stream, master_path, lot_paths, sink, timer, master_snapshot, result_key,
+        os.path.join(scratch.path, filename),
+    )
+    released = False
+
+    def close():
+        nonlocal released
+        sink.cancel()
+        if not released:
+            released = True
+            pipeline.release()
+        scratch.release()
+
+    async def body():
+        while True:
+            chunk = await run_in_threadpool(sink.next_chunk)
+            if chunk is None:
+                break
+            yield chunk
+
+    return ClosingStreamingResponse(body(), close, media_type="application/pdf", headers=headers)
+
 
 @app.post("/upload") 
 async def upload(
     request: Request, 
     background_tasks: BackgroundTasks,
-    master_file: UploadFile = Form(...),
-    lot_files: List[UploadFile] = Form(...),
+    stream: bool = STREAM_OUTPUT,
+    optimize: bool = OPTIMIZE_OUTPUT,
     _ = Depends(check_authentication) 
 ):
+    # The multipart body is parsed by MultipartIngest rather than Form(...)
+    # parameters, so files are written once, straight into the job directory.
+    # See ingest_tender_inputs for the fields. With ?stream=true the response starts once the inputs are in and
+    # the PDF is sent while it is being merged; that mode always merges on a thread, as the writer must share our process.
+    # A tender whose inputs and settings match a cached one is answered from
+    # result_cache, with its key as ETag. A matching If-None-Match gets a 412:
+    # RFC 9110 keeps 304 for GET and HEAD.
+    # ?optimize=true runs the size optimization pass after the merge (not in
+    # stream mode) and reports it in an X-Tender-Optimization header.
+
+    pipeline.acquire()
+    handed_off = False
+    timer = StageTimer()
+    try:
+        scratch = temp_storage.create(request_scratch_bytes(request))
+        temp_dir_path = scratch.path
+
+        try:
+            with timer.stage("ingest"):
+                master_path, master_sha256, lot_paths, master_snapshot = await ingest_tender_inputs(request, temp_dir_path)
+            # The body size was only a guess (or unknown); move to disk now if RAM cannot hold the conversions and output.
+            await run_in_threadpool(scratch.fit, await run_in_threadpool(tender_scratch_bytes, master_path, lot_paths))
+
+            output_pdf_filename = "Tender.pdf" 
+            result_key = None
+            if result_cache.enabled:
+                result_key = await run_in_threadpool(result_cache_key, master_sha256, lot_paths, optimize)
+                etag = f'"{result_key}"'
+                if etag_matches(request.headers.get("if-none-match"), etag):
+                    # The client holds this tender already; still counted as not_modified.
+                    metrics.inc("tender_result_cache_total", result="not_modified")
+                    timer.record("upload", "not_modified")
+                    background_tasks.add_task(scratch.release)
+                    return Response(status_code=status.HTTP_412_PRECONDITION_FAILED, headers={"ETag": etag})
+                cached_pdf_path = await run_in_threadpool(result_cache.fetch, result_key, temp_dir_path)
+                if cached_pdf_path is not None:
+                    metrics.inc("tender_result_cache_total", result="hit")
+                    timer.record("upload", "cache_hit")
+                    background_tasks.add_task(scratch.release)
+                    return FileResponse(
+                        path=cached_pdf_path, media_type="application/pdf", filename=output_pdf_filename,
+                        headers={"ETag": etag},
+                    )
+                metrics.inc("tender_result_cache_total", result="miss")
+
+            if stream:
+                handed_off = True
+                return await stream_tender_pdf(
+                    master_path, lot_paths, master_snapshot, scratch, output_pdf_filename, timer, result_key,
+                )
+
+            output_pdf_path = os.path.join(temp_dir_path, output_pdf_filename)
+            ingest_seconds = timer.seconds
+            timer = await pipeline.run(build_tender_pdf, master_path, lot_paths, output_pdf_path, None, optimize, master_snapshot)
+            timer.seconds = {**ingest_seconds, **timer.seconds}
+
+        except HTTPException as e:
+            timer.record("upload", "client_error" if e.status_code < 500 else "error")
+            await run_in_threadpool(scratch.release)
+            raise
+        except Exception as e:
+            logging.error("Error during PDF generation: %s", e, exc_info=True)
+            timer.record("upload", "error")
+            await run_in_threadpool(scratch.release)
+            raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
+    finally:
+        if not handed_off:
+            pipeline.release()
+
+    timer.record("upload")
+    headers = {"Server-Timing": timer.server_timing()} if SERVER_TIMING else {}
+    if timer.optimization is not None:
+        headers["X-Tender-Optimization"] = timer.optimization_header()
+    if result_key is not None:
+        headers["ETag"] = f'"{result_key}"'
+        background_tasks.add_task(result_cache.store, result_key, output_pdf_path)
+    background_tasks.add_task(scratch.release)
+    return FileResponse(
+        path=output_pdf_path,
+        media_type='application/pdf',
+        filename=output_pdf_filename,
+        headers=headers,
+    )
+
+
+@app.post("/masters")
+async def register_master(request: Request, _ = Depends(check_authentication)):
+    # Expects a single master_file PDF part, streamed next to the library.
+    staging_dir = tempfile.mkdtemp(dir=master_library.directory)
+    try:
+        ingest = await ingest_multipart(request, staging_dir)
+        master_files = ingest.files_for("master_file")
+        if not master_files:
+            raise HTTPException(status_code=400, detail="Master file must be a PDF and have a filename.")
+        master = master_files[0]
+        metadata = await run_in_threadpool(master_library.register, master.path, master.filename, master.sha256)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error("Error registering master: %s", e, exc_info=True)
+        raise HTTPException(status_code=400, detail=f"Could not register master PDF: {str(e)}")
+    finally:
+        await run_in_threadpool(shutil.rmtree, staging_dir, True)
+    return metadata
 
-    if not master_file.filename or master_file.content_type != "application/pdf":
-        raise HTTPException(status_code=400, detail="Master file must be a PDF and have a filename.")
 
-    temp_dir_path: str = tempfile.mkdtemp() 
+@app.get("/masters")
+async def list_masters(_ = Depends(check_authentication)):
+    return await run_in_threadpool(master_library.list)
 
-    background_tasks.add_task(cleanup_temp_dir, temp_dir_path)
 
-    temporary_file_paths_to_clean = []
+@app.get("/masters/{master_id}")
+async def get_master(master_id: str, _ = Depends(check_authentication)):
+    metadata = await run_in_threadpool(master_library.get, master_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail=f"Unknown master_id: {master_id}")
+    return metadata
 
+
+@app.delete("/masters/{master_id}")
+async def delete_master(master_id: str, _ = Depends(check_authentication)):
+    if not master_library.delete(master_id):
+        raise HTTPException(status_code=404, detail=f"Unknown master_id: {master_id}")
+    return {"deleted": master_id}
+
+
+@app.post("/uploads", status_code=status.HTTP_201_CREATED)
+async def create_upload(request: Request, _ = Depends(check_authentication)):
+    # JSON body: {"filename": ..., "size": total bytes, "sha256": optional hex of the whole file}
+    try:
+        body = await request.json()
+        filename, size = str(body["filename"]), int(body["size"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Expected JSON with filename and size.")
+    meta = await run_in_threadpool(upload_sessions.create, filename, size, body.get("sha256"))
+    return {
+        "upload_id": meta["upload_id"],
+        "offset": 0,
+        "chunk_size": UPLOAD_CHUNK_BYTES,
+        "upload_url": f"/uploads/{meta['upload_id']}",
+    }
+
+
+@app.head("/uploads/{upload_id}")
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str, _ = Depends(check_authentication)):
+    meta = upload_sessions.get(upload_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired upload: {upload_id}")
+    return Response(
+        content=json.dumps(meta), media_type="application/json",
+        headers={"Upload-Offset": str(meta["offset"]), "Upload-Length": str(meta["size"]), "Cache-Control": "no-store"},
+    )
+
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, _ = Depends(check_authentication)):
+    # Body: raw bytes to store at the Upload-Offset header; Upload-Checksum: sha256 <base64 or hex> is checked if sent.
+    offset = request.headers.get("upload-offset", "")
+    if not offset.isdigit():
+        raise HTTPException(status_code=400, detail="Upload-Offset header is required.")
+    checksum = parse_upload_checksum(request.headers.get("upload-checksum"))
+    new_offset = await upload_sessions.write_chunk(upload_id, int(offset), request, checksum)
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers={"Upload-Offset": str(new_offset)})
+
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, _ = Depends(check_authentication)):
+    return await run_in_threadpool(upload_sessions.finalize, upload_id)
+
+
+@app.delete("/uploads/{upload_id}")
+async def delete_upload(upload_id: str, _ = Depends(check_authentication)):
+    if not await run_in_threadpool(upload_sessions.delete, upload_id):
+        raise HTTPException(status_code=404, detail=f"Unknown or expired upload: {upload_id}")
+    return {"deleted": upload_id}
+
+
+@app.post("/projects", status_code=status.HTTP_201_CREATED)
+async def create_project(request: Request, _ = Depends(check_authentication)):
+    # Same form fields as /upload; the project keeps every converted lot for later revisions.
+    staging_dir = tempfile.mkdtemp(dir=tender_projects.directory, prefix=".staging-")
+    try:
+        master_path, _, lot_paths, _ = await ingest_tender_inputs(request, staging_dir)
+        with pipeline.slot():
+            return await pipeline.run(tender_projects.create, master_path, lot_paths)
+    finally:
+        await run_in_threadpool(shutil.rmtree, staging_dir, True)
+
+
+@app.get("/projects/{project_id}")
+async def get_project(project_id: str, _ = Depends(check_authentication)):
+    state = await run_in_threadpool(tender_projects.get, project_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"Unknown project: {project_id}")
+    return tender_projects.describe(state)
+
+
+@app.get("/projects/{project_id}/pdf")
+async def get_project_pdf(project_id: str, request: Request, _ = Depends(check_authentication)):
+    state = await run_in_threadpool(tender_projects.get, project_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"Unknown project: {project_id}")
+    etag = f'"{project_id}-{state["revision"]}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    # Updates replace Tender.pdf atomically, so this is the revision the ETag names or a later one.
+    return FileResponse(
+        path=tender_projects.pdf_path(project_id), media_type="application/pdf", filename="Tender.pdf",
+        headers={"ETag": etag},
+    )
+
+
+async def ingest_project_lot(request: Request, staging_dir: str):
+    """Parse a request carrying exactly one lot; returns (lot_path, form fields)."""
+    ingest = await ingest_multipart(request, staging_dir)
+    lot_paths = await ingested_lots(ingest, staging_dir)
+    if len(lot_paths) != 1:
+        raise HTTPException(status_code=400, detail="Send exactly one lot_files part or lot_upload_id field.")
+    return lot_paths[0], ingest
+
+
+@app.post("/projects/{project_id}/lots")
+async def insert_project_lot(project_id: str, request: Request, _ = Depends(check_authentication)):
+    # One lot plus an optional 0-based position field (default: append).
+    staging_dir = tempfile.mkdtemp(dir=tender_projects.directory, prefix=".staging-")
     try:
-        master_path = os.path.join(temp_dir_path, master_file.filename)
-        with open(master_path, "wb") as f:
-            shutil.copyfileobj(master_file.file, f) 
-        await master_file.close() 
-
-        pdf_merger = PdfMerger()
-        pdf_merger.append(master_path)
-
-        for lot_file in lot_files:
-            if not lot_file.filename:
-                logging.warning("Skipping a lot file with no filename.")
-                await lot_file.close()
-                continue
-
-            lot_file_path = os.path.join(temp_dir_path, lot_file.filename)
-            with open(lot_file_path, "wb") as f:
-                shutil.copyfileobj(lot_file.file, f)
-            await lot_file.close() 
-
-            ext = lot_file.filename.lower().split('.')[-1] if '.' in lot_file.filename else ""
-
-            converted_pdf_path = None
-            if ext == "pdf":
-                pdf_merger.append(lot_file_path)
-            elif ext in ("jpg", "jpeg", "png"):
-                converted_pdf_path = convert_image_to_pdf(lot_file_path)
-                pdf_merger.append(converted_pdf_path)
-                temporary_file_paths_to_clean.append(converted_pdf_path) 
-                # os.unlink(lot_file_path) # Original image can be kept or deleted
-            elif ext == "docx":
-                converted_pdf_path = convert_word_to_pdf(lot_file_path)
-                pdf_merger.append(converted_pdf_path)
-                temporary_file_paths_to_clean.append(converted_pdf_path) # Mark for cleanup
-                # os.unlink(lot_file_path) # Original docx can be kept or deleted
-            else:
-                logging.error(f"Unsupported file type: {lot_file.filename}")
-                raise HTTPException(status_code=400, detail=f"Unsupported file type: {lot_file.filename}")
-
-        output_pdf_filename = "Tender.pdf" 
-        output_pdf_path = os.path.join(temp_dir_path, output_pdf_filename)
-        pdf_merger.write(output_pdf_path)
-        pdf_merger.close()
-
-        for temp_pdf in temporary_file_paths_to_clean:
-            if os.path.exists(temp_pdf):
-                try:
-                    os.unlink(temp_pdf)
-                    logging.info(f"Cleaned up intermediate PDF: {temp_pdf}")
-                except OSError as e:
-                    logging.error(f"Error cleaning up intermediate PDF {temp_pdf}: {e}")
-
-
-        
-        return FileResponse(
-            path=output_pdf_path,
-            media_type='application/pdf',
-            filename=output_pdf_filename         )
-
-    except HTTPException: 
+        lot_path, ingest = await ingest_project_lot(request, staging_dir)
+        position = ingest.field("position")
+        if position is not None and not position.isdigit():
+            raise HTTPException(status_code=400, detail="position must be a non-negative integer.")
+        with pipeline.slot():
+            return await pipeline.run(
+                tender_projects.insert_lot, project_id, lot_path, int(position) if position is not None else None,
+            )
+    finally:
+        await run_in_threadpool(shutil.rmtree, staging_dir, True)
+
+
+@app.put("/projects/{project_id}/lots/{lot_id}")
+async def replace_project_lot(project_id: str, lot_id: str, request: Request, _ = Depends(check_authentication)):
+    staging_dir = tempfile.mkdtemp(dir=tender_projects.directory, prefix=".staging-")
+    try:
+        lot_path, _ = await ingest_project_lot(request, staging_dir)
+        with pipeline.slot():
+            return await pipeline.run(tender_projects.replace_lot, project_id, lot_id, lot_path)
+    finally:
+        await run_in_threadpool(shutil.rmtree, staging_dir, True)
+
+
+@app.delete("/projects/{project_id}/lots/{lot_id}")
+async def remove_project_lot(project_id: str, lot_id: str, _ = Depends(check_authentication)):
+    with pipeline.slot():
+        return await pipeline.run(tender_projects.remove_lot, project_id, lot_id)
+
+
+@app.put("/projects/{project_id}/order")
+async def reorder_project_lots(project_id: str, request: Request, _ = Depends(check_authentication)):
+    # JSON body: {"lot_ids": [every lot_id, in the new order]}
+    try:
+        lot_ids = [str(lot_id) for lot_id in (await request.json())["lot_ids"]]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Expected JSON with lot_ids.")
+    with pipeline.slot():
+        return await pipeline.run(tender_projects.reorder, project_id, lot_ids)
+
+
+@app.delete("/projects/{project_id}")
+async def delete_project(project_id: str, _ = Depends(check_authentication)):
+    if not await run_in_threadpool(tender_projects.delete, project_id):
+        raise HTTPException(status_code=404, detail=f"Unknown project: {project_id}")
+    return {"deleted": project_id}
+
+
+async def build_batch_output(index: int, plan: dict, lot_pdf_paths: dict, slots: BatchSlots) -> Tuple[int, dict]:
+    """Merge one batch output on a pipeline worker; returns (index, its report entry)."""
+    report = {"name": plan["name"], "status": "done", "cached": plan["cached"]}
+    if not plan["cached"]:
+        lots = [
+            (f"lot{lot_index:03d}.pdf", lot_pdf_paths[(kind_from_filename(filename), content_hash)], None)
+            for lot_index, (filename, _, content_hash) in enumerate(plan["lots"])
+        ]
+        try:
+            async with slots.output():
+                timer = await pipeline.run(
+                    build_tender_pdf, plan["master"][1], lots, plan["path"], None, plan["optimize"], plan["master_snapshot"],
+                )
+        except Exception as e:
+            if not isinstance(e, HTTPException):
+                logging.error("Error building batch output %s: %s", plan["name"], e, exc_info=True)
+            StageTimer().record("batch", "client_error" if getattr(e, "status_code", 500) < 500 else "error")
+            report.update(status="failed", error=str(getattr(e, "detail", e)))
+            return index, report
+        timer.lot_kinds = [] # already counted by the shared conversion
+        timer.record("batch")
+        report["pages"] = timer.pages
+        if timer.optimization is not None:
+            report["optimization"] = timer.optimization
+        if plan["key"] is not None:
+            await run_in_threadpool(result_cache.store, plan["key"], plan["path"])
+    else:
+        StageTimer().record("batch", "cache_hit")
+    report["bytes"] = os.path.getsize(plan["path"])
+    return index, report
+
+
+async def stream_batch_zip(plans: List[dict], tasks: List[asyncio.Future], scratch: ScratchDir):
+    """Yield a ZIP of the batch outputs in the order they finish, then batch.json.
+
+    batch.json lists every output with its status, so a failed output does
+    not abort the archive. Owns the batch's pipeline slot and scratch
+    directory, both released once every output is done, even if the client
+    went away.
+    """
+    loop = asyncio.get_running_loop()
+
+    def finished(_):
+        pipeline.release()
+        loop.run_in_executor(None, scratch.release)
+
+    buffer = ZipStreamBuffer()
+    reports = [None] * len(tasks)
+    try:
+        with zipfile.ZipFile(buffer, "w", allowZip64=True) as archive:
+            for next_finished in asyncio.as_completed(tasks):
+                index, report = await next_finished
+                reports[index] = report
+                if report["status"] != "done":
+                    continue
+                chunks = zip_member_chunks(archive, buffer, plans[index]["path"], report["name"])
+                with closing(chunks):
+                    while True:
+                        chunk = await run_in_threadpool(next, chunks, None)
+                        if chunk is None:
+                            break
+                        yield chunk
+            await run_in_threadpool(archive.writestr, "batch.json", json.dumps({"outputs": reports}, indent=2))
+            await run_in_threadpool(archive.close) # writes the central directory
+        yield buffer.take()
+    finally:
+        asyncio.gather(*tasks, return_exceptions=True).add_done_callback(finished)
+
+
+@app.post("/batches")
+async def create_batch(request: Request, delivery: str = "zip", optimize: bool = OPTIMIZE_OUTPUT,
+                       _ = Depends(check_authentication)):
+    # Multipart body: a `manifest` field (see parse_batch_manifest) plus any
+    # number of `files` parts. Every distinct input is received, checked out
+    # and converted once for all outputs, and every master is parsed once;
+    # the outputs are then merged on the batch's pipeline slot plus any
+    # worker that is idle (see BatchSlots). delivery=zip streams Tenders.zip
+    # as outputs finish; delivery=links keeps them in batch_store and
+    # answers with download links.
+    # ?optimize=true optimizes every output; each report lists its savings.
+    if delivery not in ("zip", "links"):
+        raise HTTPException(status_code=400, detail="delivery must be zip or links.")
+    scratch = temp_storage.create(request_scratch_bytes(request))
+    temp_dir_path = scratch.path
+    try:
+        pipeline.acquire()
+    except HTTPException:
+        scratch.release()
+        raise
+    handed_off = False
+    batch_id = None
+    try:
+        ingest = await ingest_multipart(request, temp_dir_path)
+        outputs = parse_batch_manifest(ingest.field("manifest"))
+        inputs = await resolve_batch_inputs(ingest, outputs, temp_dir_path)
+        await run_in_threadpool(scratch.fit, await run_in_threadpool(batch_scratch_bytes, inputs, outputs))
+        if delivery == "links":
+            batch_id = await run_in_threadpool(batch_store.create)
+
+        plans = []
+        for index, output in enumerate(outputs):
+            plan = {
+                "name": output["name"],
+                "master": inputs[output["master"]],
+                "lots": [inputs[ref] for ref in output["lots"]],
+                "path": batch_store.output_path(batch_id, index) if batch_id
+                        else os.path.join(temp_dir_path, f"output{index:03d}.pdf"),
+                "key": None,
+                "cached": False,
+                "optimize": optimize,
+            }
+            # Outputs already in the result cache need no conversion at all.
+            if result_cache.enabled:
+                plan["key"] = await run_in_threadpool(result_cache_key, plan["master"][2], plan["lots"], optimize)
+                cached_pdf_path = await run_in_threadpool(result_cache.fetch, plan["key"], temp_dir_path)
+                metrics.inc("tender_result_cache_total", result="miss" if cached_pdf_path is None else "hit")
+                if cached_pdf_path is not None:
+                    await run_in_threadpool(shutil.move, cached_pdf_path, plan["path"])
+                    plan["cached"] = True
+            plans.append(plan)
+
+        # Lots with the same type and content are converted once, whatever their names.
+        distinct_lots = {}
+        for plan in plans:
+            if not plan["cached"]:
+                for filename, path, content_hash in plan["lots"]:
+                    distinct_lots.setdefault((kind_from_filename(filename), content_hash), (filename, path, content_hash))
+        lot_pdf_paths = {}
+        if distinct_lots:
+            pdf_paths, conversion_timer = await pipeline.run(convert_batch_lots, list(distinct_lots.values()), temp_dir_path)
+            conversion_timer.record_conversions()
+            metrics.observe("tender_stage_seconds", conversion_timer.seconds["convert"], stage="convert")
+            lot_pdf_paths = dict(zip(distinct_lots, pdf_paths))
+        logging.info("Batch of %s outputs: %s distinct inputs, %s lots to convert", len(plans), len(inputs), len(distinct_lots))
+
+        master_paths = sorted({plan["master"][1] for plan in plans if not plan["cached"]})
+        master_snapshots = {}
+        if master_paths and MERGE_ENGINE == "paged":
+            master_snapshots = dict(zip(master_paths, await pipeline.run(spool_batch_masters, master_paths, temp_dir_path)))
+        for plan in plans:
+            plan["master_snapshot"] = master_snapshots.get(plan["master"][1])
+
+        slots = BatchSlots(pipeline)
+        tasks = [
+            asyncio.ensure_future(build_batch_output(index, plan, lot_pdf_paths, slots)) for index, plan in enumerate(plans)
+        ]
+        if delivery == "zip":
+            handed_off = True
+            return StreamingResponse(
+                stream_batch_zip(plans, tasks, scratch),
+                media_type="application/zip",
+                headers={"Content-Disposition": 'attachment; filename="Tenders.zip"'},
+            )
+
+        reports = [report for _, report in await asyncio.gather(*tasks)]
+        for index, report in enumerate(reports):
+            if report["status"] == "done":
+                report["url"] = f"/batches/{batch_id}/outputs/{index}"
+        batch = {"batch_id": batch_id, "expires_at": time.time() + BATCH_TTL_SECONDS, "outputs": reports}
+        await run_in_threadpool(batch_store.save, batch_id, batch)
+        return batch
+    except HTTPException:
+        if batch_id is not None:
+            await run_in_threadpool(batch_store.delete, batch_id)
         raise
     except Exception as e:
-        logging.error(f"Error during PDF generation: {e}", exc_info=True)
-        
+        logging.error("Error during batch generation: %s", e, exc_info=True)
+        if batch_id is not None:
+            await run_in_threadpool(batch_store.delete, batch_id)
         raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
-    
+    finally:
+        if not handed_off:
+            pipeline.release()
+            await run_in_threadpool(scratch.release)
+
+
+@app.get("/batches/{batch_id}")
+async def get_batch(batch_id: str, _ = Depends(check_authentication)):
+    batch = await run_in_threadpool(batch_store.get, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired batch: {batch_id}")
+    return batch
+
+
+@app.get("/batches/{batch_id}/outputs/{index}")
+async def get_batch_output(batch_id: str, index: int, _ = Depends(check_authentication)):
+    batch = await run_in_threadpool(batch_store.get, batch_id)
+    if batch is None or not 0 <= index < len(batch["outputs"]) or batch["outputs"][index]["status"] != "done":
+        raise HTTPException(status_code=404, detail="Unknown batch output.")
+    return FileResponse(
+        path=batch_store.output_path(batch_id, index),
+        media_type="application/pdf",
+        filename=batch["outputs"][index]["name"],
+    )
+
+
+@app.delete("/batches/{batch_id}")
+async def delete_batch(batch_id: str, _ = Depends(check_authentication)):
+    if not await run_in_threadpool(batch_store.delete, batch_id):
+        raise HTTPException(status_code=404, detail=f"Unknown batch: {batch_id}")
+    return {"deleted": batch_id}
+
+
+def job_status(job: dict) -> dict:
+    response = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "lots": [{"filename": lot["filename"], "state": lot["state"]} for lot in job["lots"]],
+    }
+    if job["finished_at"] is not None:
+        response["expires_at"] = job["finished_at"] + JOB_TTL_SECONDS
+    if job["error"]:
+        response["error"] = job["error"]
+    if job["status"] == "done":
+        response["result_url"] = f"/jobs/{job['id']}/result"
+    return response
+
+
+@app.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(request: Request, _ = Depends(check_authentication)):
+    # Same form fields as /upload; the tender is built by a job worker.
+    if await run_in_threadpool(job_store.count_queued) >= JOB_MAX_QUEUED:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many tenders are queued, please retry later.",
+            headers={"Retry-After": str(PIPELINE_RETRY_AFTER)},
+        )
+
+    job_id = secrets.token_hex(16)
+    job_dir = job_store.job_dir(job_id)
+    os.makedirs(job_dir)
+    try:
+        master_path, _, lot_paths, _ = await ingest_tender_inputs(request, job_dir)
+        await run_in_threadpool(job_store.create, job_id, master_path, lot_paths)
+    except BaseException:
+        await run_in_threadpool(shutil.rmtree, job_dir, True)
+        raise
+
+    job_runner.ensure_started()
+    job_runner.wake()
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, _ = Depends(check_authentication)):
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job: {job_id}")
+    return job_status(job)
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, _ = Depends(check_authentication)):
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job: {job_id}")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job['status']}, no result to download.")
+    return FileResponse(path=job["result_path"], media_type="application/pdf", filename="Tender.pdf")
+
+
+metrics.collector("tender_pipeline_in_flight", "Tenders admitted to the pipeline (running or waiting).",
+                  lambda: [({}, pipeline.admitted)])
+metrics.collector("tender_pipeline_capacity", "Tenders the pipeline admits before answering 503.",
+                  lambda: [({}, pipeline.capacity)])
+metrics.collector("tender_jobs", "Background jobs, by status.",
+                  lambda: [({"status": job_status_name}, count) for job_status_name, count in job_store.count_by_status().items()])
+metrics.collector("tender_pandoc_worker_events_total", "Pandoc worker conversions, failures, timeouts and recycles.",
+                  lambda: [({"event": event}, pandoc_service.stats()[event]) for event in ("conversions", "failures", "timeouts", "recycled")],
+                  kind="counter")
+metrics.collector("tender_temp_bytes", "Bytes on disk, by area.", lambda: [
+    ({"area": "jobs"}, directory_bytes(JOBS_DIR)),
+    ({"area": "conversion_cache"}, directory_bytes(CACHE_DIR)),
+    ({"area": "result_cache"}, directory_bytes(RESULT_CACHE_DIR)),
+    ({"area": "masters"}, directory_bytes(MASTERS_DIR)),
+] + temp_storage.usage())
+
+
+@app.get("/warmup")
+async def warmup_endpoint():
+    # For deploy hooks and schedulers keeping a serverless instance warm, so
+    # like /metrics it needs no login cookie. Only the first call does any
+    # work; once the instance is warm, calls return without leaving the loop.
+    if warmed_up.is_set():
+        return {"imported": [], "seconds": 0.0}
+    return await run_in_threadpool(warmup)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Prometheus scrapes without the login cookie; set TENDER_METRICS=0 to hide it.
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    body = await run_in_threadpool(metrics.render)
+    return Response(content=body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 
 #if __name__ == "__main__":
 
@@ -5,8 +5,12 @@ a = Analysis(
     ['tender.py'],
     pathex=[],
     binaries=[],
-    datas=[('static', 'static')],
-    hiddenimports=[],
+    datas=[('static', 'static'), ('templates', 'templates')],
+    hiddenimports=[
+        'PIL.Image', 'PyPDF2', 'PyPDF2.generic', 'pypandoc', # loaded lazily, see LazyModule
+        'pikepdf', 'brotli', # optional, imported inside functions (optimize, frontend)
+        'python_multipart', 'python_multipart.multipart', 'multipart', 'multipart.multipart', # see tenderflow/ingest.py
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1 @@
+"""TenderFlow's subsystems; api/tender.py wires them into the FastAPI app."""
@@ -0,0 +1,291 @@
+"""Batch generation: several tenders sharing their uploads and conversions."""
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Tuple
+from contextlib import asynccontextmanager, closing
+from functools import cached_property
+import asyncio
+import json
+import re
+import shutil
+import time
+import os
+import zipfile
+import logging
+from pathlib import Path
+import secrets
+from .config import BATCH_MAX_OUTPUTS, BATCH_TTL_SECONDS, BATCHES_DIR, STREAM_CHUNK_BYTES
+from .metrics import metrics, StageTimer
+from .masters import MASTER_ID_PATTERN, master_library
+from .ingest import MultipartIngest
+from .uploads import upload_sessions
+from .merge import PagedMerger
+from .pipeline import conversion_scheduler, PipelineError, PipelineStage
+
+
+BATCH_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+BATCH_OUTPUT_NAME_PATTERN = re.compile(r"^[\w][\w .()-]{0,99}$")
+
+
+def parse_batch_manifest(raw: Optional[str]) -> List[dict]:
+    """Validate a batch manifest; returns its outputs as {"name", "master", "lots"}.
+
+    The manifest is JSON: {"outputs": [{"name": "Tender-A.pdf", "master": ref,
+    "lots": [ref, ...]}, ...]}. A ref is the filename of a `files` part,
+    "upload:<upload_id>" for a finalized resumable upload or, for masters
+    only, "master:<master_id>" for a registered master.
+    """
+    try:
+        outputs = json.loads(raw or "")["outputs"]
+        if not isinstance(outputs, list):
+            raise TypeError()
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="manifest must be JSON with an outputs list.")
+    if not 0 < len(outputs) <= BATCH_MAX_OUTPUTS:
+        raise HTTPException(status_code=400, detail=f"A batch needs between 1 and {BATCH_MAX_OUTPUTS} outputs.")
+    parsed, names = [], set()
+    for output in outputs:
+        if not isinstance(output, dict):
+            raise HTTPException(status_code=400, detail="Every manifest output must be an object.")
+        name, master, lots = output.get("name"), output.get("master"), output.get("lots")
+        if not isinstance(name, str) or not BATCH_OUTPUT_NAME_PATTERN.match(name):
+            raise HTTPException(status_code=400, detail=f"Invalid output name: {name!r}")
+        if not name.lower().endswith(".pdf"):
+            name += ".pdf"
+        if name in names:
+            raise HTTPException(status_code=400, detail=f"Duplicate output name: {name}")
+        names.add(name)
+        if not isinstance(master, str) or not isinstance(lots, list) or not lots \
+                or not all(isinstance(lot, str) for lot in lots):
+            raise HTTPException(status_code=400, detail=f"{name} needs a master and at least one lot.")
+        parsed.append({"name": name, "master": master, "lots": lots})
+    return parsed
+
+
+async def resolve_batch_inputs(ingest: MultipartIngest, outputs: List[dict], dest_dir: str):
+    """Map manifest refs onto ingested files, each checked out once.
+
+    Returns {ref: (filename, path, sha256)} for every master and lot ref.
+    """
+    parts = {}
+    for ingested in ingest.files_for("files"):
+        if ingested.filename in parts:
+            raise HTTPException(status_code=400, detail=f"Two files parts are named {ingested.filename}.")
+        parts[ingested.filename] = ingested
+    for ingested in ingest.files:
+        metrics.inc("tender_input_bytes_total", ingested.size, kind=ingested.kind)
+
+    inputs = {}
+    masters = {output["master"] for output in outputs}
+    for index, ref in enumerate(sorted(masters | {lot for output in outputs for lot in output["lots"]})):
+        if ref.startswith("master:"):
+            master_id = ref[len("master:"):]
+            if ref not in masters:
+                raise HTTPException(status_code=400, detail=f"{ref} can only be used as a master.")
+            path = os.path.join(dest_dir, f"master-{index:03d}.pdf")
+            if not MASTER_ID_PATTERN.match(master_id) or \
+                    not await run_in_threadpool(master_library.checkout, master_id, path):
+                raise HTTPException(status_code=404, detail=f"Unknown master_id: {master_id}")
+            inputs[ref] = (f"{master_id}.pdf", path, master_id) # master ids are content hashes
+            continue
+        if ref.startswith("upload:"):
+            ingested = await run_in_threadpool(upload_sessions.checkout, ref[len("upload:"):], dest_dir, f"upload{index:03d}")
+        elif ref in parts:
+            ingested = parts[ref]
+        else:
+            raise HTTPException(status_code=400, detail=f"The manifest refers to a missing file: {ref}")
+        if ref in masters and ingested.kind != "pdf":
+            raise HTTPException(status_code=400, detail=f"Master file must be a PDF: {ref}")
+        inputs[ref] = (ingested.filename, ingested.path, ingested.sha256)
+    return inputs
+
+
+def convert_batch_lots(lot_paths: List[Tuple[str, str, Optional[str]]], dest_dir: str) -> Tuple[List[str], StageTimer]:
+    """Convert every lot to a PDF of its own inside dest_dir; PDF lots are used as they are.
+
+    Runs inside the pipeline executor. Returns the PDF paths in lot order and
+    the conversion timings.
+    """
+    timer = StageTimer()
+    pdf_paths = [None] * len(lot_paths)
+    started = time.perf_counter()
+    try:
+        with closing(conversion_scheduler.convert_lots(lot_paths, timer, batch_images=False)) as converted_lots:
+            for (index,), lot_pdf_path, converted in converted_lots:
+                if converted:
+                    pdf_paths[index] = os.path.join(dest_dir, f"converted{index:03d}.pdf")
+                    shutil.move(lot_pdf_path, pdf_paths[index])
+                else:
+                    pdf_paths[index] = lot_pdf_path
+    except HTTPException as e:
+        raise PipelineError(e.status_code, str(e.detail)) from None
+    timer.add("convert", time.perf_counter() - started)
+    return pdf_paths, timer
+
+
+def spool_batch_masters(master_paths: List[str], dest_dir: str) -> List[Optional[dict]]:
+    """Parse every master once into a PagedMerger snapshot that the outputs built on it start from.
+
+    Runs inside the pipeline executor. A master that cannot be read gets
+    None, so only the outputs using it fail, when they read it themselves.
+    """
+    snapshots = []
+    for index, master_path in enumerate(master_paths):
+        merger = PagedMerger(spool_dir=dest_dir)
+        try:
+            merger.append(master_path)
+            snapshots.append(merger.snapshot(os.path.join(dest_dir, f"master{index:03d}.spool")))
+        except Exception as e:
+            logging.warning("Could not spool master %s: %s", Path(master_path).name, e)
+            snapshots.append(None)
+        finally:
+            merger.close()
+    return snapshots
+
+
+class BatchSlots:
+    """Pipeline slots for the outputs of one batch.
+
+    The batch is admitted with a single slot, which always has one of its
+    outputs running. Further outputs only start on pipeline workers that
+    are idle at that moment, and hand the slot back as soon as they are
+    done, so a batch never runs more outputs than there are free workers
+    and never makes /upload requests wait behind it.
+    """
+    def __init__(self, stage: PipelineStage):
+        self.stage = stage
+        self._own_slot_free = True
+        self._changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def output(self):
+        async with self._changed:
+            while True:
+                own_slot = self._own_slot_free
+                if own_slot or self.stage.try_acquire_idle():
+                    break
+                await self._changed.wait()
+            if own_slot:
+                self._own_slot_free = False
+        try:
+            yield
+        finally:
+            if own_slot:
+                self._own_slot_free = True
+            else:
+                self.stage.release()
+            async with self._changed:
+                self._changed.notify_all()
+
+
+class ZipStreamBuffer:
+    """Write-only file object that zipfile writes a streamed archive into.
+
+    It has no seek(), so zipfile writes each member's sizes in a data
+    descriptor after the data and never goes back; take() hands over what
+    was written since the last call.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def zip_member_chunks(archive: zipfile.ZipFile, buffer: ZipStreamBuffer, pdf_path: str, name: str):
+    """Add pdf_path to archive as name, yielding buffer.take() after every chunk.
+
+    Blocking; the response steps through it with run_in_threadpool(next, ...).
+    """
+    member = zipfile.ZipInfo.from_file(pdf_path, name)
+    # PDFs are compressed already; store them as they are.
+    with open(pdf_path, "rb") as pdf_file, \
+            archive.open(member, "w", force_zip64=member.file_size > zipfile.ZIP64_LIMIT) as entry:
+        while True:
+            chunk = pdf_file.read(STREAM_CHUNK_BYTES)
+            if not chunk:
+                break
+            entry.write(chunk)
+            yield buffer.take()
+
+
+class BatchStore:
+    """Outputs of ?delivery=links batches, kept for download until they expire.
+
+    Each batch is a directory holding `batch.json` (the report returned to
+    the client) and one PDF per output, named by its position in the manifest.
+    """
+    EXPIRE_EVERY_SECONDS = 300
+
+    def __init__(self, directory: str, ttl_seconds: int):
+        self._directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._last_expiry = 0.0
+
+    @cached_property
+    def directory(self) -> str:
+        os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+    def _dir(self, batch_id: str) -> str:
+        return os.path.join(self.directory, batch_id)
+
+    def output_path(self, batch_id: str, index: int) -> str:
+        return os.path.join(self._dir(batch_id), f"{index:03d}.pdf")
+
+    def create(self) -> str:
+        self._expire_if_due()
+        batch_id = secrets.token_hex(16)
+        os.makedirs(self._dir(batch_id))
+        return batch_id
+
+    def save(self, batch_id: str, report: dict):
+        with open(os.path.join(self._dir(batch_id), "batch.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f)
+
+    def get(self, batch_id: str) -> Optional[dict]:
+        if not BATCH_ID_PATTERN.match(batch_id):
+            return None
+        try:
+            with open(os.path.join(self._dir(batch_id), "batch.json"), encoding="utf-8") as f:
+                report = json.load(f)
+        except FileNotFoundError:
+            return None
+        return report if report["expires_at"] > time.time() else None
+
+    def delete(self, batch_id: str) -> bool:
+        if not BATCH_ID_PATTERN.match(batch_id) or not os.path.isdir(self._dir(batch_id)):
+            return False
+        shutil.rmtree(self._dir(batch_id), ignore_errors=True)
+        return True
+
+    def _expire_if_due(self):
+        now = time.monotonic()
+        if now - self._last_expiry < self.EXPIRE_EVERY_SECONDS:
+            return
+        self._last_expiry = now
+        cutoff = time.time() - self.ttl_seconds
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    logging.info("Expired batch %s", entry.name)
+            except FileNotFoundError:
+                continue
+
+
+batch_store = BatchStore(BATCHES_DIR, BATCH_TTL_SECONDS)
@@ -0,0 +1,179 @@
+"""Content-addressed caches of converted lots and of finished tenders."""
+from typing import List, Optional, Tuple
+from contextlib import contextmanager
+from functools import cached_property
+import hashlib
+import shutil
+import time
+import os
+import tempfile
+import threading
+import logging
+try:
+    import fcntl
+except ImportError: # Windows builds (see initTender.spec) have no flock
+    fcntl = None
+from .lazy import PIL
+from .config import (
+    CACHE_DIR, CACHE_MAX_BYTES, IMAGE_BATCH_SIZE, IMAGE_JPEG_QUALITY, IMAGE_MAX_DPI, MERGE_ENGINE,
+    RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL,
+)
+from .ingest import kind_from_filename
+from .optimize import OPTIMIZER_SETTINGS
+
+
+def converter_settings() -> dict:
+    """Tag per converter; bump one whenever its output changes so stale entries miss.
+
+    A function so that reading Pillow's version waits until a lot is converted.
+    """
+    return {
+        "image": f"image-v2-pil{PIL.__version__}-dpi{IMAGE_MAX_DPI}-q{IMAGE_JPEG_QUALITY}",
+        "docx": "docx-v1-pandoc-pdf",
+    }
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source: str, dest: str):
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
+
+
+class ConversionCache:
+    """Content-addressed on-disk cache of converted lot PDFs.
+
+    Entries are named after sha256(converter settings + source bytes) and are
+    written with an atomic rename, so several uvicorn workers can share one
+    directory. Hits are handed out as hard links, which keeps them valid even
+    if another worker evicts the entry mid-merge. Recency is tracked through
+    the file mtime and the oldest entries are evicted once the directory
+    grows past max_bytes, or once unused for ttl_seconds (if set).
+    """
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: int = 0):
+        self._directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @cached_property
+    def directory(self) -> str:
+        if self.enabled:
+            os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def key_for(self, kind: str, content_hashes: List[str]) -> str:
+        """Key for converting the given inputs (in order) into one PDF."""
+        return hashlib.sha256(f"{converter_settings()[kind]}:{':'.join(content_hashes)}".encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def _expired(self, mtime: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - mtime > self.ttl_seconds
+
+    def fetch(self, key: str, dest_dir: str = None):
+        """Return a private temporary copy of the cached PDF, or None on a miss."""
+        entry_path = self._entry_path(key)
+        fd, dest = tempfile.mkstemp(suffix=".pdf", dir=dest_dir)
+        os.close(fd)
+        os.unlink(dest)
+        try:
+            if self._expired(os.stat(entry_path).st_mtime):
+                raise FileNotFoundError(entry_path) # evict() will remove it
+            link_or_copy(entry_path, dest)
+            os.utime(entry_path) # mark as recently used
+        except FileNotFoundError:
+            if os.path.exists(dest):
+                os.unlink(dest)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return dest
+
+    def store(self, key: str, pdf_path: str):
+        entry_path = self._entry_path(key)
+        staging_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            link_or_copy(pdf_path, staging_path)
+            os.replace(staging_path, entry_path)
+        except OSError as e:
+            logging.warning("Could not store conversion cache entry %s: %s", key, e)
+            if os.path.exists(staging_path):
+                os.unlink(staging_path)
+            return
+        with self._lock:
+            self.stores += 1
+        self.evict()
+
+    @contextmanager
+    def _exclusive(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, ".lock"), "a", encoding="utf-8") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def evict(self):
+        with self._exclusive():
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".pdf"):
+                    try:
+                        stat_result = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat_result.st_mtime, stat_result.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_bytes and not self._expired(mtime):
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions}
+
+
+conversion_cache = ConversionCache(CACHE_DIR, CACHE_MAX_BYTES)
+result_cache = ConversionCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL)
+
+
+def result_cache_key(master_sha256: str, lot_paths: List[Tuple[str, str, Optional[str]]], optimize: bool = False) -> str:
+    """Key (and ETag) of the tender built from these inputs, in this order, with the current settings."""
+    converters = converter_settings()
+    settings = f"tender-v1:{MERGE_ENGINE}:batch{IMAGE_BATCH_SIZE}:{converters['image']}:{converters['docx']}"
+    if optimize:
+        settings += f":{OPTIMIZER_SETTINGS}"
+    lots = ":".join(
+        f"{kind_from_filename(filename)}-{content_hash or file_sha256(path)}" for filename, path, content_hash in lot_paths
+    )
+    return hashlib.sha256(f"{settings}:{master_sha256}:{lots}".encode()).hexdigest()
@@ -0,0 +1,146 @@
+"""Settings, read once from TENDER_* environment variables at import."""
+import os
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPLOAD_FOLDER = os.path.join(APP_DIR, "uploads")
+STATIC_DIR = os.path.join(APP_DIR, "static")
+TEMPLATES_DIR = os.path.join(APP_DIR, "templates")
+
+
+# --- Pipeline execution settings ---
+# "thread" or "process": where the conversion+merge pipeline runs.
+PIPELINE_EXECUTOR = os.environ.get("TENDER_PIPELINE_EXECUTOR", "thread")
+# How many tenders may be converted/merged at the same time.
+PIPELINE_WORKERS = int(os.environ.get("TENDER_PIPELINE_WORKERS", "2"))
+# How many further requests may wait for a free worker before we answer 503.
+PIPELINE_QUEUE_DEPTH = int(os.environ.get("TENDER_PIPELINE_QUEUE_DEPTH", "4"))
+# Seconds suggested to the client in the Retry-After header when saturated.
+PIPELINE_RETRY_AFTER = int(os.environ.get("TENDER_PIPELINE_RETRY_AFTER", "5"))
+# "paged" copies one input at a time to a spool file (bounded memory);
+# "merger" is PyPDF2's PdfMerger, which holds every input until write().
+MERGE_ENGINE = os.environ.get("TENDER_MERGE_ENGINE", "paged")
+# Processes used to convert image lots in parallel.
+CONVERSION_WORKERS = int(os.environ.get("TENDER_CONVERSION_WORKERS", str(os.cpu_count() or 2)))
+# Upper bound on pandoc (and its PDF engine) processes running at once.
+PANDOC_CONCURRENCY = int(os.environ.get("TENDER_PANDOC_CONCURRENCY", "2"))
+# Scans whose embedded DPI exceeds this are downsampled to it (0 disables).
+IMAGE_MAX_DPI = int(os.environ.get("TENDER_IMAGE_MAX_DPI", "300"))
+# JPEG quality for images that have to be re-encoded (PNG, downsampled scans).
+IMAGE_JPEG_QUALITY = int(os.environ.get("TENDER_IMAGE_JPEG_QUALITY", "75"))
+# Consecutive image lots written together as pages of one PDF.
+IMAGE_BATCH_SIZE = int(os.environ.get("TENDER_IMAGE_BATCH_SIZE", "16"))
+# Run DOCX conversions on PANDOC_CONCURRENCY long-lived worker interpreters
+# with pypandoc already imported; pandoc and LaTeX still start per file.
+PANDOC_SERVICE = os.environ.get("TENDER_PANDOC_SERVICE", "1") == "1"
+# Seconds a single DOCX conversion may take before its worker is killed.
+PANDOC_TIMEOUT = float(os.environ.get("TENDER_PANDOC_TIMEOUT", "120"))
+# Conversions served by one worker before it is replaced.
+PANDOC_RECYCLE_AFTER = int(os.environ.get("TENDER_PANDOC_RECYCLE_AFTER", "50"))
+# Run one throwaway DOCX->PDF conversion per worker to prime LaTeX/font caches.
+PANDOC_WARMUP = os.environ.get("TENDER_PANDOC_WARMUP", "1") == "1"
+
+# --- Conversion cache settings ---
+CACHE_DIR = os.environ.get("TENDER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tenderflow", "conversions"))
+# Size cap for cached PDFs; 0 disables the cache.
+CACHE_MAX_BYTES = int(os.environ.get("TENDER_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Finished Tender.pdf files, keyed by the ordered input hashes and settings.
+RESULT_CACHE_DIR = os.environ.get("TENDER_RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tenderflow", "results"))
+# Size cap for cached tenders; 0 disables the result cache.
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("TENDER_RESULT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Cached tenders not requested for this many seconds are dropped.
+RESULT_CACHE_TTL = int(os.environ.get("TENDER_RESULT_CACHE_TTL", str(24 * 3600)))
+
+# Registered master PDFs, reusable across /upload calls by master_id.
+MASTERS_DIR = os.environ.get("TENDER_MASTERS_DIR", os.path.join(UPLOAD_FOLDER, "masters"))
+
+# --- Upload limits ---
+MAX_FILE_BYTES = int(os.environ.get("TENDER_MAX_FILE_BYTES", str(512 * 1024 * 1024)))
+MAX_REQUEST_BYTES = int(os.environ.get("TENDER_MAX_REQUEST_BYTES", str(2 * 1024 * 1024 * 1024)))
+MAX_FIELD_BYTES = 64 * 1024
+
+# --- Streamed output ---
+# Send Tender.pdf while it is being serialized unless ?stream= says otherwise.
+STREAM_OUTPUT = os.environ.get("TENDER_STREAM_OUTPUT", "0") == "1"
+STREAM_CHUNK_BYTES = 256 * 1024
+# Chunks buffered between the PDF writer and a slow client.
+STREAM_QUEUE_CHUNKS = 16
+
+# --- Scratch storage ---
+# Per-request working directories (uploads, converted lots, outputs) are created here.
+TEMP_ROOT = os.environ.get("TENDER_TEMP_DIR", os.path.join(tempfile.gettempdir(), "tenderflow", "work"))
+# RAM-backed (tmpfs) directory for small requests; empty keeps everything on disk.
+TEMP_RAM_ROOT = os.environ.get("TENDER_TEMP_RAM_DIR", "/dev/shm/tenderflow" if os.path.isdir("/dev/shm") else "")
+# Requests expected to need at most this much scratch space start in RAM...
+TEMP_RAM_JOB_BYTES = int(os.environ.get("TENDER_TEMP_RAM_JOB_BYTES", str(32 * 1024 * 1024)))
+# ...while all RAM-backed requests of this process stay under this total.
+TEMP_RAM_MAX_BYTES = int(os.environ.get("TENDER_TEMP_RAM_MAX_BYTES", str(256 * 1024 * 1024)))
+# Disk scratch space one process may reserve before new requests get a 503 (0: unlimited).
+TEMP_QUOTA_BYTES = int(os.environ.get("TENDER_TEMP_QUOTA_BYTES", "0"))
+# Scratch space expected per uploaded byte: the inputs, converted lots and the output.
+TEMP_BYTES_PER_INPUT_BYTE = 3
+# Once the inputs are on disk: bytes of converted PDF per input byte, by kind
+# (pandoc's PDFs carry fonts, so short DOCX files grow the most).
+TEMP_CONVERTED_BYTES_PER_INPUT_BYTE = {"pdf": 1, "image": 1, "docx": 4}
+
+# --- Output optimization ---
+# Run the size optimization pass after merging unless ?optimize= says otherwise (jobs always follow this).
+OPTIMIZE_OUTPUT = os.environ.get("TENDER_OPTIMIZE", "0") == "1"
+# Images with more pixels than this resolution needs to cover their page are downsampled (0 disables).
+OPTIMIZE_IMAGE_DPI = int(os.environ.get("TENDER_OPTIMIZE_IMAGE_DPI", "150"))
+# JPEG quality for images the optimization pass re-encodes.
+OPTIMIZE_JPEG_QUALITY = int(os.environ.get("TENDER_OPTIMIZE_JPEG_QUALITY", "75"))
+# Linearize optimized tenders for fast web view.
+OPTIMIZE_LINEARIZE = os.environ.get("TENDER_OPTIMIZE_LINEARIZE", "1") == "1"
+
+# --- Background jobs ---
+JOBS_DIR = os.environ.get("TENDER_JOBS_DIR", os.path.join(UPLOAD_FOLDER, "jobs"))
+# Job worker threads per server process.
+JOB_WORKERS = int(os.environ.get("TENDER_JOB_WORKERS", "1"))
+# Finished jobs (and their Tender.pdf) are kept this long.
+JOB_TTL_SECONDS = int(os.environ.get("TENDER_JOB_TTL_SECONDS", str(24 * 3600)))
+# Jobs waiting beyond this count make POST /jobs answer 503.
+JOB_MAX_QUEUED = int(os.environ.get("TENDER_JOB_MAX_QUEUED", "100"))
+# A running job without a heartbeat for this long is assumed orphaned and requeued.
+JOB_STALE_SECONDS = int(os.environ.get("TENDER_JOB_STALE_SECONDS", "900"))
+# Running jobs refresh their heartbeat this often, however long a single lot takes.
+JOB_HEARTBEAT_SECONDS = max(1, JOB_STALE_SECONDS // 3)
+
+# --- Tender projects ---
+PROJECTS_DIR = os.environ.get("TENDER_PROJECTS_DIR", os.path.join(UPLOAD_FOLDER, "projects"))
+# Incremental updates appended to a project's Tender.pdf before it is rewritten from scratch.
+PROJECT_MAX_UPDATES = int(os.environ.get("TENDER_PROJECT_MAX_UPDATES", "20"))
+
+# --- Batch generation ---
+BATCHES_DIR = os.environ.get("TENDER_BATCHES_DIR", os.path.join(UPLOAD_FOLDER, "batches"))
+# Outputs of ?delivery=links batches stay downloadable this long.
+BATCH_TTL_SECONDS = int(os.environ.get("TENDER_BATCH_TTL_SECONDS", str(24 * 3600)))
+# Output documents allowed in one batch manifest.
+BATCH_MAX_OUTPUTS = int(os.environ.get("TENDER_BATCH_MAX_OUTPUTS", "50"))
+
+# --- Resumable uploads ---
+UPLOAD_SESSIONS_DIR = os.environ.get("TENDER_UPLOAD_SESSIONS_DIR", os.path.join(UPLOAD_FOLDER, "sessions"))
+# Upload sessions (finished or not) untouched for this long are deleted.
+UPLOAD_SESSION_TTL = int(os.environ.get("TENDER_UPLOAD_SESSION_TTL", str(24 * 3600)))
+# Suggested chunk size returned to clients when a session is created.
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+
+# --- Metrics ---
+# Record per-stage timings and counters for GET /metrics; 0 turns recording off.
+METRICS_ENABLED = os.environ.get("TENDER_METRICS", "1") == "1"
+# Add a Server-Timing header with the stage durations to /upload responses.
+SERVER_TIMING = os.environ.get("TENDER_SERVER_TIMING", "0") == "1"
+
+# --- Front-end pages ---
+# Seconds browsers may show the cached login page without revalidating it.
+PAGE_MAX_AGE = int(os.environ.get("TENDER_PAGE_MAX_AGE", "300"))
+# Seconds browsers keep versioned static assets (/static/...?v=<content hash>).
+STATIC_MAX_AGE = int(os.environ.get("TENDER_STATIC_MAX_AGE", str(365 * 24 * 3600)))
+
+# --- Startup ---
+# Serverless mode (default under Vercel): no job runner threads or pandoc
+# workers at startup; the first request that needs them starts them.
+LAZY_STARTUP = os.environ.get("TENDER_LAZY_STARTUP", "1" if os.environ.get("VERCEL") else "0") == "1"
+# Run warmup() in the background right after startup, so the first tender does
+# not pay for importing the PDF/image/DOCX stacks and starting pandoc workers.
+WARMUP_ON_STARTUP = os.environ.get("TENDER_WARMUP", "0" if LAZY_STARTUP else "1") == "1"
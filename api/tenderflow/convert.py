@@ -0,0 +1,124 @@
+"""Image and DOCX lots converted to PDF."""
+from fastapi import HTTPException
+from typing import List
+import io
+import shutil
+import os
+from pathlib import Path
+from .lazy import Image, pypandoc
+from .config import IMAGE_JPEG_QUALITY, IMAGE_MAX_DPI
+from .scratch import converted_pdf_path
+from .pandoc import pandoc_service
+
+
+PDF_COLORSPACES = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"}
+
+
+def _image_page(image_path: str):
+    """Return (dict entries, data source, pixel size, page size) for one image.
+
+    Baseline JPEGs in a PDF-compatible colour space are embedded as-is
+    (DCTDecode passthrough: the file is never decoded). Everything else is
+    decoded once and re-encoded as JPEG, like PIL's own PDF writer does.
+    Pages keep PIL's 72 dpi geometry (one point per source pixel); scans
+    whose DPI exceeds IMAGE_MAX_DPI are downsampled inside that page.
+    """
+    with Image.open(image_path) as img:
+        page_size = img.size
+        scale = 1.0
+        dpi = img.info.get("dpi")
+        if IMAGE_MAX_DPI and dpi and max(dpi) > IMAGE_MAX_DPI:
+            scale = IMAGE_MAX_DPI / float(max(dpi))
+        target_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+
+        if img.format == "JPEG" and scale == 1.0 and img.mode in PDF_COLORSPACES:
+            entries = f"/ColorSpace {PDF_COLORSPACES[img.mode]} /BitsPerComponent 8 /Filter /DCTDecode"
+            if img.mode == "CMYK" and "adobe" in img.info:
+                entries += " /Decode [1 0 1 0 1 0 1 0]" # Adobe stores CMYK JPEGs inverted
+            return entries, image_path, img.size, page_size
+
+        if img.format == "JPEG":
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale straight away.
+            img.draft("RGB" if img.mode != "L" else "L", target_size)
+        if img.mode not in ("L", "RGB"):
+            img = img.convert("RGB") # RGBA, P, CMYK, ... (alpha is dropped as before)
+        if img.size != target_size:
+            img = img.resize(target_size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=IMAGE_JPEG_QUALITY)
+        entries = f"/ColorSpace {PDF_COLORSPACES[img.mode]} /BitsPerComponent 8 /Filter /DCTDecode"
+        return entries, buffer.getvalue(), img.size, page_size
+
+
+def convert_images_to_pdf(image_paths: List[str]) -> str:
+    """Write every image as one page of a single new PDF, in one pass.
+
+    JPEG payloads are copied from disk in chunks, so memory stays flat
+    even for large scans.
+    """
+    output_path = converted_pdf_path(image_paths[0])
+    offsets = {}
+    page_ids = [3 + 3 * index + 2 for index in range(len(image_paths))]
+    try:
+        with open(output_path, "wb") as out:
+            def begin(obj_id):
+                offsets[obj_id] = out.tell()
+                out.write(f"{obj_id} 0 obj\n".encode())
+
+            out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+            for index, image_path in enumerate(image_paths):
+                image_id, content_id, page_id = 3 + 3 * index, 4 + 3 * index, 5 + 3 * index
+                entries, data, (width, height), (page_width, page_height) = _image_page(image_path)
+
+                length = os.path.getsize(data) if isinstance(data, str) else len(data)
+                begin(image_id)
+                out.write(f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} {entries} /Length {length} >>\nstream\n".encode())
+                if isinstance(data, str):
+                    with open(data, "rb") as source:
+                        shutil.copyfileobj(source, out, 1024 * 1024)
+                else:
+                    out.write(data)
+                out.write(b"\nendstream\nendobj\n")
+
+                content = f"q {page_width} 0 0 {page_height} 0 0 cm /Im0 Do Q".encode()
+                begin(content_id)
+                out.write(f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream\nendobj\n")
+
+                begin(page_id)
+                out.write(
+                    f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] "
+                    f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>\nendobj\n".encode()
+                )
+
+            begin(1)
+            out.write(b"<< /Type /Catalog /Pages 2 0 R >>\nendobj\n")
+            begin(2)
+            kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+            out.write(f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>\nendobj\n".encode())
+
+            xref_offset = out.tell()
+            object_count = max(offsets) + 1
+            out.write(f"xref\n0 {object_count}\n0000000000 65535 f \n".encode())
+            for obj_id in range(1, object_count):
+                out.write(f"{offsets[obj_id]:010d} 00000 n \n".encode())
+            out.write(f"trailer\n<< /Size {object_count} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+    except BaseException:
+        os.unlink(output_path)
+        raise
+    return output_path
+
+
+def convert_image_to_pdf(image_path):
+    return convert_images_to_pdf([image_path])
+
+def convert_word_to_pdf(docx_path):
+    output_path = converted_pdf_path(docx_path)
+    try:
+        if not (pandoc_service.enabled and pandoc_service.convert(docx_path, output_path)):
+            pypandoc.convert_file(docx_path, 'pdf', outputfile=output_path)
+        return output_path
+    except Exception as e:
+        
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+        raise HTTPException(status_code=500, detail=f"Word to PDF conversion failed for {Path(docx_path).name}: {e}")
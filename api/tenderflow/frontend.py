@@ -0,0 +1,153 @@
+"""Login and upload pages, pre-rendered and pre-compressed, and the static assets."""
+from fastapi import Request, status, Response
+from fastapi.responses import HTMLResponse
+from fastapi.staticfiles import StaticFiles
+from typing import Optional
+import gzip
+import hashlib
+import re
+import os
+import threading
+from urllib.parse import parse_qs
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+try:
+    import brotli
+except ImportError: # pages are then served gzip-compressed only
+    brotli = None
+from .config import STATIC_DIR, STATIC_MAX_AGE, TEMPLATES_DIR
+
+
+def preferred_encoding(accept_encoding: str, available) -> str:
+    """Content coding to send for an Accept-Encoding header: the highest q-value wins, br before gzip before identity."""
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        params = params.strip().lower()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding] = weight
+
+    def weight_of(coding):
+        if coding == "identity": # always acceptable, but only preferred when listed
+            return weights.get("identity", weights.get("*", 0.001))
+        return weights.get(coding, weights.get("*", 0.0))
+
+    candidates = [coding for coding in ("br", "gzip") if coding in available] + ["identity"]
+    best = max(candidates, key=weight_of) # max keeps the first of equal weights
+    return best if weight_of(best) > 0 else "identity"
+
+
+class RenderedPage:
+    """A page rendered once, kept as bytes next to its compressed variants, each with its own strong ETag."""
+
+    def __init__(self, body: bytes):
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.variants = {"identity": (body, f'"{digest}"')}
+        compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body, quality=11)
+        for coding, data in compressed.items():
+            if len(data) < len(body):
+                self.variants[coding] = (data, f'"{digest}-{coding}"')
+
+
+class PageCache:
+    """Renders the templates in TEMPLATES_DIR once and answers page requests from memory."""
+
+    # name -> (template, context)
+    PAGES = {
+        "login": ("login.html", {"title": "Login - Tender Generator", "error": None}),
+        "login_failed": ("login.html", {"title": "Login Failed", "error": "Invalid username or password"}),
+        "upload": ("upload.html", {"title": "Tender Generator"}),
+    }
+    FONTS_URL = "https://fonts.googleapis.com/css2?family=Montserrat:wght@400;700&family=Roboto:wght@400;500;700&display=swap"
+
+    def __init__(self, templates_dir: str, static_dir: str):
+        self.static_dir = static_dir
+        self.env = Environment(loader=FileSystemLoader(templates_dir), autoescape=select_autoescape(["html"]))
+        self.env.globals["static_url"] = self.static_url
+        self._asset_versions = {}
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def asset_version(self, name: str) -> str:
+        """Hash of a file in STATIC_DIR, read once per process."""
+        version = self._asset_versions.get(name)
+        if version is None:
+            with open(os.path.join(self.static_dir, name), "rb") as f:
+                version = hashlib.sha256(f.read()).hexdigest()[:12]
+            self._asset_versions[name] = version
+        return version
+
+    def static_url(self, name: str) -> str:
+        """URL of a file in STATIC_DIR that changes with its content, so it can be cached for good."""
+        return f"/static/{name}?v={self.asset_version(name)}"
+
+    def render_all(self):
+        for name in self.PAGES:
+            self.get(name)
+
+    def get(self, name: str) -> RenderedPage:
+        page = self._pages.get(name)
+        if page is None:
+            with self._lock:
+                page = self._pages.get(name)
+                if page is None:
+                    template, context = self.PAGES[name]
+                    page_class = template.split(".")[0] + "-page"
+                    html = self.env.get_template(template).render(
+                        page_class=page_class, fonts_url=self.FONTS_URL, **context)
+                    page = self._pages[name] = RenderedPage(html.encode("utf-8"))
+        return page
+
+    def response(self, request: Request, name: str, cache_control: str, status_code: int = 200) -> Response:
+        page = self.get(name)
+        coding = preferred_encoding(request.headers.get("accept-encoding", ""), page.variants)
+        body, etag = page.variants[coding]
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if status_code == 200 and etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return HTMLResponse(body, status_code=status_code, headers=headers)
+
+
+class StaticAssets(StaticFiles):
+    """StaticFiles that lets browsers keep versioned URLs (see PageCache.static_url) for STATIC_MAX_AGE.
+
+    Only a v= matching the file's current hash counts; any other URL is
+    revalidated.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        versions = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("v")
+        if versions == [pages.asset_version(self.get_path(scope).replace(os.sep, "/"))]:
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+        else:
+            response.headers["Cache-Control"] = "public, no-cache"
+        return response
+
+
+pages = PageCache(TEMPLATES_DIR, STATIC_DIR)
+
+
+ENTITY_TAG_PATTERN = re.compile(r'(?:W/)?("[^"]*")')
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match calls for: W/"x" and "x" match each other.
+
+    "*" is not honoured: it would answer any new upload with a 304.
+    """
+    if not if_none_match:
+        return False
+    opaque_tag = ENTITY_TAG_PATTERN.match(etag).group(1)
+    return opaque_tag in ENTITY_TAG_PATTERN.findall(if_none_match)
@@ -0,0 +1,236 @@
+"""Streaming multipart ingestion: parts go straight to disk and are sniffed on the way."""
+from fastapi import Request, HTTPException
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Tuple
+import hashlib
+import os
+import logging
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError: # older python-multipart releases
+    from multipart.multipart import MultipartParser, parse_options_header
+from .config import MAX_FIELD_BYTES, MAX_FILE_BYTES, MAX_REQUEST_BYTES
+
+
+def is_image(filename): return filename.lower().endswith((".jpg", ".jpeg", ".png"))
+def is_word(filename): return filename.lower().endswith(".docx")
+def is_pdf(filename): return filename.lower().endswith(".pdf")
+
+
+SNIFF_BYTES = 1024
+# Part data buffered before it is handed to a worker thread to be written.
+INGEST_FLUSH_BYTES = 1024 * 1024
+
+
+def sniff_file_kind(head: bytes) -> Optional[str]:
+    """Classify a file by its magic bytes: "pdf", "image", "docx" or None."""
+    if b"%PDF-" in head[:SNIFF_BYTES]: # the spec tolerates junk before the header
+        return "pdf"
+    if head.startswith(b"\xff\xd8\xff") or head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image"
+    if head.startswith(b"PK\x03\x04"): # DOCX is a ZIP container
+        return "docx"
+    return None
+
+
+def kind_from_filename(filename: str) -> Optional[str]:
+    if is_pdf(filename):
+        return "pdf"
+    if is_image(filename):
+        return "image"
+    if is_word(filename):
+        return "docx"
+    return None
+
+
+class IngestedFile:
+    def __init__(self, field_name: str, filename: str, path: str):
+        self.field_name = field_name
+        self.filename = filename
+        self.path = path
+        self.size = 0
+        self.sha256 = None
+        self.kind = None
+
+
+class MultipartIngest:
+    """Parses a multipart body straight off the socket into dest_dir.
+
+    Each file part is written exactly once, to its final place in the job
+    directory, and its sha256 is updated on the way. The parser only sniffs
+    the first bytes and buffers the data; writing and hashing happen in
+    the thread pool, INGEST_FLUSH_BYTES at a time, so the event loop never
+    blocks on the disk. Size limits and type mismatches abort the request
+    as soon as they are seen.
+    """
+    FILE_FIELDS = {"master_file": "pdf", "lot_files": None, "files": None} # files: batch inputs
+
+    def __init__(self, dest_dir: str, boundary: bytes, max_file_bytes: int = MAX_FILE_BYTES,
+                 max_request_bytes: int = MAX_REQUEST_BYTES):
+        self.dest_dir = dest_dir
+        self.max_file_bytes = max_file_bytes
+        self.max_request_bytes = max_request_bytes
+        self.request_bytes = 0
+        self.fields = {}
+        self.files = []
+        self.parts = [] # (field name, str value or IngestedFile), in body order
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._part = None
+        self._pending = [] # (IngestedFile, chunk, or None at the part's end), not yet written
+        self._pending_bytes = 0
+        self._file = None # of the part being written by _write
+        self._digest = None
+        self._head = b""
+        self._field_name = None
+        self._field_value = None
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def field(self, name: str) -> Optional[str]:
+        values = self.fields.get(name)
+        return values[0] if values else None
+
+    def files_for(self, field_name: str) -> List[IngestedFile]:
+        return [f for f in self.files if f.field_name == field_name]
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._part = None
+        self._field_name = None
+        self._field_value = None
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        field_name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" not in options:
+            self._field_name = field_name
+            self._field_value = b""
+            return
+        if field_name not in self.FILE_FIELDS:
+            return # unknown file fields are drained, not stored
+
+        filename = os.path.basename(options[b"filename"].decode("utf-8", "replace").replace("\\", "/"))
+        if not filename:
+            logging.warning("Skipping a %s part with no filename.", field_name)
+            return
+        if self.FILE_FIELDS[field_name] is None and kind_from_filename(filename) is None:
+            logging.error("Unsupported file type: %s", filename)
+            raise HTTPException(status_code=400, detail=f"Unsupported file type: {filename}")
+
+        path = os.path.join(self.dest_dir, f"{len(self.files):03d}-{filename}")
+        self._part = IngestedFile(field_name, filename, path)
+        self._head = b""
+
+    def _check_kind(self):
+        part = self._part
+        part.kind = sniff_file_kind(self._head)
+        expected = self.FILE_FIELDS[part.field_name] or kind_from_filename(part.filename)
+        if part.kind != expected:
+            if part.field_name == "master_file":
+                raise HTTPException(status_code=400, detail="Master file must be a PDF and have a filename.")
+            raise HTTPException(status_code=400, detail=f"{part.filename} does not look like a {expected.upper()} file.")
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._field_value is not None:
+            self._field_value += data[start:end]
+            if len(self._field_value) > MAX_FIELD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Form field {self._field_name} is too large.")
+            return
+        if self._part is None:
+            return
+
+        chunk = data[start:end]
+        self._part.size += len(chunk)
+        if self._part.size > self.max_file_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"{self._part.filename} exceeds the {self.max_file_bytes} byte per-file limit.",
+            )
+        if self._part.kind is None and len(self._head) < SNIFF_BYTES:
+            self._head += chunk[:SNIFF_BYTES - len(self._head)]
+            if len(self._head) >= SNIFF_BYTES:
+                self._check_kind()
+        self._pending.append((self._part, chunk))
+        self._pending_bytes += len(chunk)
+
+    def _on_part_end(self):
+        if self._field_value is not None:
+            value = self._field_value.decode("utf-8", "replace")
+            self.fields.setdefault(self._field_name, []).append(value)
+            self.parts.append((self._field_name, value))
+            self._field_value = None
+            return
+        if self._part is None:
+            return
+        if self._part.kind is None:
+            self._check_kind()
+        self._pending.append((self._part, None))
+        self.files.append(self._part)
+        self.parts.append((self._part.field_name, self._part))
+        self._part = None
+
+    def _write(self, pending: List[Tuple[IngestedFile, Optional[bytes]]]):
+        """Write and hash buffered part data; runs in the thread pool, one call at a time."""
+        for part, chunk in pending:
+            if self._file is None:
+                self._file = open(part.path, "wb")
+                self._digest = hashlib.sha256()
+            if chunk is None:
+                self._file.close()
+                self._file = None
+                part.sha256 = self._digest.hexdigest()
+            else:
+                self._digest.update(chunk)
+                self._file.write(chunk)
+
+    async def _flush(self):
+        pending, self._pending, self._pending_bytes = self._pending, [], 0
+        await run_in_threadpool(self._write, pending)
+
+    async def consume(self, request: Request):
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_request_bytes:
+            raise HTTPException(status_code=413, detail=f"Request exceeds the {self.max_request_bytes} byte limit.")
+        try:
+            async for chunk in request.stream():
+                self.request_bytes += len(chunk)
+                if self.request_bytes > self.max_request_bytes:
+                    raise HTTPException(status_code=413, detail=f"Request exceeds the {self.max_request_bytes} byte limit.")
+                self._parser.write(chunk)
+                if self._pending_bytes >= INGEST_FLUSH_BYTES:
+                    await self._flush()
+            self._parser.finalize()
+            if self._pending:
+                await self._flush()
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        return self
+
+
+async def ingest_multipart(request: Request, dest_dir: str) -> MultipartIngest:
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload.")
+    return await MultipartIngest(dest_dir, options[b"boundary"]).consume(request)
@@ -0,0 +1,282 @@
+"""Background tender jobs queued in SQLite."""
+from typing import List, Optional, Tuple
+from contextlib import contextmanager, closing
+from functools import cached_property
+import json
+import shutil
+import sqlite3
+import time
+import os
+import threading
+import logging
+from .config import JOB_HEARTBEAT_SECONDS, JOB_STALE_SECONDS, JOB_TTL_SECONDS, JOB_WORKERS, JOBS_DIR, OPTIMIZE_OUTPUT
+from .metrics import metrics, StageTimer
+from .cache import file_sha256, result_cache, result_cache_key
+from .pipeline import build_tender_pdf, pipeline, PipelineError, PipelineStage
+
+
+class JobStore:
+    """SQLite-backed queue of tender jobs shared by every server process.
+
+    Each job owns JOBS_DIR/<job_id>/ holding its inputs and, once done,
+    Tender.pdf. Rows carry the per-lot progress as JSON. Workers claim jobs
+    with a single UPDATE inside an IMMEDIATE transaction, so two uvicorn
+    workers never pick the same job.
+    """
+    def __init__(self, directory: str):
+        self._directory = directory
+
+    @cached_property
+    def directory(self) -> str:
+        os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+    @cached_property
+    def db_path(self) -> str:
+        path = os.path.join(self.directory, "jobs.sqlite3")
+        with closing(sqlite3.connect(path, timeout=30, isolation_level=None)) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    master_path TEXT NOT NULL,
+                    lots TEXT NOT NULL,
+                    error TEXT,
+                    result_path TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    finished_at REAL
+                )"""
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        return path
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.directory, job_id)
+
+    def count_queued(self) -> int:
+        with closing(self._connect()) as db:
+            return db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def count_by_status(self) -> dict:
+        with closing(self._connect()) as db:
+            return dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def create(self, job_id: str, master_path: str, lot_paths: List[Tuple[str, str, Optional[str]]]):
+        lots = [
+            {"filename": filename, "path": path, "sha256": sha256, "state": "received"}
+            for filename, path, sha256 in lot_paths
+        ]
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, master_path, lots, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, master_path, json.dumps(lots), now, now),
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["lots"] = json.loads(job["lots"])
+        return job
+
+    def claim(self) -> Optional[dict]:
+        """Atomically take the oldest queued (or orphaned running) job."""
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND updated_at < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (now - JOB_STALE_SECONDS,),
+                ).fetchone()
+                if row is not None:
+                    db.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (now, row["id"]))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return self.get(row["id"]) if row is not None else None
+
+    def heartbeat(self, job_id: str):
+        with closing(self._connect()) as db:
+            db.execute("UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running'", (time.time(), job_id))
+
+    def set_lot_state(self, job_id: str, lots: List[dict], index: int, state: str):
+        lots[index]["state"] = state
+        with closing(self._connect()) as db:
+            db.execute("UPDATE jobs SET lots = ?, updated_at = ? WHERE id = ?", (json.dumps(lots), time.time(), job_id))
+
+    def finish(self, job_id: str, result_path: str = None, error: str = None):
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result_path = ?, error = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+                ("failed" if error else "done", result_path, error, now, now, job_id),
+            )
+
+    def expire(self, ttl_seconds: int) -> int:
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (time.time() - ttl_seconds,),
+            ).fetchall()
+            for row in rows:
+                shutil.rmtree(self.job_dir(row["id"]), ignore_errors=True)
+                db.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+        return len(rows)
+
+
+class JobRunner:
+    """Worker threads that run queued jobs independently of any request.
+
+    A job builds on the runner's own thread but holds a slot of stage while
+    it does, taken only when a pipeline worker is idle (like the extra
+    outputs of a batch), so requests and jobs together stay within
+    TENDER_PIPELINE_WORKERS.
+    """
+    POLL_SECONDS = 2.0
+    SLOT_POLL_SECONDS = 0.2
+    EXPIRE_EVERY_SECONDS = 300
+
+    def __init__(self, store: JobStore, workers: int, stage: PipelineStage):
+        self.store = store
+        self.workers = max(1, workers)
+        self.stage = stage
+        self._threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._last_expiry = 0.0
+
+    def ensure_started(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._loop, name=f"tender-job-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            self._threads = []
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self._expire_if_due()
+                # Leave the job to another server process while this one's pipeline is busy.
+                job = self.store.claim() if self.stage.admitted < self.stage.workers else None
+            except Exception as e:
+                logging.error("Job queue error: %s", e, exc_info=True)
+                job = None
+            if job is None:
+                self._wake.wait(self.POLL_SECONDS)
+                self._wake.clear()
+                continue
+            with self._heartbeat(job["id"]):
+                self.run_job(job)
+
+    @contextmanager
+    def _heartbeat(self, job_id: str):
+        """Refresh the job's updated_at while it runs, so claim() only takes over jobs of dead workers."""
+        done = threading.Event()
+
+        def beat():
+            while not done.wait(JOB_HEARTBEAT_SECONDS):
+                try:
+                    self.store.heartbeat(job_id)
+                except Exception as e:
+                    logging.warning("Heartbeat for job %s failed: %s", job_id, e)
+
+        thread = threading.Thread(target=beat, name=f"tender-job-heartbeat-{job_id[:8]}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    @contextmanager
+    def _pipeline_slot(self):
+        while not self.stage.try_acquire_idle():
+            time.sleep(self.SLOT_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            self.stage.release()
+
+    def _expire_if_due(self):
+        now = time.monotonic()
+        if now - self._last_expiry >= self.EXPIRE_EVERY_SECONDS:
+            self._last_expiry = now
+            expired = self.store.expire(JOB_TTL_SECONDS)
+            if expired:
+                logging.info("Expired %s finished jobs", expired)
+
+    def run_job(self, job: dict):
+        job_id = job["id"]
+        lots = job["lots"]
+        lot_paths = [(lot["filename"], lot["path"], lot["sha256"]) for lot in lots]
+        output_pdf_path = os.path.join(self.store.job_dir(job_id), "Tender.pdf")
+        logging.info("Running job %s with %s lots", job_id, len(lots))
+
+        def progress(index: int, state: str):
+            self.store.set_lot_state(job_id, lots, index, state)
+
+        try:
+            timer = None
+            result_key = result_cache_key(file_sha256(job["master_path"]), lot_paths, OPTIMIZE_OUTPUT) if result_cache.enabled else None
+            cached_pdf_path = result_cache.fetch(result_key, self.store.job_dir(job_id)) if result_key else None
+            if cached_pdf_path is not None:
+                metrics.inc("tender_result_cache_total", result="hit")
+                os.replace(cached_pdf_path, output_pdf_path)
+                for index in range(len(lots)):
+                    progress(index, "merged")
+            else:
+                if result_key is not None:
+                    metrics.inc("tender_result_cache_total", result="miss")
+                with self._pipeline_slot():
+                    timer = build_tender_pdf(job["master_path"], lot_paths, output_pdf_path, progress, OPTIMIZE_OUTPUT)
+                if result_key is not None:
+                    result_cache.store(result_key, output_pdf_path)
+        except PipelineError as e:
+            StageTimer().record("job", "client_error" if e.status_code < 500 else "error")
+            self.store.finish(job_id, error=e.detail)
+        except Exception as e:
+            logging.error("Job %s failed: %s", job_id, e, exc_info=True)
+            StageTimer().record("job", "error")
+            self.store.finish(job_id, error=f"An internal error occurred: {str(e)}")
+        else:
+            if timer is not None:
+                timer.record("job")
+            else:
+                StageTimer().record("job", "cache_hit")
+            self.store.finish(job_id, result_path=output_pdf_path)
+            logging.info("Job %s done", job_id)
+        finally:
+            # Only Tender.pdf is kept for download.
+            for path in [job["master_path"]] + [path for _, path, _ in lot_paths]:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+job_store = JobStore(JOBS_DIR)
+job_runner = JobRunner(job_store, JOB_WORKERS, pipeline)
@@ -0,0 +1,36 @@
+"""Modules imported on first use, so cold starts skip the PDF, image and DOCX stacks."""
+import importlib
+import sys
+
+
+class LazyModule:
+    """Stands in for a module global until an attribute is first read.
+
+    The module is imported then and every module global still bound to the
+    stand-in is rebound to it, so later lookups cost nothing extra. Keeps the
+    PDF, image and DOCX stacks out of processes (and cold starts) that only
+    serve the login page.
+    """
+
+    def __init__(self, name: str, alias: str):
+        self._name = name
+        self._alias = alias
+
+    def _load(self):
+        module = importlib.import_module(self._name)
+        for namespace in list(sys.modules.values()):
+            namespace_globals = getattr(namespace, "__dict__", None)
+            if namespace_globals is not None and namespace_globals.get(self._alias) is self:
+                namespace_globals[self._alias] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+PIL = LazyModule("PIL", "PIL")
+Image = LazyModule("PIL.Image", "Image")
+PyPDF2 = LazyModule("PyPDF2", "PyPDF2")
+generic = LazyModule("PyPDF2.generic", "generic")
+pypandoc = LazyModule("pypandoc", "pypandoc")
+LAZY_MODULES = (PIL, Image, PyPDF2, generic, pypandoc)
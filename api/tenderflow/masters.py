@@ -0,0 +1,169 @@
+"""Library of master PDFs uploaded once and reused by ID."""
+from typing import List, Optional
+from functools import cached_property
+import json
+import re
+import os
+import logging
+from pathlib import Path
+from .config import MASTERS_DIR
+from .cache import file_sha256, link_or_copy
+from .merge import PagedMerger
+
+
+MASTER_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def spool_master(pdf_path: str, spool_path: str) -> dict:
+    """Parse a master into a PagedMerger snapshot saved at spool_path; returns the snapshot."""
+    merger = PagedMerger(spool_dir=os.path.dirname(spool_path))
+    try:
+        merger.append(pdf_path)
+        return merger.snapshot(spool_path)
+    finally:
+        merger.close()
+
+
+def snapshot_to_json(snapshot: dict) -> dict:
+    return {
+        **{key: value for key, value in snapshot.items() if key != "path"},
+        "offsets": {str(obj_id): offset for obj_id, offset in snapshot["offsets"].items()},
+        "dedup": {digest.hex(): obj_id for digest, obj_id in snapshot["dedup"].items()},
+    }
+
+
+def snapshot_from_json(data: dict, path: str) -> dict:
+    return {
+        **data,
+        "path": path,
+        "offsets": {int(obj_id): offset for obj_id, offset in data["offsets"].items()},
+        "dedup": {bytes.fromhex(digest): obj_id for digest, obj_id in data["dedup"].items()},
+    }
+
+
+class MasterLibrary:
+    """Stores master PDFs once so later /upload calls can refer to them by ID.
+
+    A master's ID is the sha256 of its bytes, so registering the same file
+    twice is a no-op. Next to every `<id>.pdf` sits an `<id>.json` holding
+    its metadata (filename, size, page count), and the master parsed once at
+    registration: `<id>.spool` with the objects as PagedMerger wrote them and
+    `<id>.spool.json` with the rest of the snapshot. Merges start from that
+    snapshot instead of reading the PDF again.
+    """
+    def __init__(self, directory: str):
+        self._directory = directory
+
+    @cached_property
+    def directory(self) -> str:
+        os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+    def _pdf_path(self, master_id: str) -> str:
+        return os.path.join(self.directory, f"{master_id}.pdf")
+
+    def _metadata_path(self, master_id: str) -> str:
+        return os.path.join(self.directory, f"{master_id}.json")
+
+    def _spool_path(self, master_id: str) -> str:
+        return os.path.join(self.directory, f"{master_id}.spool")
+
+    def _write_json(self, path: str, data: dict):
+        staged_path = f"{path}.{os.getpid()}.tmp"
+        with open(staged_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(staged_path, path)
+
+    def _save_snapshot(self, master_id: str, pdf_path: str) -> dict:
+        # The spool is in place before its JSON, which is what checkout looks for.
+        staged_spool_path = f"{self._spool_path(master_id)}.{os.getpid()}.tmp"
+        snapshot = spool_master(pdf_path, staged_spool_path)
+        os.replace(staged_spool_path, self._spool_path(master_id))
+        self._write_json(f"{self._spool_path(master_id)}.json", snapshot_to_json(snapshot))
+        return snapshot
+
+    def _load_snapshot(self, master_id: str, spool_path: str) -> Optional[dict]:
+        try:
+            with open(f"{self._spool_path(master_id)}.json", encoding="utf-8") as f:
+                return snapshot_from_json(json.load(f), spool_path)
+        except FileNotFoundError:
+            return None
+
+    def register(self, staged_pdf_path: str, filename: str, master_id: str = None) -> dict:
+        """Move a staged upload into the library and return its metadata."""
+        master_id = master_id or file_sha256(staged_pdf_path)
+        existing = self.get(master_id)
+        if existing is not None:
+            os.unlink(staged_pdf_path)
+            return existing
+
+        try:
+            snapshot = self._save_snapshot(master_id, staged_pdf_path)
+        except Exception:
+            os.unlink(staged_pdf_path)
+            raise
+        metadata = {
+            "pages": sum(len(document["pages"]) for document in snapshot["documents"]),
+            "master_id": master_id,
+            "filename": filename,
+            "size": os.path.getsize(staged_pdf_path),
+        }
+        os.replace(staged_pdf_path, self._pdf_path(master_id))
+        self._write_json(self._metadata_path(master_id), metadata)
+        logging.info("Registered master %s as %s (%s pages)", filename, master_id, metadata["pages"])
+        return metadata
+
+    def get(self, master_id: str) -> Optional[dict]:
+        if not MASTER_ID_PATTERN.match(master_id):
+            return None
+        try:
+            with open(self._metadata_path(master_id), encoding="utf-8") as f:
+                metadata = json.load(f)
+        except FileNotFoundError:
+            return None
+        metadata.pop("object_offsets", None) # kept by masters registered before the snapshots
+        return metadata
+
+    def list(self) -> List[dict]:
+        masters = []
+        for entry in sorted(Path(self.directory).glob("*.json")):
+            metadata = self.get(entry.stem)
+            if metadata is not None:
+                masters.append(metadata)
+        return masters
+
+    def checkout(self, master_id: str, dest_path: str) -> Optional[dict]:
+        """Link a registered master and its spool into a job directory.
+
+        Returns the master's PagedMerger snapshot, pointing at the linked
+        spool next to dest_path, or None if the master is unknown. The job
+        works on its own links, so deleting the master mid-merge is safe.
+        """
+        if self.get(master_id) is None:
+            return None
+        spool_path = f"{dest_path}.spool"
+        try:
+            link_or_copy(self._pdf_path(master_id), dest_path)
+            snapshot = self._load_snapshot(master_id, spool_path)
+            if snapshot is None:
+                # Registered before masters were spooled: parse it this once.
+                snapshot = self._save_snapshot(master_id, dest_path)
+                snapshot["path"] = spool_path
+            link_or_copy(self._spool_path(master_id), spool_path)
+        except FileNotFoundError:
+            return None
+        return snapshot
+
+    def delete(self, master_id: str) -> bool:
+        if self.get(master_id) is None:
+            return False
+        spool_path = self._spool_path(master_id)
+        for path in (self._metadata_path(master_id), f"{spool_path}.json", spool_path, self._pdf_path(master_id)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        return True
+
+
+master_library = MasterLibrary(MASTERS_DIR)
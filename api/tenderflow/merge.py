@@ -0,0 +1,451 @@
+"""PDF merge engines: the paged merger and PyPDF2's PdfMerger."""
+from typing import List, Tuple, Union
+import copy
+import hashlib
+import io
+import shutil
+import tempfile
+import logging
+from pathlib import Path
+from .lazy import generic, PyPDF2
+from .config import MERGE_ENGINE
+from .scratch import temp_storage
+
+
+class PagedMerger:
+    """Drop-in for the parts of PdfMerger we use, with memory bounded per input.
+
+    append() copies a document's pages, and everything they reference, into
+    an anonymous spool file straight away and then forgets the document; the
+    reader's object cache is cleared after every page. Objects are written
+    children first, so a font, image or other resource whose bytes (with
+    renumbered references) were already written is reused instead of
+    copied. write() emits the header, the spool, then the page tree,
+    outline, named destinations, form, catalog and xref. Bookmarks, named
+    destinations and form fields are carried over. A destination name or
+    top-level field name that an earlier document already uses gets a
+    "-2", "-3", ... suffix, and the document's own links follow the
+    rename. Other document-level structures (tags, scripts) are not kept.
+
+    write_update() instead appends the spool to an existing output as a PDF
+    incremental update (see TenderProjects), with first_id continuing that
+    file's object numbering and reserved listing the documents already in
+    it, whose names new documents must not reuse.
+
+    snapshot() saves what was appended so far (say, a master shared by a
+    batch) to a file; a merger created with base=<that snapshot> starts
+    from there and writes the saved objects out without parsing them again.
+
+    stream_to() sends the header and everything appended so far to a file
+    object, and later appends write their objects straight to it instead of
+    the spool; write() into that same file object then only adds the page
+    tree, catalog, xref and trailer.
+    """
+    HEADER = b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n"
+    CATALOG_ID = 1
+    PAGES_ID = 2
+    DEST_KEYS = ("/Dest", "/D") # of link annotations and GoTo actions
+
+    def __init__(self, spool_dir: str = None, first_id: int = 3, base: dict = None, reserved: List[dict] = None):
+        self._spool = tempfile.TemporaryFile(dir=spool_dir or temp_storage.root)
+        self._offsets = {} # object id -> offset inside the base file and the spool
+        self._next_id = first_id
+        self._dedup = {} # sha256 of an object's bytes -> object id
+        self.duplicates = 0 # objects replaced by an identical one already written
+        # One entry per append(): {"pages": [page object ids], "outline": [[title, page id, dest args, children]],
+        # "dests": [[name, page id, dest args]], "form": None or {"fields": [[field id, title]], "dr", "da", "need_appearances"}}
+        self.documents = []
+        self._reserved = reserved or []
+        self._dest_renames = {} # destination name as the current document's links give it -> name in the output
+        self._field_titles = {} # (idnum, generation) of a renamed top-level field -> its new /T
+        self._base = base
+        self._stream = None # see stream_to()
+        if base is not None:
+            self._offsets = dict(base["offsets"])
+            self._next_id = base["next_id"]
+            self._dedup = dict(base["dedup"])
+            self.documents = copy.deepcopy(base["documents"])
+
+    @property
+    def pages(self) -> List[int]:
+        return [page_id for document in self.documents for page_id in document["pages"]]
+
+    @property
+    def next_id(self) -> int:
+        return self._next_id
+
+    @property
+    def _base_bytes(self) -> int:
+        return self._base["bytes"] if self._base is not None else 0
+
+    @property
+    def _body_bytes(self) -> int:
+        """Bytes of objects written so far, counted from the end of the header."""
+        if self._stream is not None:
+            return self._stream.tell() - len(self.HEADER)
+        return self._base_bytes + self._spool.tell()
+
+    def snapshot(self, path: str) -> dict:
+        """Save everything appended so far to path; returns the picklable base= for new mergers."""
+        if self._base is not None or self._stream is not None:
+            raise ValueError("only a merger started from scratch and not streaming can be snapshotted")
+        self._spool.seek(0)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(self._spool, f, 1024 * 1024)
+        return {
+            "path": path,
+            "bytes": self._spool.tell(),
+            "offsets": dict(self._offsets),
+            "next_id": self._next_id,
+            "dedup": dict(self._dedup),
+            "documents": copy.deepcopy(self.documents),
+        }
+
+    def _allocate(self) -> int:
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id: int, body: bytes):
+        self._offsets[obj_id] = self._body_bytes
+        (self._stream or self._spool).write(b"%d 0 obj\n" % obj_id + body + b"\nendobj\n")
+
+    def _copy_body(self, fileobj):
+        if self._base is not None:
+            with open(self._base["path"], "rb") as base:
+                shutil.copyfileobj(base, fileobj, 1024 * 1024)
+        self._spool.seek(0)
+        shutil.copyfileobj(self._spool, fileobj, 1024 * 1024)
+
+    def _serialize(self, obj, resolve) -> bytes:
+        if isinstance(obj, generic.IndirectObject):
+            return b"%d 0 R" % resolve(obj)
+        if isinstance(obj, generic.DictionaryObject):
+            items = b"".join(
+                b"%s %s\n" % (self._serialize(key, resolve), self._serialize(self._renamed(key, value), resolve))
+                for key, value in obj.items() if key != "/Length" or not isinstance(obj, generic.StreamObject)
+            )
+            if isinstance(obj, generic.StreamObject):
+                data = obj._data
+                return b"<<\n/Length %d\n%s>>\nstream\n%s\nendstream" % (len(data), items, data)
+            return b"<<\n" + items + b">>"
+        if isinstance(obj, generic.ArrayObject):
+            return b"[" + b" ".join(self._serialize(item, resolve) for item in obj) + b"]"
+        buffer = io.BytesIO()
+        obj.write_to_stream(buffer, None)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _name_text(obj) -> str:
+        return obj.decode("latin-1") if isinstance(obj, bytes) else str(obj)
+
+    def _renamed(self, key, value):
+        """value, or the output name of the named destination it refers to."""
+        if key in self.DEST_KEYS and self._dest_renames and isinstance(value, (str, bytes)):
+            name = self._dest_renames.get(self._name_text(value))
+            if name is not None:
+                return generic.TextStringObject(name)
+        return value
+
+    @staticmethod
+    def _unique(name: str, taken: set) -> str:
+        candidate, suffix = name, 2
+        while candidate in taken:
+            candidate, suffix = f"{name}-{suffix}", suffix + 1
+        taken.add(candidate)
+        return candidate
+
+    @classmethod
+    def _name_tree(cls, node, depth: int = 0):
+        """Yield the (key, value) pairs of a name tree."""
+        node = node.get_object()
+        names = node.get("/Names")
+        if names is not None:
+            names = names.get_object()
+            yield from zip(names[0::2], names[1::2])
+        kids = node.get("/Kids")
+        if kids is not None and depth < 32: # a deeper tree is a reference loop
+            for kid in kids.get_object():
+                yield from cls._name_tree(kid, depth + 1)
+
+    def _read_dests(self, root, memo) -> List[Tuple[str, str, int, str]]:
+        """(name as links give it, name, page id, dest args) of every named destination on a copied page."""
+        entries = []
+        names = root.get("/Names")
+        if names is not None and "/Dests" in names.get_object():
+            entries += list(self._name_tree(names.get_object()["/Dests"]))
+        legacy = root.get("/Dests") # PDF 1.1: a dictionary keyed by name objects
+        if legacy is not None:
+            entries += list(legacy.get_object().items())
+        dests = []
+        for key, value in entries:
+            value = value.get_object()
+            if isinstance(value, generic.DictionaryObject):
+                value = value.get("/D")
+                value = value.get_object() if value is not None else None
+            if not isinstance(value, generic.ArrayObject) or not value or not isinstance(value[0], generic.IndirectObject):
+                continue
+            page_id = memo.get((value[0].idnum, value[0].generation))
+            if page_id is None:
+                continue
+            text = self._name_text(key)
+            args = b" ".join(self._serialize(arg, None) for arg in value[1:]).decode("latin-1")
+            dests.append((text, text[1:] if isinstance(key, generic.NameObject) else text, page_id, args))
+        return dests
+
+    def _names_in_use(self) -> Tuple[set, set]:
+        """Destination names and top-level field names of the documents in the output so far."""
+        documents = self._reserved + self.documents
+        dests = {name for document in documents for name, _, _ in document.get("dests") or ()}
+        titles = {title for document in documents for _, title in (document.get("form") or {}).get("fields", ())}
+        return dests, titles
+
+    def append(self, fileobj):
+        """Copy every page of fileobj (a path) after the pages appended so far."""
+        with open(fileobj, "rb") as f:
+            reader = PyPDF2.PdfReader(f)
+            reader_pages = reader.pages
+            memo = {} # (idnum, generation) in this document -> output id
+            for page in reader_pages:
+                memo[(page.indirect_ref.idnum, page.indirect_ref.generation)] = self._allocate()
+            visiting = set()
+            root = reader.trailer["/Root"]
+            dest_names, field_titles = self._names_in_use()
+            # Names are settled before any page is copied, as links are rewritten while copying.
+            try:
+                dests = self._read_dests(root, memo)
+            except Exception as e: # broken destinations should not fail the tender
+                logging.warning("Skipping the named destinations of %s: %s", Path(fileobj).name, e)
+                dests = []
+            self._dest_renames = {}
+            for text, name, _, _ in dests:
+                if text not in self._dest_renames:
+                    self._dest_renames[text] = self._unique(name, dest_names)
+            try:
+                acroform = root.get("/AcroForm")
+                acroform = acroform.get_object() if acroform is not None else None
+                fields = [ref for ref in acroform.get("/Fields").get_object() if isinstance(ref, generic.IndirectObject)] \
+                    if acroform is not None and "/Fields" in acroform else []
+            except Exception as e:
+                logging.warning("Skipping the form of %s: %s", Path(fileobj).name, e)
+                acroform, fields = None, []
+            self._field_titles = {}
+            titles = {}
+            for ref in fields:
+                title = self._name_text(ref.get_object().get("/T", ""))
+                titles[(ref.idnum, ref.generation)] = self._unique(title, field_titles)
+                if titles[(ref.idnum, ref.generation)] != title:
+                    self._field_titles[(ref.idnum, ref.generation)] = titles[(ref.idnum, ref.generation)]
+
+            def resolve(ref: "generic.IndirectObject") -> int:
+                key = (ref.idnum, ref.generation)
+                obj_id = memo.get(key)
+                if obj_id is not None:
+                    return obj_id
+                if key in visiting:
+                    # A reference cycle: this object gets its id now and is not deduplicated.
+                    memo[key] = self._allocate()
+                    return memo[key]
+                visiting.add(key)
+                obj = ref.get_object()
+                if key in self._field_titles:
+                    obj = generic.DictionaryObject(obj)
+                    obj[generic.NameObject("/T")] = generic.TextStringObject(self._field_titles[key])
+                body = self._serialize(obj, resolve)
+                visiting.discard(key)
+                obj_id = memo.get(key)
+                if obj_id is None:
+                    digest = hashlib.sha256(body).digest()
+                    obj_id = self._dedup.get(digest)
+                    if obj_id is None:
+                        obj_id = self._dedup[digest] = self._allocate()
+                        self._write_object(obj_id, body)
+                    else:
+                        self.duplicates += 1
+                    memo[key] = obj_id
+                else:
+                    self._write_object(obj_id, body)
+                return obj_id
+
+            document = {"pages": [], "outline": [], "dests": [], "form": None}
+            for page in reader_pages:
+                # Inherited attributes were already pushed down by PdfReader; beads
+                # (/B) would drag in the whole article thread.
+                page_dict = generic.DictionaryObject(
+                    (key, value) for key, value in page.items() if key not in ("/Parent", "/B")
+                )
+                body = b"<<\n/Parent %d 0 R\n" % self.PAGES_ID + self._serialize(page_dict, resolve)[3:]
+                obj_id = memo[(page.indirect_ref.idnum, page.indirect_ref.generation)]
+                self._write_object(obj_id, body)
+                document["pages"].append(obj_id)
+                reader.resolved_objects.clear()
+
+            try:
+                document["outline"] = self._copy_outline(reader.outline, memo)
+            except Exception as e: # a broken outline should not fail the tender
+                logging.warning("Skipping the outline of %s: %s", Path(fileobj).name, e)
+            document["dests"] = [[self._dest_renames[text], page_id, args] for text, _, page_id, args in dests]
+            if fields:
+                document["form"] = {
+                    "fields": [[resolve(ref), titles[(ref.idnum, ref.generation)]] for ref in fields],
+                    "dr": self._serialize(acroform["/DR"], resolve).decode("latin-1") if "/DR" in acroform else None,
+                    "da": self._serialize(acroform["/DA"], resolve).decode("latin-1") if "/DA" in acroform else None,
+                    "need_appearances": acroform.get("/NeedAppearances") == generic.BooleanObject(True),
+                }
+            self._dest_renames, self._field_titles = {}, {}
+            reader.resolved_objects.clear()
+            self.documents.append(document)
+        if self._stream is not None:
+            self._stream.flush()
+
+    def stream_to(self, fileobj):
+        """Write the header and the objects appended so far to fileobj (which
+        needs write(), tell() and flush()) and send later objects there too."""
+        fileobj.write(self.HEADER)
+        self._copy_body(fileobj)
+        fileobj.flush()
+        self._stream = fileobj
+
+    def _copy_outline(self, items, memo) -> list:
+        nodes = []
+        for item in items:
+            if isinstance(item, list):
+                if nodes:
+                    nodes[-1][3].extend(self._copy_outline(item, memo))
+                continue
+            dest = item.dest_array
+            page_ref = dest[0]
+            if not isinstance(page_ref, generic.IndirectObject) or (page_ref.idnum, page_ref.generation) not in memo:
+                continue
+            args = b" ".join(self._serialize(arg, None) for arg in dest[1:]).decode("latin-1")
+            nodes.append([str(item.title), memo[(page_ref.idnum, page_ref.generation)], args, []])
+        return nodes
+
+    def _outline_objects(self, nodes, parent_id: int) -> Tuple[List[Tuple[int, bytes]], List[int], int]:
+        """Return (objects, ids of the given nodes, visible descendant count)."""
+        ids = [self._allocate() for _ in nodes]
+        objects = []
+        total = len(nodes)
+        for index, (title, page_id, args, children) in enumerate(nodes):
+            child_objects, child_ids, child_count = self._outline_objects(children, ids[index])
+            objects += child_objects
+            total += child_count
+            entries = [b"/Title " + self._serialize(generic.TextStringObject(title), None), b"/Parent %d 0 R" % parent_id]
+            if index > 0:
+                entries.append(b"/Prev %d 0 R" % ids[index - 1])
+            if index + 1 < len(ids):
+                entries.append(b"/Next %d 0 R" % ids[index + 1])
+            if child_ids:
+                entries += [b"/First %d 0 R" % child_ids[0], b"/Last %d 0 R" % child_ids[-1], b"/Count %d" % child_count]
+            entries.append(b"/Dest [%d 0 R %s]" % (page_id, args.encode("latin-1")))
+            objects.append((ids[index], b"<< " + b"\n".join(entries) + b" >>"))
+        return objects, ids, total
+
+    def _write_tail(self, fileobj, position: int, documents: List[dict], prev_xref: int = None) -> int:
+        """Copy the spool to fileobj at position (unless the objects were streamed
+        there already), then the page tree, outline, catalog, xref and trailer;
+        returns the xref offset."""
+        trailing = []
+        catalog = b"<< /Type /Catalog /Pages %d 0 R" % self.PAGES_ID
+        outline = [node for document in documents for node in document["outline"]]
+        if outline:
+            outline_id = self._allocate()
+            objects, ids, count = self._outline_objects(outline, outline_id)
+            trailing += objects
+            trailing.append((outline_id, b"<< /Type /Outlines /First %d 0 R /Last %d 0 R /Count %d >>" % (ids[0], ids[-1], count)))
+            catalog += b" /Outlines %d 0 R" % outline_id
+        dests = {}
+        for document in documents:
+            for name, page_id, args in document.get("dests") or ():
+                dests.setdefault(name, (page_id, args))
+        if dests:
+            dests_id = self._allocate()
+            names = b"\n".join(
+                b"%s [%d 0 R %s]" % (self._serialize(generic.TextStringObject(name), None), page_id, args.encode("latin-1"))
+                for name, (page_id, args) in sorted(dests.items())
+            )
+            trailing.append((dests_id, b"<< /Names [\n%s\n] >>" % names))
+            catalog += b" /Names << /Dests %d 0 R >>" % dests_id
+        forms = [document["form"] for document in documents if document.get("form")]
+        if forms:
+            form_id = self._allocate()
+            entries = [b"/Fields [%s]" % b" ".join(b"%d 0 R" % field_id for form in forms for field_id, _ in form["fields"])]
+            # Default resources and appearance come from the first document that has them.
+            for key in ("dr", "da"):
+                value = next((form[key] for form in forms if form[key] is not None), None)
+                if value is not None:
+                    entries.append(b"/%s %s" % (key.upper().encode(), value.encode("latin-1")))
+            if any(form["need_appearances"] for form in forms):
+                entries.append(b"/NeedAppearances true")
+            trailing.append((form_id, b"<< " + b" ".join(entries) + b" >>"))
+            catalog += b" /AcroForm %d 0 R" % form_id
+        page_ids = [page_id for document in documents for page_id in document["pages"]]
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+        trailing.append((self.PAGES_ID, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))))
+        trailing.append((self.CATALOG_ID, catalog + b" >>"))
+
+        body_bytes = self._body_bytes
+        if self._stream is None:
+            self._copy_body(fileobj)
+        offsets = {obj_id: position + offset for obj_id, offset in self._offsets.items()}
+        position += body_bytes
+        for obj_id, body in trailing:
+            chunk = b"%d 0 obj\n" % obj_id + body + b"\nendobj\n"
+            offsets[obj_id] = position
+            fileobj.write(chunk)
+            position += len(chunk)
+
+        if prev_xref is None:
+            xref = [b"xref\n0 %d\n0000000000 65535 f \n" % self._next_id]
+            for obj_id in range(1, self._next_id):
+                # Only an append that failed midway leaves ids unwritten; keep them free.
+                xref.append(b"%010d 00000 n \n" % offsets[obj_id] if obj_id in offsets else b"0000000000 65535 f \n")
+            trailer = b"<< /Size %d /Root %d 0 R >>" % (self._next_id, self.CATALOG_ID)
+        else:
+            # An update section only lists the objects it (re)defines, in runs of consecutive ids.
+            xref = [b"xref\n"]
+            obj_ids = sorted(offsets)
+            start = 0
+            for index in range(1, len(obj_ids) + 1):
+                if index == len(obj_ids) or obj_ids[index] != obj_ids[index - 1] + 1:
+                    xref.append(b"%d %d\n" % (obj_ids[start], index - start))
+                    xref += [b"%010d 00000 n \n" % offsets[obj_id] for obj_id in obj_ids[start:index]]
+                    start = index
+            trailer = b"<< /Size %d /Root %d 0 R /Prev %d >>" % (self._next_id, self.CATALOG_ID, prev_xref)
+        fileobj.write(b"".join(xref))
+        fileobj.write(b"trailer\n%s\nstartxref\n%d\n%%%%EOF\n" % (trailer, position))
+        return position
+
+    def write(self, fileobj) -> int:
+        """Write the merged PDF to a path or a binary file object; returns the xref offset."""
+        if isinstance(fileobj, (str, Path)):
+            with open(fileobj, "wb") as f:
+                return self.write(f)
+        if self._stream is None:
+            fileobj.write(self.HEADER)
+        elif fileobj is not self._stream:
+            raise ValueError("a streaming merger can only be finished into its stream")
+        return self._write_tail(fileobj, len(self.HEADER), self.documents)
+
+    def write_update(self, pdf_path: str, prev_xref: int, documents: List[dict]) -> int:
+        """Append the documents added here to pdf_path as an incremental update.
+
+        documents is the complete page order of the new revision (earlier
+        documents keep their object ids); returns the new xref offset.
+        """
+        with open(pdf_path, "ab") as f:
+            f.write(b"\n")
+            return self._write_tail(f, f.tell(), documents, prev_xref)
+
+    def close(self):
+        self._spool.close()
+
+
+TenderMerger = Union[PagedMerger, "PyPDF2.PdfMerger"]
+
+
+def new_merger(base: dict = None) -> TenderMerger:
+    """A merger for the configured engine; base (a PagedMerger snapshot) needs the paged one."""
+    if base is not None or MERGE_ENGINE == "paged":
+        return PagedMerger(base=base)
+    return PyPDF2.PdfMerger()
@@ -0,0 +1,184 @@
+"""Prometheus counters and histograms, and the per-tender stage timer."""
+from typing import Callable, List, Tuple
+from contextlib import contextmanager
+import bisect
+import time
+import os
+import threading
+import logging
+from .config import METRICS_ENABLED
+from .cache import conversion_cache
+
+
+class Metrics:
+    """Process-local counters and histograms in the Prometheus text format.
+
+    Gauges are read from the live objects (pipeline, caches, ...) when
+    /metrics is scraped, so the hot path only pays for counters and
+    histograms, and nothing at all when disabled. With several uvicorn
+    workers each process reports its own series.
+    """
+    SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._meta = {} # name -> (type, help, buckets)
+        self._values = {} # (name, labels) -> float, or [bucket counts..., sum, count]
+        self._collectors = [] # (name, type, help, callable returning [(labels dict, value)])
+
+    def counter(self, name: str, help_text: str):
+        self._meta[name] = ("counter", help_text, None)
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = SECONDS_BUCKETS):
+        self._meta[name] = ("histogram", help_text, buckets)
+
+    def collector(self, name: str, help_text: str, collect: Callable[[], List[Tuple[dict, float]]], kind: str = "gauge"):
+        """Register a series whose samples are read from collect() at scrape time."""
+        self._collectors.append((name, kind, help_text, collect))
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        buckets = self._meta[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(buckets) + 3) # buckets, +Inf, sum, count
+            series[bisect.bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @staticmethod
+    def _labels(labels, extra: str = "") -> str:
+        parts = [f'{name}="{str(value)}"' for name, value in labels] + ([extra] if extra else [])
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            values = sorted(self._values.items(), key=lambda item: item[0])
+            values = [(key, list(value) if isinstance(value, list) else value) for key, value in values]
+        described = set()
+        for (name, labels), value in values:
+            kind, help_text, buckets = self._meta[name]
+            if name not in described:
+                described.add(name)
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == "counter":
+                lines.append(f"{name}{self._labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + (float("inf"),), value):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_label = f'le="{le}"'
+                lines.append(f"{name}_bucket{self._labels(labels, bucket_label)} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {value[-2]}")
+            lines.append(f"{name}_count{self._labels(labels)} {value[-1]}")
+        for name, kind, help_text, collect in self._collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                logging.warning("Could not collect metric %s: %s", name, e)
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for labels, value in samples:
+                lines.append(f"{name}{self._labels(sorted(labels.items()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics(METRICS_ENABLED)
+metrics.counter("tender_requests_total", "Tender generations finished, by entry point and outcome (cache_hit and not_modified included).")
+metrics.histogram("tender_stage_seconds", "Time spent per pipeline stage (ingest, convert, merge, write) per tender.")
+metrics.histogram("tender_conversion_seconds", "Time to convert one lot batch to PDF, by file type.")
+metrics.counter("tender_lots_total", "Lots processed, by file type.")
+metrics.counter("tender_input_bytes_total", "Uploaded bytes, by file type.")
+metrics.counter("tender_output_bytes_total", "Bytes of generated Tender.pdf files.")
+metrics.histogram("tender_pages", "Pages per generated tender.", buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000))
+metrics.counter("tender_conversion_cache_total", "Conversion cache lookups, by result.")
+metrics.counter("tender_result_cache_total", "Whole-tender result cache lookups, by result.")
+metrics.counter("tender_optimize_saved_bytes_total", "Bytes removed from tenders by the optimization pass.")
+
+
+class StageTimer:
+    """Stage durations and sizes of one tender, reported once it is done.
+
+    Plain data so it can travel back from a process pipeline worker.
+    """
+    def __init__(self):
+        self.seconds = {}
+        self.conversions = [] # (kind, seconds)
+        self.lot_kinds = []
+        self.cache_hits = 0
+        self.pages = 0
+        self.output_bytes = 0
+        self.optimization = None # optimize_tender_pdf report, if the pass ran
+
+    def add(self, stage: str, seconds: float):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.seconds.items())
+
+    def optimization_header(self) -> str:
+        report = self.optimization
+        return (
+            f"before={report['bytes_before']}; after={report['bytes_after']}; seconds={report['seconds']}; "
+            f"linearized={str(report['linearized']).lower()}"
+        )
+
+    def record(self, entry_point: str, outcome: str = "ok"):
+        metrics.inc("tender_requests_total", entry_point=entry_point, outcome=outcome)
+        if outcome != "ok":
+            return
+        for stage, seconds in self.seconds.items():
+            metrics.observe("tender_stage_seconds", seconds, stage=stage)
+        self.record_conversions()
+        metrics.observe("tender_pages", self.pages)
+        metrics.inc("tender_output_bytes_total", self.output_bytes)
+        if self.optimization is not None:
+            metrics.inc("tender_optimize_saved_bytes_total", self.optimization["bytes_before"] - self.optimization["bytes_after"])
+
+    def record_conversions(self):
+        """Record lots and conversions only; batches convert shared lots once for several tenders."""
+        for kind, seconds in self.conversions:
+            metrics.observe("tender_conversion_seconds", seconds, kind=kind)
+        for kind in self.lot_kinds:
+            metrics.inc("tender_lots_total", kind=kind)
+        if conversion_cache.enabled:
+            metrics.inc("tender_conversion_cache_total", self.cache_hits, result="hit")
+            metrics.inc("tender_conversion_cache_total", len(self.conversions), result="miss")
+
+
+def directory_bytes(path: str) -> int:
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += directory_bytes(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            continue
+    return total
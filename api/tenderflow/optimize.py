@@ -0,0 +1,148 @@
+"""Optional size optimization of finished tenders with pikepdf or qpdf."""
+from typing import Tuple
+import io
+import shutil
+import subprocess
+import time
+import os
+import zlib
+import importlib.util
+import logging
+from pathlib import Path
+from .lazy import Image
+from .config import OPTIMIZE_IMAGE_DPI, OPTIMIZE_JPEG_QUALITY, OPTIMIZE_LINEARIZE
+
+
+PIKEPDF_AVAILABLE = importlib.util.find_spec("pikepdf") is not None
+OPTIMIZE_TOOL = "pikepdf" if PIKEPDF_AVAILABLE else "qpdf" if shutil.which("qpdf") else None
+# Part of result cache keys, so optimized and plain tenders never mix.
+OPTIMIZER_SETTINGS = (
+    f"optimize-v2-{OPTIMIZE_TOOL}-dpi{OPTIMIZE_IMAGE_DPI}-q{OPTIMIZE_JPEG_QUALITY}-lin{int(OPTIMIZE_LINEARIZE)}"
+)
+OPTIMIZABLE_IMAGE_MODES = {"/DeviceGray": "L", "/DeviceRGB": "RGB"}
+
+
+class PdfOptimizer:
+    """Downsamples the images of a finished tender opened with pikepdf.
+
+    8-bit gray and RGB images (JPEG or Flate) with more pixels than
+    image_dpi needs to cover the largest page they are drawn on are
+    downsampled. That is the most they can need even if they are drawn
+    full-page. Everything else (masks, CMYK, /Decode arrays, other
+    filters), and any image the rewrite would not make smaller, is left
+    unchanged.
+    """
+    def __init__(self, image_dpi: int, jpeg_quality: int):
+        self.image_dpi = image_dpi
+        self.jpeg_quality = jpeg_quality
+        self.images_downsampled = 0
+
+    def downsample_images(self, pdf):
+        if not self.image_dpi:
+            return
+        images = {} # (object id, generation) -> [image, largest page size it is on]
+        for page in pdf.pages:
+            page_size = (float(page.mediabox[2] - page.mediabox[0]), float(page.mediabox[3] - page.mediabox[1]))
+            xobjects = page.obj.get("/Resources", {}).get("/XObject", {})
+            for image in (xobject for _, xobject in xobjects.items() if xobject.get("/Subtype") == "/Image"):
+                entry = images.setdefault(image.objgen, [image, (0.0, 0.0)])
+                entry[1] = (max(entry[1][0], abs(page_size[0])), max(entry[1][1], abs(page_size[1])))
+        for image, page_size in images.values():
+            try:
+                self._downsample(image, page_size)
+            except Exception as e: # an image we cannot decode stays as it is
+                logging.warning("Optimizer left an image unchanged: %s", e)
+
+    def _downsample(self, image, page_size: Tuple[float, float]):
+        mode = OPTIMIZABLE_IMAGE_MODES.get(str(image.get("/ColorSpace")))
+        filters = str(image.get("/Filter"))
+        if (not all(page_size) or mode is None or image.get("/BitsPerComponent") != 8
+                or "/Decode" in image or "/Mask" in image or filters not in ("/DCTDecode", "/FlateDecode")):
+            return
+        width, height = int(image.Width), int(image.Height)
+        scale = max(self.image_dpi * page_size[0] / 72.0 / width, self.image_dpi * page_size[1] / 72.0 / height)
+        if scale > 0.9: # not worth a lossy pass
+            return
+        target_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+        raw = image.read_raw_bytes()
+        if filters == "/DCTDecode":
+            img = Image.open(io.BytesIO(raw))
+            img.draft(mode, target_size) # let libjpeg decode at a fraction of the size
+            if img.mode != mode:
+                return
+        else:
+            img = Image.frombytes(mode, (width, height), image.read_bytes())
+        img = img.resize(target_size, Image.LANCZOS)
+        if filters == "/DCTDecode":
+            buffer = io.BytesIO()
+            img.save(buffer, "JPEG", quality=self.jpeg_quality)
+            data = buffer.getvalue()
+        else:
+            data = zlib.compress(img.tobytes(), 9) # lossless stays lossless
+        if len(data) >= len(raw):
+            return
+        image.write(data, filter=image.Filter) # drops /DecodeParms with the old encoding
+        image.Width, image.Height = target_size
+        self.images_downsampled += 1
+
+
+def optimize_with_pikepdf(pdf_path: str, staged_path: str, report: dict):
+    import pikepdf
+
+    optimizer = PdfOptimizer(OPTIMIZE_IMAGE_DPI, OPTIMIZE_JPEG_QUALITY)
+    with pikepdf.open(pdf_path) as pdf:
+        optimizer.downsample_images(pdf)
+        pdf.remove_unreferenced_resources()
+        pdf.save(
+            staged_path, compress_streams=True, recompress_flate=True,
+            object_stream_mode=pikepdf.ObjectStreamMode.generate, linearize=OPTIMIZE_LINEARIZE,
+        )
+    report.update(images_downsampled=optimizer.images_downsampled, linearized=OPTIMIZE_LINEARIZE)
+
+
+def optimize_with_qpdf(pdf_path: str, staged_path: str, report: dict):
+    command = [shutil.which("qpdf"), "--object-streams=generate", "--recompress-flate", "--compression-level=9"]
+    if OPTIMIZE_LINEARIZE:
+        command.append("--linearize")
+    result = subprocess.run(command + [pdf_path, staged_path], capture_output=True, timeout=600, check=False)
+    if result.returncode not in (0, 3): # 3: succeeded with warnings
+        raise RuntimeError(f"qpdf exited with {result.returncode}: {result.stderr.decode(errors='replace').strip()}")
+    report["linearized"] = OPTIMIZE_LINEARIZE
+
+
+def optimize_tender_pdf(pdf_path: str) -> dict:
+    """Optimize the finished pdf_path in place.
+
+    With pikepdf, images are downsampled (see PdfOptimizer), unused page
+    resources dropped, streams recompressed and objects packed into object
+    streams; qpdf alone does all but the images. Either linearizes when
+    TENDER_OPTIMIZE_LINEARIZE is set. The file is rewritten as it is, so
+    outlines, links and forms survive; identical objects are only merged by
+    the paged merge engine. The original stays if the result is not
+    smaller, unless it was linearized, or if the pass fails. Runs inside
+    the pipeline executor; returns the report shown to clients.
+    """
+    started = time.perf_counter()
+    staged_path = f"{pdf_path}.optimized"
+    report = {"bytes_before": os.path.getsize(pdf_path), "tool": OPTIMIZE_TOOL, "linearized": False, "images_downsampled": 0}
+    try:
+        if OPTIMIZE_TOOL == "pikepdf":
+            optimize_with_pikepdf(pdf_path, staged_path, report)
+        elif OPTIMIZE_TOOL == "qpdf":
+            optimize_with_qpdf(pdf_path, staged_path, report)
+        if os.path.exists(staged_path) and (report["linearized"] or os.path.getsize(staged_path) < report["bytes_before"]):
+            os.replace(staged_path, pdf_path)
+    except Exception as e: # the unoptimized tender is still a valid result
+        logging.warning("Could not optimize %s: %s", Path(pdf_path).name, e)
+        report.update(linearized=False, images_downsampled=0)
+    finally:
+        if os.path.exists(staged_path):
+            os.unlink(staged_path)
+    report.update(bytes_after=os.path.getsize(pdf_path), seconds=round(time.perf_counter() - started, 3))
+    logging.info(
+        "Optimized %s with %s: %s -> %s bytes in %ss (%s images downsampled)",
+        Path(pdf_path).name, report["tool"], report["bytes_before"], report["bytes_after"],
+        report["seconds"], report["images_downsampled"],
+    )
+    return report
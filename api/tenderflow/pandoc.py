@@ -0,0 +1,375 @@
+"""Long-lived pandoc worker interpreters for DOCX conversions."""
+from typing import Optional, Tuple
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import json
+import queue
+import secrets
+import signal
+import subprocess
+import sys
+import time
+import os
+import threading
+import logging
+from pathlib import Path
+from .config import PANDOC_CONCURRENCY, PANDOC_RECYCLE_AFTER, PANDOC_SERVICE, PANDOC_TIMEOUT, PANDOC_WARMUP
+
+
+# Runs in a bare interpreter: one JSON request per stdin line, one JSON reply
+# per stdout line. Importing pypandoc and locating pandoc happen once here.
+PANDOC_WORKER_SOURCE = r"""
+import json, os, sys, tempfile, time
+
+def reply(message):
+    try:
+        print(json.dumps(message), flush=True)
+    except BrokenPipeError: # the server went away
+        sys.exit(0)
+
+try:
+    import pypandoc
+    pypandoc.get_pandoc_version()
+    if sys.argv[1] == "1":
+        with tempfile.TemporaryDirectory() as warm_dir:
+            try:
+                pypandoc.convert_text("warm up", "pdf", format="md", outputfile=os.path.join(warm_dir, "w.pdf"))
+            except Exception:
+                pass
+except Exception as e:
+    reply({"ready": False, "error": str(e)})
+    sys.exit(1)
+reply({"ready": True})
+for line in sys.stdin:
+    job = json.loads(line)
+    started = time.perf_counter()
+    try:
+        pypandoc.convert_file(job["source"], "pdf", outputfile=job["output"])
+        result = {"ok": True}
+    except Exception as e:
+        result = {"ok": False, "error": str(e)}
+    result["seconds"] = time.perf_counter() - started
+    reply(result)
+"""
+
+
+class PandocWorkerError(Exception):
+    pass
+
+
+class PandocTimeout(PandocWorkerError):
+    pass
+
+
+class PandocWorker:
+    def __init__(self, prime_caches: bool):
+        self.jobs_done = 0
+        self._replies = queue.Queue()
+        self._process = subprocess.Popen(
+            [sys.executable, "-c", PANDOC_WORKER_SOURCE, "1" if prime_caches else "0"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            start_new_session=True, # own process group, so a timeout also kills pandoc/LaTeX
+        )
+        threading.Thread(target=self._read_replies, name="tender-pandoc-reader", daemon=True).start()
+
+    def _read_replies(self):
+        for line in self._process.stdout:
+            self._replies.put(json.loads(line))
+        self._replies.put(None) # worker exited
+
+    def _reply(self, timeout: float) -> dict:
+        try:
+            reply = self._replies.get(timeout=timeout)
+        except queue.Empty:
+            self.kill()
+            raise PandocTimeout(f"pandoc did not finish within {timeout:.0f} seconds") from None
+        if reply is None:
+            raise PandocWorkerError("pandoc worker exited unexpectedly")
+        return reply
+
+    def wait_ready(self, timeout: float):
+        reply = self._reply(timeout)
+        if not reply.get("ready"):
+            self.kill()
+            raise PandocWorkerError(reply.get("error", "pandoc worker failed to start"))
+
+    def convert(self, source_path: str, output_path: str, timeout: float) -> dict:
+        self._process.stdin.write(json.dumps({"source": source_path, "output": output_path}) + "\n")
+        self._process.stdin.flush()
+        reply = self._reply(timeout)
+        self.jobs_done += 1
+        return reply
+
+    @property
+    def alive(self) -> bool:
+        return self._process.poll() is None
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+            self._process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+    def kill(self):
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(self._process.pid, signal.SIGKILL)
+            else:
+                self._process.kill()
+        except OSError:
+            pass
+
+
+class PandocService:
+    """Pool of long-lived worker interpreters that run pandoc, fed over stdin/stdout pipes.
+
+    Pandoc and its LaTeX engine have no resident mode, so every DOCX still
+    starts both cold. A worker only saves the Python side: starting an
+    interpreter, importing pypandoc and locating the pandoc binary. The
+    optional warm-up conversion at most leaves LaTeX's files in the OS cache.
+    The service also enforces a per-job timeout (the whole process group is
+    killed), recycles workers after `recycle_after` jobs and records timings.
+    Pipeline worker processes do not start workers of their own: they send
+    their conversions to the service in the parent process (see listen()).
+    If a worker cannot start (e.g. pandoc is missing) the service reports
+    itself unavailable and callers fall back to a direct pypandoc call. It
+    tries again after a backoff that doubles with every failed start, from
+    RETRY_MIN_SECONDS up to RETRY_MAX_SECONDS, so a passing problem does not
+    switch the workers off for good.
+    """
+    START_TIMEOUT = 120.0
+    RETRY_MIN_SECONDS = 5.0
+    RETRY_MAX_SECONDS = 300.0
+
+    def __init__(self, enabled: bool, workers: int, timeout: float, recycle_after: int, prime_caches: bool):
+        self.enabled = enabled
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.recycle_after = max(1, recycle_after)
+        self.prime_caches = prime_caches
+        self._idle = queue.Queue()
+        self._busy = set() # checked-out workers, killed by shutdown()
+        self._closed = False
+        self._listener = None
+        self._authkey = secrets.token_bytes(16)
+        self._remote = None # (address, authkey) of the parent's service, see connect()
+        self._spawned = 0
+        self._retry_seconds = 0.0 # backoff after the last failed start, 0 once a worker started
+        self._retry_at = 0.0 # time.monotonic() before which no worker is started
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.conversions = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    @property
+    def available(self) -> bool:
+        return self.enabled and not self._closed and time.monotonic() >= self._retry_at
+
+    def _spawn(self) -> Optional[PandocWorker]:
+        try:
+            worker = PandocWorker(self.prime_caches)
+            worker.wait_ready(self.START_TIMEOUT)
+        except (OSError, PandocWorkerError) as e:
+            with self._lock:
+                self._retry_seconds = min(self.RETRY_MAX_SECONDS, max(self.RETRY_MIN_SECONDS, 2 * self._retry_seconds))
+                self._retry_at = time.monotonic() + self._retry_seconds
+            logging.warning("Pandoc worker unavailable, converting DOCX in-process for %.0fs: %s", self._retry_seconds, e)
+            return None
+        with self._lock:
+            self._retry_seconds = 0.0
+        return worker
+
+    def _replace(self):
+        worker = self._spawn() if not self._closed else None
+        if worker is not None:
+            self._idle.put(worker)
+        else:
+            with self._lock:
+                self._spawned -= 1
+
+    def warmup(self):
+        """Start every worker now rather than on the first DOCX."""
+        while self.available:
+            with self._lock:
+                if self._spawned >= self.workers:
+                    return
+                self._spawned += 1
+            self._replace()
+
+    def _checkout(self) -> Optional[PandocWorker]:
+        worker = self._take()
+        if worker is not None:
+            with self._lock:
+                self._busy.add(worker)
+        return worker
+
+    def _take(self) -> Optional[PandocWorker]:
+        while self.enabled:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if not self.available:
+                return None # backing off after a failed start
+            with self._lock:
+                spawn = self._spawned < self.workers
+                if spawn:
+                    self._spawned += 1
+            if spawn:
+                worker = self._spawn()
+                if worker is None:
+                    with self._lock:
+                        self._spawned -= 1
+                return worker
+            try:
+                return self._idle.get(timeout=1.0)
+            except queue.Empty:
+                continue # re-check: a failed respawn may have started a backoff
+        return None
+
+    def _checkin(self, worker: PandocWorker):
+        with self._lock:
+            self._busy.discard(worker)
+            if not self._closed:
+                self._idle.put(worker)
+                return
+        worker.close()
+
+    def _retire(self, worker: PandocWorker, kill: bool = False):
+        with self._lock:
+            self._busy.discard(worker)
+        if kill:
+            worker.kill()
+        else:
+            worker.close()
+        with self._stats_lock:
+            self.recycled += 1
+        threading.Thread(target=self._replace, name="tender-pandoc-spawn", daemon=True).start()
+
+    def convert(self, source_path: str, output_path: str) -> bool:
+        """Convert on a worker; False if the service is unavailable.
+
+        Conversion errors are raised as PandocWorkerError.
+        """
+        if self._remote is not None:
+            return self._convert_remote(source_path, output_path)
+        worker = self._checkout()
+        if worker is None:
+            return False
+        try:
+            reply = worker.convert(source_path, output_path, self.timeout)
+        except PandocWorkerError as e:
+            with self._stats_lock:
+                self.failures += 1
+                if isinstance(e, PandocTimeout):
+                    self.timeouts += 1
+            self._retire(worker, kill=True)
+            raise
+
+        with self._stats_lock:
+            self.conversions += 1
+            self.total_seconds += reply["seconds"]
+            self.max_seconds = max(self.max_seconds, reply["seconds"])
+            if not reply["ok"]:
+                self.failures += 1
+        logging.info("pandoc converted %s in %.2fs", Path(source_path).name, reply["seconds"])
+
+        if worker.jobs_done >= self.recycle_after or not worker.alive:
+            self._retire(worker)
+        else:
+            self._checkin(worker)
+        if not reply["ok"]:
+            raise PandocWorkerError(reply["error"])
+        return True
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "conversions": self.conversions,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "recycled": self.recycled,
+                "total_seconds": self.total_seconds,
+                "max_seconds": self.max_seconds,
+            }
+
+    def listen(self) -> Tuple[str, bytes]:
+        """Serve conversions to other processes; returns the (address, authkey) they connect() with."""
+        with self._lock:
+            if self._listener is None:
+                self._listener = Listener(authkey=self._authkey)
+                threading.Thread(
+                    target=self._accept, args=(self._listener,), name="tender-pandoc-listener", daemon=True,
+                ).start()
+            return self._listener.address, self._authkey
+
+    def _accept(self, listener: Listener):
+        while not self._closed:
+            try:
+                connection = listener.accept()
+            except (OSError, AuthenticationError): # closed by shutdown(), or a client with the wrong key
+                continue
+            threading.Thread(target=self._serve, args=(connection,), name="tender-pandoc-remote", daemon=True).start()
+
+    def _serve(self, connection):
+        with connection:
+            try:
+                source_path, output_path = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = {"converted": self.convert(source_path, output_path)}
+            except PandocWorkerError as e:
+                reply = {"error": str(e)}
+            try:
+                connection.send(reply)
+            except OSError: # the pipeline process went away
+                pass
+
+    def connect(self, address: str, authkey: bytes):
+        """Send this process's conversions to the service listen() was called on.
+
+        For pipeline worker processes. Whatever a fork copied from the
+        parent's service (its workers' pipes, locks) is dropped, not closed.
+        """
+        self.__init__(True, self.workers, self.timeout, self.recycle_after, self.prime_caches)
+        self._remote = (address, authkey)
+
+    def _convert_remote(self, source_path: str, output_path: str) -> bool:
+        address, authkey = self._remote
+        try:
+            with Client(address, authkey=authkey) as connection:
+                connection.send((source_path, output_path))
+                reply = connection.recv()
+        except (EOFError, OSError) as e:
+            raise PandocWorkerError(f"pandoc service unreachable: {e}") from None
+        if "error" in reply:
+            raise PandocWorkerError(reply["error"])
+        return reply["converted"]
+
+    def shutdown(self):
+        """Close idle workers and kill busy ones; the service converts nothing afterwards."""
+        with self._lock:
+            self._closed = True
+            busy, self._busy = self._busy, set()
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.close()
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        for worker in busy:
+            worker.kill()
+
+
+pandoc_service = PandocService(PANDOC_SERVICE, PANDOC_CONCURRENCY, PANDOC_TIMEOUT, PANDOC_RECYCLE_AFTER, PANDOC_WARMUP)
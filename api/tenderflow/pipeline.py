@@ -0,0 +1,528 @@
+"""Conversion and merge pipeline, run on a bounded worker pool."""
+from fastapi import HTTPException, status
+from typing import Callable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from contextlib import contextmanager, closing
+import asyncio
+import queue
+import time
+import os
+import threading
+import weakref
+import logging
+from .config import (
+    CONVERSION_WORKERS, IMAGE_BATCH_SIZE, PANDOC_CONCURRENCY, PIPELINE_EXECUTOR, PIPELINE_QUEUE_DEPTH, PIPELINE_RETRY_AFTER,
+    PIPELINE_WORKERS, STREAM_CHUNK_BYTES, STREAM_QUEUE_CHUNKS,
+)
+from .metrics import StageTimer
+from .convert import convert_images_to_pdf, convert_word_to_pdf
+from .cache import conversion_cache, file_sha256, result_cache
+from .ingest import is_image, is_pdf, is_word, kind_from_filename
+from .merge import new_merger, PagedMerger, TenderMerger
+from .pandoc import pandoc_service
+from .optimize import optimize_tender_pdf
+
+
+class PipelineError(Exception):
+    """Picklable stand-in for HTTPException raised inside the worker pool."""
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+_IN_PIPELINE_PROCESS = False
+
+
+def _mark_pipeline_process(pandoc_connection: Tuple[str, bytes] = None):
+    global _IN_PIPELINE_PROCESS
+    _IN_PIPELINE_PROCESS = True
+    if pandoc_connection is not None:
+        # DOCX lots go to the parent's workers, so TENDER_PANDOC_CONCURRENCY stays a global cap.
+        pandoc_service.connect(*pandoc_connection)
+
+
+def _convert_and_cache(converter, source, cache_key: str = None):
+    started = time.perf_counter()
+    pdf_path = converter(source)
+    seconds = time.perf_counter() - started
+    if cache_key is not None:
+        conversion_cache.store(cache_key, pdf_path)
+    return pdf_path, seconds
+
+
+def _discard_converted_pdf(future: Future):
+    # A conversion that finished after its tender was abandoned: drop the output.
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        os.unlink(future.result()[0])
+    except OSError:
+        pass
+
+
+def _shutdown_executor(executor, futures):
+    """shutdown(wait=False, cancel_futures=True), which Python 3.8 lacks: the
+    futures that have not started are cancelled, running ones are left to finish."""
+    for future in list(futures):
+        future.cancel()
+    executor.shutdown(wait=False)
+
+
+class ConversionScheduler:
+    """Fans lot conversions out across worker pools and hands them back in order.
+
+    Images go to a process pool (PIL is CPU bound); DOCX files go to a small
+    thread pool whose size caps the number of pandoc processes alive at once,
+    since pandoc does its work in its own subprocess anyway.
+    """
+    def __init__(self, image_workers: int, pandoc_workers: int):
+        self.image_workers = max(1, image_workers)
+        self.pandoc_workers = max(1, pandoc_workers)
+        self._image_executor = None
+        self._pandoc_executor = None
+        self._futures = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def _image_pool(self):
+        with self._lock:
+            if self._image_executor is None:
+                if _IN_PIPELINE_PROCESS:
+                    # Already inside a pipeline worker process; nesting another
+                    # process pool there leaves orphaned workers on shutdown.
+                    self._image_executor = ThreadPoolExecutor(max_workers=self.image_workers, thread_name_prefix="tender-image")
+                else:
+                    self._image_executor = ProcessPoolExecutor(max_workers=self.image_workers)
+            return self._image_executor
+
+    def _pandoc_pool(self):
+        with self._lock:
+            if self._pandoc_executor is None:
+                self._pandoc_executor = ThreadPoolExecutor(max_workers=self.pandoc_workers, thread_name_prefix="tender-pandoc")
+            return self._pandoc_executor
+
+    def submit(self, kind: str, lot_file_paths: List[str], content_hashes: List[Optional[str]]) -> Future:
+        """Start converting lot_file_paths into one PDF ("image" batches or a single "docx").
+
+        The future resolves to (pdf_path, conversion seconds, or None for a cache hit).
+        """
+        if kind == "image":
+            converter, source, pool = convert_images_to_pdf, lot_file_paths, self._image_pool
+        else:
+            converter, source, pool = convert_word_to_pdf, lot_file_paths[0], self._pandoc_pool
+
+        cache_key = None
+        if conversion_cache.enabled:
+            content_hashes = [
+                content_hash or file_sha256(path) for path, content_hash in zip(lot_file_paths, content_hashes)
+            ]
+            cache_key = conversion_cache.key_for(kind, content_hashes)
+            cached_pdf_path = conversion_cache.fetch(cache_key, os.path.dirname(lot_file_paths[0]))
+            if cached_pdf_path is not None:
+                future = Future()
+                future.set_result((cached_pdf_path, None))
+                return future
+        future = pool().submit(_convert_and_cache, converter, source, cache_key)
+        self._futures.add(future)
+        return future
+
+    def convert_lots(self, lot_paths: List[Tuple[str, str, Optional[str]]], timer: "StageTimer" = None,
+                     batch_images: bool = True):
+        """Yield (lot indices, pdf_path, is_converted) covering every lot, in upload order.
+
+        lot_paths holds (filename, path, sha256 or None) triples. Runs of
+        consecutive image lots (up to IMAGE_BATCH_SIZE) become one PDF with a
+        page per image. All conversions start immediately. The first failure
+        cancels every job that has not started yet and is re-raised; outputs
+        of jobs that were already running are deleted when they finish.
+        Conversion times and cache hits are added to timer, if given. With
+        batch_images=False every image gets a PDF of its own.
+        """
+        # Validate everything before any job is started.
+        for lot_filename, _, _ in lot_paths:
+            if not (is_pdf(lot_filename) or is_image(lot_filename) or is_word(lot_filename)):
+                raise PipelineError(400, f"Unsupported file type: {lot_filename}")
+            if timer is not None:
+                timer.lot_kinds.append(kind_from_filename(lot_filename))
+
+        futures = []
+        image_run = []
+
+        def flush_images():
+            if image_run:
+                futures.append((
+                    [index for index, _, _ in image_run],
+                    self.submit("image", [path for _, path, _ in image_run], [sha for _, _, sha in image_run]),
+                    "image",
+                ))
+                image_run.clear()
+
+        for index, (lot_filename, lot_file_path, content_hash) in enumerate(lot_paths):
+            if is_image(lot_filename):
+                image_run.append((index, lot_file_path, content_hash))
+                if len(image_run) >= (max(1, IMAGE_BATCH_SIZE) if batch_images else 1):
+                    flush_images()
+                continue
+            flush_images()
+            if is_pdf(lot_filename):
+                future = Future()
+                future.set_result((lot_file_path, None))
+                futures.append(([index], future, None))
+            else:
+                futures.append(([index], self.submit("docx", [lot_file_path], [content_hash]), "docx"))
+        flush_images()
+
+        next_index = 0
+        pending = {future for _, future, _ in futures if not future.done()}
+        try:
+            while next_index < len(futures):
+                if not futures[next_index][1].done():
+                    # Woken by every conversion that ends, so a failure anywhere is raised at once.
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception() is not None:
+                            raise future.exception()
+                while next_index < len(futures) and futures[next_index][1].done():
+                    lot_indices, future, kind = futures[next_index]
+                    next_index += 1
+                    pdf_path, seconds = future.result()
+                    if timer is not None and kind is not None:
+                        if seconds is None:
+                            timer.cache_hits += 1
+                        else:
+                            timer.conversions.append((kind, seconds))
+                    yield lot_indices, pdf_path, kind is not None
+        finally:
+            for _, future, kind in futures[next_index:]:
+                if kind is not None and not future.cancel():
+                    future.add_done_callback(_discard_converted_pdf)
+
+    def shutdown(self):
+        with self._lock:
+            for executor in (self._image_executor, self._pandoc_executor):
+                if executor is not None:
+                    _shutdown_executor(executor, self._futures)
+            self._image_executor = None
+            self._pandoc_executor = None
+
+
+conversion_scheduler = ConversionScheduler(CONVERSION_WORKERS, PANDOC_CONCURRENCY)
+
+
+def merge_tender_pdf(master_path: str, lot_paths: List[Tuple[str, str, Optional[str]]],
+                     progress: Callable[[int, str], None] = None, timer: StageTimer = None,
+                     master_snapshot: dict = None, sink: "PdfChunkStream" = None) -> TenderMerger:
+    """Convert every lot and append it after the master; returns the merger.
+
+    lot_paths holds (original filename, path on disk, sha256 or None) triples
+    in upload order. Both engines are done with an input once append()
+    returns, so the intermediate PDFs are removed before this returns. progress, if given, is
+    called with (lot index, "converting" | "merged"). timer, if given, gets
+    the time spent waiting for conversions ("convert") and appending ("merge").
+    master_snapshot, a PagedMerger snapshot of the master, is used instead
+    of reading master_path again. With sink (see PdfChunkStream), the paged
+    engine sends the header and every input's objects there as it goes;
+    pdf_merger.write(sink) then finishes the PDF.
+    """
+    timer = timer if timer is not None else StageTimer()
+    temporary_file_paths_to_clean = []
+    pdf_merger = new_merger(master_snapshot)
+    try:
+        if sink is not None and isinstance(pdf_merger, PagedMerger):
+            pdf_merger.stream_to(sink)
+        if master_snapshot is None:
+            with timer.stage("merge"):
+                pdf_merger.append(master_path)
+
+        if progress is not None:
+            for index in range(len(lot_paths)):
+                progress(index, "converting")
+        with closing(conversion_scheduler.convert_lots(lot_paths, timer)) as converted_lots:
+            waiting_since = time.perf_counter()
+            for lot_indices, lot_pdf_path, converted in converted_lots:
+                timer.add("convert", time.perf_counter() - waiting_since)
+                if converted:
+                    temporary_file_paths_to_clean.append(lot_pdf_path) # Mark for cleanup
+                with timer.stage("merge"):
+                    pdf_merger.append(lot_pdf_path)
+                if progress is not None:
+                    for index in lot_indices:
+                        progress(index, "merged")
+                waiting_since = time.perf_counter()
+        timer.pages = len(pdf_merger.pages)
+    except HTTPException as e:
+        pdf_merger.close()
+        raise PipelineError(e.status_code, str(e.detail)) from None
+    except BaseException:
+        pdf_merger.close()
+        raise
+    finally:
+        for temp_pdf in temporary_file_paths_to_clean:
+            if os.path.exists(temp_pdf):
+                try:
+                    os.unlink(temp_pdf)
+                    logging.info("Cleaned up intermediate PDF: %s", temp_pdf)
+                except OSError as e:
+                    logging.error("Error cleaning up intermediate PDF %s: %s", temp_pdf, e)
+    return pdf_merger
+
+
+def build_tender_pdf(master_path: str, lot_paths: List[Tuple[str, str, Optional[str]]], output_pdf_path: str,
+                     progress: Callable[[int, str], None] = None, optimize: bool = False,
+                     master_snapshot: dict = None) -> StageTimer:
+    """Convert every lot and merge it after the master (or master_snapshot,
+    see merge_tender_pdf) into output_pdf_path, then run the optimization
+    pass if asked to.
+
+    Runs inside the pipeline executor, so it must stay picklable and must not
+    raise HTTPException (it cannot cross a process boundary). Returns the
+    stage timings, which the caller records.
+    """
+    timer = StageTimer()
+    pdf_merger = merge_tender_pdf(master_path, lot_paths, progress, timer, master_snapshot)
+    try:
+        with timer.stage("write"):
+            pdf_merger.write(output_pdf_path)
+    finally:
+        pdf_merger.close()
+    if optimize:
+        with timer.stage("optimize"):
+            timer.optimization = optimize_tender_pdf(output_pdf_path)
+    timer.output_bytes = os.path.getsize(output_pdf_path)
+    return timer
+
+
+class StreamCancelled(Exception):
+    pass
+
+
+class PdfChunkStream:
+    """Write-only file object that hands merger output to a response.
+
+    Both engines only need write(), tell() and flush() and emit objects,
+    then the xref table and trailer, strictly in order, so bytes can go to
+    the client as soon as a chunk fills up (or the paged engine flushes
+    after an input). The queue is bounded: a slow client stalls the writer
+    instead of growing memory. Everything written also goes to tee, if
+    given, so the finished PDF can be cached.
+    """
+    _DONE = object()
+
+    def __init__(self, chunk_bytes: int = STREAM_CHUNK_BYTES, max_chunks: int = STREAM_QUEUE_CHUNKS, tee=None):
+        self.chunk_bytes = chunk_bytes
+        self.tee = tee
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._buffer = bytearray()
+        self._position = 0
+        self._cancelled = threading.Event()
+
+    # --- writer side (pipeline thread) ---
+    def _put(self, item):
+        while True:
+            if self._cancelled.is_set():
+                raise StreamCancelled()
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data) -> int:
+        if self.tee is not None:
+            self.tee.write(data)
+        self._buffer += data
+        self._position += len(data)
+        if len(self._buffer) >= self.chunk_bytes:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        """Hand over what was written so far, even if it does not fill a chunk."""
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def finish(self, error: BaseException = None):
+        if error is None:
+            self.flush()
+        self._put(error if error is not None else self._DONE)
+
+    # --- reader side (response) ---
+    def next_chunk(self):
+        """Block for the next chunk; None once the writer is done or the stream was cancelled."""
+        while True:
+            try:
+                item = self._queue.get(timeout=0.5)
+                break
+            except queue.Empty:
+                if self._cancelled.is_set():
+                    return None
+        if item is self._DONE:
+            return None
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def cancel(self):
+        self._cancelled.set()
+
+
+def write_tender_pdf_stream(master_path: str, lot_paths: List[Tuple[str, str, Optional[str]]], sink: PdfChunkStream,
+                            timer: StageTimer = None, master_snapshot: dict = None, result_key: str = None,
+                            copy_path: str = None):
+    """Merge the tender into sink on a pipeline thread (see merge_tender_pdf).
+
+    With the paged engine the client gets each input as soon as it is
+    appended, while later lots are still converting; a failure after that
+    can only cut the response short. With result_key, a copy goes to
+    copy_path on the way and is stored in result_cache once the PDF is
+    complete, before the client gets the last chunk (after that the scratch
+    directory may already be gone).
+    """
+    timer = timer if timer is not None else StageTimer()
+    pdf_merger = None
+    try:
+        if result_key is not None:
+            sink.tee = open(copy_path, "wb")
+        pdf_merger = merge_tender_pdf(master_path, lot_paths, None, timer, master_snapshot, sink)
+        started = time.perf_counter()
+        pdf_merger.write(sink)
+        if sink.tee is not None:
+            sink.tee.close()
+            result_cache.store(result_key, copy_path)
+    except StreamCancelled:
+        logging.info("Client went away, stopped streaming Tender.pdf")
+        timer.record("upload", "cancelled")
+    except Exception as e:
+        logging.error("Error while streaming Tender.pdf: %s", e, exc_info=True)
+        timer.record("upload", "error")
+        try:
+            sink.finish(e)
+        except StreamCancelled:
+            pass
+    else:
+        try:
+            sink.finish()
+        except StreamCancelled:
+            timer.record("upload", "cancelled")
+        else:
+            # Includes the time spent waiting for the client to drain the stream.
+            timer.add("write", time.perf_counter() - started)
+            timer.output_bytes = sink.tell()
+            timer.record("upload")
+    finally:
+        if sink.tee is not None:
+            sink.tee.close()
+        if pdf_merger is not None:
+            pdf_merger.close()
+
+
+class PipelineStage:
+    """Bounded executor for the blocking conversion+merge work.
+
+    At most `workers` pipelines run at once and at most `queue_depth` more are
+    admitted to wait; anything beyond that is rejected straight away with a
+    503 so the event loop never piles up work it cannot serve.
+    """
+    def __init__(self, kind: str, workers: int, queue_depth: int, retry_after: int):
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_depth)
+        self.retry_after = retry_after
+        self._executor = None
+        self._thread_executor = None
+        self._futures = weakref.WeakSet()
+        self._admitted = 0
+        self._lock = threading.Lock()
+
+    @property
+    def admitted(self) -> int:
+        return self._admitted
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == "process":
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.workers, initializer=_mark_pipeline_process,
+                            initargs=(pandoc_service.listen() if pandoc_service.enabled else None,),
+                        )
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tender-pipeline")
+        return self._executor
+
+    def _get_thread_executor(self):
+        if self.kind != "process":
+            return self._get_executor()
+        with self._lock:
+            if self._thread_executor is None:
+                self._thread_executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tender-stream")
+            return self._thread_executor
+
+    def acquire(self):
+        with self._lock:
+            if self._admitted >= self.capacity:
+                logging.warning("Pipeline saturated (%s/%s), rejecting request", self._admitted, self.capacity)
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server is busy generating other tenders, please retry shortly.",
+                    headers={"Retry-After": str(self.retry_after)},
+                )
+            self._admitted += 1
+
+    def try_acquire_idle(self) -> bool:
+        """Take a slot only if a worker is idle right now; never queues and never raises."""
+        with self._lock:
+            if self._admitted >= self.workers:
+                return False
+            self._admitted += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._admitted -= 1
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _submit(self, executor, func, *args) -> Future:
+        future = executor.submit(func, *args)
+        self._futures.add(future)
+        return future
+
+    async def run(self, func, *args):
+        try:
+            return await asyncio.wrap_future(self._submit(self._get_executor(), func, *args))
+        except PipelineError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    async def run_in_thread(self, func, *args):
+        """Like run(), but always in this process; for work whose result
+        (e.g. a live PdfMerger) cannot be pickled back from a worker process."""
+        try:
+            return await asyncio.wrap_future(self._submit(self._get_thread_executor(), func, *args))
+        except PipelineError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    def submit_in_thread(self, func, *args) -> Future:
+        return self._submit(self._get_thread_executor(), func, *args)
+
+    def shutdown(self):
+        for executor in (self._executor, self._thread_executor):
+            if executor is not None:
+                _shutdown_executor(executor, self._futures)
+        self._executor = None
+        self._thread_executor = None
+
+
+pipeline = PipelineStage(PIPELINE_EXECUTOR, PIPELINE_WORKERS, PIPELINE_QUEUE_DEPTH, PIPELINE_RETRY_AFTER)
@@ -0,0 +1,277 @@
+"""Tender projects: stored lots, edited and rebuilt incrementally."""
+from fastapi import HTTPException
+from typing import List, Optional, Tuple
+from contextlib import contextmanager, closing
+from functools import cached_property
+import json
+import re
+import shutil
+import os
+import threading
+import logging
+import secrets
+try:
+    import fcntl
+except ImportError: # Windows builds (see initTender.spec) have no flock
+    fcntl = None
+from .config import PROJECT_MAX_UPDATES, PROJECTS_DIR
+from .cache import link_or_copy
+from .merge import PagedMerger
+from .pipeline import conversion_scheduler, PipelineError
+
+
+PROJECT_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class TenderProjects:
+    """Tenders kept on disk between requests so that single lots can be revised.
+
+    A project directory holds master.pdf, one already-converted PDF per lot,
+    project.json and the current Tender.pdf. project.json records, for the
+    master and every lot, the object ids of its pages and its bookmarks in
+    Tender.pdf. Inserting or replacing a lot converts only that lot, and
+    every change appends a PDF incremental-update section (the new lot's
+    objects plus a new page tree) to a copy of Tender.pdf, so the other lots
+    are never re-serialized. After max_updates sections the file is rebuilt
+    from the stored lot PDFs to shed the objects that are no longer used.
+    Changes to one project are serialized with an flock; all server
+    processes share the directory.
+    """
+    def __init__(self, directory: str, max_updates: int):
+        self._directory = directory
+        self.max_updates = max_updates
+
+    @cached_property
+    def directory(self) -> str:
+        os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+    def _dir(self, project_id: str) -> str:
+        return os.path.join(self.directory, project_id)
+
+    def pdf_path(self, project_id: str) -> str:
+        return os.path.join(self._dir(project_id), "Tender.pdf")
+
+    def _lot_path(self, project_id: str, lot: dict) -> str:
+        return os.path.join(self._dir(project_id), "lots", lot["pdf"])
+
+    @contextmanager
+    def _locked(self, project_id: str):
+        """Hold the project's lock; yields its state as read under the lock.
+
+        A project deleted before or while waiting for the lock is a 404.
+        """
+        missing = PipelineError(404, f"Unknown project: {project_id}")
+        if not PROJECT_ID_PATTERN.match(project_id):
+            raise missing
+        if fcntl is None:
+            state = self.get(project_id)
+            if state is None:
+                raise missing
+            yield state
+            return
+        try:
+            lock_file = open(os.path.join(self._dir(project_id), ".lock"), "a", encoding="utf-8")
+        except FileNotFoundError:
+            raise missing
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = self.get(project_id)
+                if state is None:
+                    raise missing
+                yield state
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, project_id: str) -> Optional[dict]:
+        if not PROJECT_ID_PATTERN.match(project_id):
+            return None
+        try:
+            with open(os.path.join(self._dir(project_id), "project.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save(self, state: dict):
+        state_path = os.path.join(self._dir(state["project_id"]), "project.json")
+        staged_path = f"{state_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(staged_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(staged_path, state_path)
+
+    @staticmethod
+    def describe(state: dict) -> dict:
+        page = len(state["master"]["pages"])
+        lots = []
+        for lot in state["lots"]:
+            lots.append({
+                "lot_id": lot["lot_id"],
+                "filename": lot["filename"],
+                "first_page": page + 1,
+                "last_page": page + len(lot["pages"]),
+            })
+            page += len(lot["pages"])
+        return {
+            "project_id": state["project_id"],
+            "revision": state["revision"],
+            "pages": page,
+            "lots": lots,
+            "pdf_url": f"/projects/{state['project_id']}/pdf",
+        }
+
+    def _convert(self, project_id: str, lot_paths: List[Tuple[str, str, Optional[str]]]) -> List[dict]:
+        """Convert lots one PDF each and store them in the project."""
+        lots = []
+        try:
+            with closing(conversion_scheduler.convert_lots(lot_paths, batch_images=False)) as converted_lots:
+                for (index,), lot_pdf_path, converted in converted_lots:
+                    filename, _, content_hash = lot_paths[index]
+                    lot = {"lot_id": secrets.token_hex(8), "filename": filename, "sha256": content_hash}
+                    lot["pdf"] = f"{secrets.token_hex(8)}.pdf"
+                    if converted:
+                        shutil.move(lot_pdf_path, self._lot_path(project_id, lot))
+                    else:
+                        link_or_copy(lot_pdf_path, self._lot_path(project_id, lot))
+                    lots.append(lot)
+        except HTTPException as e:
+            self._discard(project_id, lots)
+            raise PipelineError(e.status_code, str(e.detail)) from None
+        except BaseException:
+            self._discard(project_id, lots)
+            raise
+        return lots
+
+    def _discard(self, project_id: str, lots: List[dict]):
+        for lot in lots:
+            try:
+                os.unlink(self._lot_path(project_id, lot))
+            except FileNotFoundError:
+                pass
+
+    def _rebuild(self, state: dict):
+        """Write Tender.pdf from scratch."""
+        project_id = state["project_id"]
+        merger = PagedMerger()
+        staged_path = f"{self.pdf_path(project_id)}.{os.getpid()}.tmp"
+        try:
+            merger.append(os.path.join(self._dir(project_id), "master.pdf"))
+            for lot in state["lots"]:
+                merger.append(self._lot_path(project_id, lot))
+            state["xref_offset"] = merger.write(staged_path)
+            os.replace(staged_path, self.pdf_path(project_id))
+        except BaseException:
+            if os.path.exists(staged_path):
+                os.unlink(staged_path)
+            raise
+        finally:
+            merger.close()
+        for document, part in zip(merger.documents, [state["master"]] + state["lots"]):
+            part.update(document)
+        state["next_id"] = merger.next_id
+        state["updates"] = 0
+
+    def _update(self, state: dict, new_lots: List[dict]):
+        """Append new_lots and the new page order to Tender.pdf as an incremental update."""
+        if state["updates"] >= self.max_updates:
+            self._rebuild(state)
+            return
+        project_id = state["project_id"]
+        merger = PagedMerger(first_id=state["next_id"], reserved=[state["master"]] + state["lots"])
+        staged_path = f"{self.pdf_path(project_id)}.{os.getpid()}.tmp"
+        try:
+            for lot in new_lots:
+                merger.append(self._lot_path(project_id, lot))
+                lot.update(merger.documents[-1])
+            # Downloads in progress keep reading the previous revision's inode.
+            shutil.copyfile(self.pdf_path(project_id), staged_path)
+            state["xref_offset"] = merger.write_update(staged_path, state["xref_offset"], [state["master"]] + state["lots"])
+            os.replace(staged_path, self.pdf_path(project_id))
+        except BaseException:
+            if os.path.exists(staged_path):
+                os.unlink(staged_path)
+            raise
+        finally:
+            merger.close()
+        state["next_id"] = merger.next_id
+        state["updates"] += 1
+
+    def _commit(self, state: dict, new_lots: List[dict], dropped_lots: List[dict]):
+        try:
+            self._update(state, new_lots)
+        except BaseException:
+            self._discard(state["project_id"], new_lots)
+            raise
+        state["revision"] += 1
+        self._save(state)
+        self._discard(state["project_id"], dropped_lots)
+        logging.info("Project %s is at revision %s (%s incremental updates)", state["project_id"], state["revision"], state["updates"])
+        return self.describe(state)
+
+    def create(self, master_path: str, lot_paths: List[Tuple[str, str, Optional[str]]]) -> dict:
+        """Build a new project from files ingested into a directory inside self.directory."""
+        project_id = secrets.token_hex(16)
+        os.makedirs(os.path.join(self._dir(project_id), "lots"))
+        try:
+            os.replace(master_path, os.path.join(self._dir(project_id), "master.pdf"))
+            state = {
+                "project_id": project_id,
+                "revision": 1,
+                "master": {},
+                "lots": self._convert(project_id, lot_paths),
+            }
+            self._rebuild(state)
+            self._save(state)
+        except BaseException:
+            shutil.rmtree(self._dir(project_id), ignore_errors=True)
+            raise
+        return self.describe(state)
+
+    @staticmethod
+    def _lot_index(state: dict, lot_id: str) -> int:
+        for index, lot in enumerate(state["lots"]):
+            if lot["lot_id"] == lot_id:
+                return index
+        raise PipelineError(404, f"Unknown lot: {lot_id}")
+
+    def insert_lot(self, project_id: str, lot_path: Tuple[str, str, Optional[str]], position: int = None) -> dict:
+        with self._locked(project_id) as state:
+            position = len(state["lots"]) if position is None else position
+            if not 0 <= position <= len(state["lots"]):
+                raise PipelineError(400, f"position must be between 0 and {len(state['lots'])}.")
+            lot = self._convert(project_id, [lot_path])[0]
+            state["lots"].insert(position, lot)
+            return self._commit(state, [lot], [])
+
+    def replace_lot(self, project_id: str, lot_id: str, lot_path: Tuple[str, str, Optional[str]]) -> dict:
+        with self._locked(project_id) as state:
+            index = self._lot_index(state, lot_id)
+            lot = self._convert(project_id, [lot_path])[0]
+            lot["lot_id"] = lot_id # callers keep referring to the same lot
+            previous = state["lots"][index]
+            state["lots"][index] = lot
+            return self._commit(state, [lot], [previous])
+
+    def remove_lot(self, project_id: str, lot_id: str) -> dict:
+        with self._locked(project_id) as state:
+            previous = state["lots"].pop(self._lot_index(state, lot_id))
+            return self._commit(state, [], [previous])
+
+    def reorder(self, project_id: str, lot_ids: List[str]) -> dict:
+        with self._locked(project_id) as state:
+            lots = {lot["lot_id"]: lot for lot in state["lots"]}
+            if sorted(lot_ids) != sorted(lots):
+                raise PipelineError(400, "lot_ids must list every lot of the project exactly once.")
+            state["lots"] = [lots[lot_id] for lot_id in lot_ids]
+            return self._commit(state, [], [])
+
+    def delete(self, project_id: str) -> bool:
+        try:
+            with self._locked(project_id): # waits out a change in progress
+                shutil.rmtree(self._dir(project_id), ignore_errors=True)
+        except PipelineError:
+            return False
+        return True
+
+
+tender_projects = TenderProjects(PROJECTS_DIR, PROJECT_MAX_UPDATES)
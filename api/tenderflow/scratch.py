@@ -0,0 +1,238 @@
+"""Per-request scratch directories, in RAM when they fit and on disk otherwise."""
+from fastapi import HTTPException, status
+from typing import List, Optional, Tuple
+from functools import cached_property
+import shutil
+import os
+import tempfile
+import threading
+import logging
+from pathlib import Path
+import secrets
+from .config import (
+    PIPELINE_RETRY_AFTER, TEMP_QUOTA_BYTES, TEMP_RAM_JOB_BYTES, TEMP_RAM_MAX_BYTES, TEMP_RAM_ROOT, TEMP_ROOT,
+)
+from .metrics import directory_bytes
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt": # os.kill would terminate the process there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ScratchDir:
+    """One request's working directory, handed out by TempStorage.create()."""
+    def __init__(self, storage: "TempStorage", name: str, ram: bool, reserved: int):
+        self.storage = storage
+        self.name = name
+        self.path = os.path.join(storage.root, name)
+        self.ram = ram
+        self.reserved = reserved
+        self.released = False
+
+    def fit(self, total_bytes: int):
+        """Make room for total_bytes in all, moving the directory to disk if RAM cannot hold it."""
+        self.storage._fit(self, total_bytes)
+
+    def release(self):
+        """Hand the directory to the background cleaner; calling it again does nothing."""
+        self.storage._release(self)
+
+
+class TempStorage:
+    """Request-scoped scratch directories with crash-safe, bulk cleanup.
+
+    Every request gets `<root>/<pid>-<random>`. If it is expected to stay
+    under ram_job_bytes and the process's RAM budget allows, the directory
+    lives in ram_root (a tmpfs) instead, behind a symlink at the same path.
+    fit() can then spill it to disk without changing any file path.
+    release() only renames a directory into `.trash`. A background thread
+    per process deletes the trash in bulk, off the request path. At startup,
+    sweep() trashes the directories of processes that are gone (crashes,
+    kill -9, container restarts). The RAM budget and the disk quota are
+    tracked per process.
+    """
+    TRASH = ".trash"
+
+    def __init__(self, root: str, ram_root: str, ram_job_bytes: int, ram_max_bytes: int, quota_bytes: int):
+        self._root = root
+        self._ram_root = ram_root or None
+        self.ram_job_bytes = ram_job_bytes
+        self.ram_max_bytes = ram_max_bytes
+        self.quota_bytes = quota_bytes
+        self._ram_reserved = 0
+        self._disk_reserved = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._cleaner = None
+
+    # The module-level stores are built at import; their directories (and
+    # databases) are only set up when first used, so importing tender
+    # touches no disk.
+    @cached_property
+    def root(self) -> str:
+        os.makedirs(os.path.join(self._root, self.TRASH), exist_ok=True)
+        return self._root
+
+    @cached_property
+    def ram_root(self) -> Optional[str]:
+        if self._ram_root is None:
+            return None
+        try:
+            os.makedirs(os.path.join(self._ram_root, self.TRASH), exist_ok=True)
+        except OSError as e:
+            logging.warning("RAM scratch directory %s is unusable, using disk only: %s", self._ram_root, e)
+            return None
+        return self._ram_root
+
+    def _roots(self) -> List[str]:
+        return [self.root] + ([self.ram_root] if self.ram_root is not None else [])
+
+    def _reserve_disk(self, size: int):
+        """Count size against the quota (caller holds the lock)."""
+        if self.quota_bytes and self._disk_reserved + max(size, 1) > self.quota_bytes:
+            logging.warning("Scratch quota exhausted (%s/%s bytes reserved)", self._disk_reserved, self.quota_bytes)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is out of scratch space, please retry shortly.",
+                headers={"Retry-After": str(PIPELINE_RETRY_AFTER)},
+            )
+        self._disk_reserved += size
+
+    def create(self, expected_bytes: int = 0) -> ScratchDir:
+        """New scratch directory; expected_bytes is 0 when the size is unknown."""
+        name = f"{os.getpid()}-{secrets.token_hex(8)}"
+        with self._lock:
+            ram = (self.ram_root is not None and 0 < expected_bytes <= self.ram_job_bytes
+                   and self._ram_reserved + expected_bytes <= self.ram_max_bytes)
+            if ram:
+                self._ram_reserved += expected_bytes
+            else:
+                self._reserve_disk(expected_bytes)
+        scratch = ScratchDir(self, name, ram, expected_bytes)
+        try:
+            if ram:
+                os.mkdir(os.path.join(self.ram_root, name))
+                os.symlink(os.path.join(self.ram_root, name), scratch.path)
+            else:
+                os.mkdir(scratch.path)
+        except BaseException:
+            self._release(scratch)
+            raise
+        return scratch
+
+    def _fit(self, scratch: ScratchDir, total_bytes: int):
+        with self._lock:
+            if total_bytes <= scratch.reserved:
+                return
+            extra = total_bytes - scratch.reserved
+            if not scratch.ram:
+                self._reserve_disk(extra)
+                scratch.reserved = total_bytes
+                return
+            if total_bytes <= self.ram_job_bytes and self._ram_reserved + extra <= self.ram_max_bytes:
+                self._ram_reserved += extra
+                scratch.reserved = total_bytes
+                return
+            self._reserve_disk(total_bytes)
+            self._ram_reserved -= scratch.reserved
+            scratch.ram, scratch.reserved = False, total_bytes
+        ram_path = os.path.join(self.ram_root, scratch.name)
+        spill_path = f"{scratch.path}.spill"
+        shutil.copytree(ram_path, spill_path, symlinks=True)
+        os.unlink(scratch.path)
+        os.rename(spill_path, scratch.path)
+        self._to_trash(ram_path)
+        logging.info("Spilled scratch directory %s to disk (%s bytes expected)", scratch.name, total_bytes)
+
+    def _release(self, scratch: ScratchDir):
+        with self._lock:
+            if scratch.released:
+                return
+            scratch.released = True
+            if scratch.ram:
+                self._ram_reserved -= scratch.reserved
+            else:
+                self._disk_reserved -= scratch.reserved
+        if scratch.ram:
+            self._to_trash(os.path.join(self.ram_root, scratch.name))
+            try:
+                os.unlink(scratch.path)
+            except FileNotFoundError:
+                pass
+        else:
+            self._to_trash(scratch.path)
+
+    def _to_trash(self, path: str):
+        try:
+            os.rename(path, os.path.join(os.path.dirname(path), self.TRASH, os.path.basename(path)))
+        except FileNotFoundError:
+            return
+        self._start_cleaner()
+        self._wake.set()
+
+    def _start_cleaner(self):
+        with self._lock:
+            if self._cleaner is None:
+                self._cleaner = threading.Thread(target=self._clean_forever, name="tender-scratch-cleaner", daemon=True)
+                self._cleaner.start()
+
+    def _clean_forever(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            self.empty_trash()
+
+    def empty_trash(self):
+        for root in self._roots():
+            for entry in os.scandir(os.path.join(root, self.TRASH)):
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    try:
+                        os.unlink(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def sweep(self):
+        """Trash the directories of processes that no longer exist, then empty the trash."""
+        swept = 0
+        for root in self._roots():
+            for entry in os.scandir(root):
+                pid = entry.name.split("-", 1)[0]
+                if entry.name == self.TRASH or not pid.isdigit():
+                    continue
+                # Nothing of ours exists yet, so our own pid means a previous run (e.g. a restarted container).
+                if int(pid) == os.getpid() or not _pid_alive(int(pid)):
+                    if entry.is_symlink():
+                        os.unlink(entry.path) # its RAM directory is swept in ram_root
+                    else:
+                        self._to_trash(entry.path)
+                    swept += 1
+        if swept:
+            logging.info("Swept %s orphaned scratch directories", swept)
+        self._start_cleaner()
+        self._wake.set()
+
+    def usage(self) -> List[Tuple[dict, int]]:
+        samples = [({"area": "scratch"}, directory_bytes(self.root))]
+        if self.ram_root is not None:
+            samples.append(({"area": "scratch_ram"}, directory_bytes(self.ram_root)))
+        return samples
+
+
+def converted_pdf_path(source_path: str) -> str:
+    """A new empty file for a conversion's output, next to its source inside the job's directory."""
+    fd, path = tempfile.mkstemp(prefix=f"{Path(source_path).stem}-", suffix=".pdf", dir=os.path.dirname(source_path))
+    os.close(fd)
+    return path
+
+
+temp_storage = TempStorage(TEMP_ROOT, TEMP_RAM_ROOT, TEMP_RAM_JOB_BYTES, TEMP_RAM_MAX_BYTES, TEMP_QUOTA_BYTES)
@@ -0,0 +1,244 @@
+"""Resumable chunked uploads of single large files."""
+from fastapi import Request, HTTPException
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+from functools import cached_property
+import base64
+import hashlib
+import json
+import re
+import shutil
+import time
+import os
+import threading
+import logging
+import secrets
+try:
+    import fcntl
+except ImportError: # Windows builds (see initTender.spec) have no flock
+    fcntl = None
+from .config import MAX_FILE_BYTES, UPLOAD_SESSION_TTL, UPLOAD_SESSIONS_DIR
+from .cache import file_sha256, link_or_copy
+from .ingest import INGEST_FLUSH_BYTES, SNIFF_BYTES, IngestedFile, kind_from_filename, sniff_file_kind
+
+
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def parse_upload_checksum(header: Optional[str]) -> Optional[bytes]:
+    """Digest from an `Upload-Checksum: sha256 <base64 or hex>` header."""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(" ")
+    if algorithm.lower() != "sha256":
+        raise HTTPException(status_code=400, detail="Upload-Checksum must use sha256.")
+    value = value.strip()
+    try:
+        return bytes.fromhex(value) if len(value) == 64 else base64.b64decode(value, validate=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Upload-Checksum is not valid hex or base64.")
+
+
+class UploadSessions:
+    """Chunked, resumable uploads of single files, shared by all server processes.
+
+    Each session is a directory holding `meta.json` and the `data` being
+    assembled. The committed offset is simply the size of `data`: a chunk is
+    appended under an exclusive flock and cut back off again if it fails its
+    checksum or the client goes away, so a retry can always resume from the
+    reported offset. Finalized uploads are linked into job directories the
+    same way registered masters are.
+    """
+    EXPIRE_EVERY_SECONDS = 300
+
+    def __init__(self, directory: str, ttl_seconds: int):
+        self._directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._last_expiry = 0.0
+
+    @cached_property
+    def directory(self) -> str:
+        os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+    def _session_dir(self, upload_id: str) -> str:
+        return os.path.join(self.directory, upload_id)
+
+    def _data_path(self, upload_id: str) -> str:
+        return os.path.join(self._session_dir(upload_id), "data")
+
+    def _write_meta(self, upload_id: str, meta: dict):
+        meta_path = os.path.join(self._session_dir(upload_id), "meta.json")
+        staged_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(staged_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(staged_path, meta_path)
+
+    def create(self, filename: str, size: int, sha256: str = None) -> dict:
+        self._expire_if_due()
+        filename = os.path.basename(filename.replace("\\", "/"))
+        if kind_from_filename(filename) is None:
+            raise HTTPException(status_code=400, detail=f"Unsupported file type: {filename}")
+        if size < 0 or size > MAX_FILE_BYTES:
+            raise HTTPException(status_code=413, detail=f"{filename} exceeds the {MAX_FILE_BYTES} byte per-file limit.")
+        upload_id = secrets.token_hex(16)
+        os.makedirs(self._session_dir(upload_id))
+        open(self._data_path(upload_id), "wb").close()
+        meta = {
+            "upload_id": upload_id,
+            "filename": filename,
+            "size": size,
+            "expected_sha256": sha256.lower() if sha256 else None,
+            "created_at": time.time(),
+            "finalized": False,
+        }
+        self._write_meta(upload_id, meta)
+        return meta
+
+    def get(self, upload_id: str) -> Optional[dict]:
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            return None
+        try:
+            with open(os.path.join(self._session_dir(upload_id), "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            meta["offset"] = os.path.getsize(self._data_path(upload_id))
+        except FileNotFoundError:
+            return None
+        return meta
+
+    def _require(self, upload_id: str) -> dict:
+        meta = self.get(upload_id)
+        if meta is None:
+            raise HTTPException(status_code=404, detail=f"Unknown or expired upload: {upload_id}")
+        return meta
+
+    def _open_chunk(self, upload_id: str, offset: int):
+        """Open and lock the data file for a chunk at offset; returns (file, meta)."""
+        meta = self._require(upload_id)
+        if meta["finalized"]:
+            raise HTTPException(status_code=409, detail="Upload is already finalized.")
+        f = open(self._data_path(upload_id), "r+b")
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise HTTPException(status_code=409, detail="Another chunk of this upload is being written.")
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise HTTPException(
+                    status_code=409, detail=f"Expected offset {current}.", headers={"Upload-Offset": str(current)},
+                )
+            f.seek(offset)
+        except BaseException:
+            f.close()
+            raise
+        return f, meta
+
+    @staticmethod
+    def _append(f, digest, chunks: List[bytes]):
+        for chunk in chunks:
+            digest.update(chunk)
+            f.write(chunk)
+
+    def _commit_chunk(self, upload_id: str, f):
+        f.flush()
+        os.utime(self._session_dir(upload_id)) # keeps the session alive
+
+    async def write_chunk(self, upload_id: str, offset: int, request: Request, checksum: Optional[bytes]) -> int:
+        """Append the request body at offset; returns the new offset.
+
+        Opening, writing and hashing run in the thread pool, with the body
+        handed over INGEST_FLUSH_BYTES at a time.
+        """
+        f, meta = await run_in_threadpool(self._open_chunk, upload_id, offset)
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            buffered, buffered_bytes = [], 0
+            async for chunk in request.stream():
+                written += len(chunk)
+                if offset + written > meta["size"]:
+                    raise HTTPException(status_code=413, detail=f"Chunk runs past the declared size of {meta['size']} bytes.")
+                buffered.append(chunk)
+                buffered_bytes += len(chunk)
+                if buffered_bytes >= INGEST_FLUSH_BYTES:
+                    await run_in_threadpool(self._append, f, digest, buffered)
+                    buffered, buffered_bytes = [], 0
+            await run_in_threadpool(self._append, f, digest, buffered)
+            if checksum is not None and digest.digest() != checksum:
+                raise HTTPException(status_code=400, detail="Chunk checksum mismatch.")
+            await run_in_threadpool(self._commit_chunk, upload_id, f)
+        except BaseException:
+            # Inline: the chunk is all-or-nothing, and this has to happen
+            # even while the request is being cancelled.
+            f.truncate(offset)
+            raise
+        finally:
+            f.close()
+        return offset + written
+
+    def finalize(self, upload_id: str) -> dict:
+        """Check the assembled file and mark it usable as a master or lot."""
+        meta = self._require(upload_id)
+        if meta["finalized"]:
+            return meta
+        if meta["offset"] != meta["size"]:
+            raise HTTPException(
+                status_code=409, detail=f"Upload has {meta['offset']} of {meta['size']} bytes.",
+                headers={"Upload-Offset": str(meta["offset"])},
+            )
+        data_path = self._data_path(upload_id)
+        with open(data_path, "rb") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX) # wait out a chunk still being written
+            if os.fstat(f.fileno()).st_size != meta["size"]:
+                raise HTTPException(status_code=409, detail="Upload changed while finalizing, retry.")
+            kind = sniff_file_kind(f.read(SNIFF_BYTES))
+        expected_kind = kind_from_filename(meta["filename"])
+        if kind != expected_kind:
+            raise HTTPException(status_code=400, detail=f"{meta['filename']} does not look like a {expected_kind.upper()} file.")
+        sha256 = file_sha256(data_path)
+        if meta["expected_sha256"] and sha256 != meta["expected_sha256"]:
+            raise HTTPException(status_code=400, detail="File checksum does not match the sha256 given at creation.")
+        meta.update({"finalized": True, "sha256": sha256, "kind": kind})
+        meta.pop("offset")
+        self._write_meta(upload_id, meta)
+        return self.get(upload_id)
+
+    def checkout(self, upload_id: str, dest_dir: str, prefix: str) -> IngestedFile:
+        """Link a finalized upload into a job directory as `<prefix>-<filename>`, like an uploaded part."""
+        meta = self.get(upload_id)
+        if meta is None or not meta["finalized"]:
+            raise HTTPException(status_code=404, detail=f"Unknown or unfinished upload: {upload_id}")
+        ingested = IngestedFile("upload", meta["filename"], os.path.join(dest_dir, f"{prefix}-{meta['filename']}"))
+        try:
+            link_or_copy(self._data_path(upload_id), ingested.path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail=f"Unknown or unfinished upload: {upload_id}")
+        ingested.size, ingested.sha256, ingested.kind = meta["size"], meta["sha256"], meta["kind"]
+        os.utime(self._session_dir(upload_id))
+        return ingested
+
+    def delete(self, upload_id: str) -> bool:
+        if self.get(upload_id) is None:
+            return False
+        shutil.rmtree(self._session_dir(upload_id), ignore_errors=True)
+        return True
+
+    def _expire_if_due(self):
+        now = time.monotonic()
+        if now - self._last_expiry < self.EXPIRE_EVERY_SECONDS:
+            return
+        self._last_expiry = now
+        cutoff = time.time() - self.ttl_seconds
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    logging.info("Expired upload session %s", entry.name)
+            except FileNotFoundError:
+                continue
+
+
+upload_sessions = UploadSessions(UPLOAD_SESSIONS_DIR, UPLOAD_SESSION_TTL)
@@ -0,0 +1,96 @@
+"""Benchmark: image lot conversion, PIL re-encode per image vs the fast path.
+
+Generates N synthetic scans, then times
+  * legacy  - the original convert_image_to_pdf (decode, RGB, one PDF per
+              image) followed by PdfMerger.append of every temporary PDF;
+  * fast    - convert_images_to_pdf (JPEG passthrough, one PDF for
+              the whole run) followed by a single PdfMerger.append.
+
+    python benchmarks/bench_images.py --images 30 --width 2480 --height 3508
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+from PyPDF2 import PdfMerger
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+from tenderflow.config import IMAGE_MAX_DPI  # noqa: E402
+from tenderflow.convert import convert_images_to_pdf  # noqa: E402
+
+
+def legacy_convert_image_to_pdf(image_path):
+    img = Image.open(image_path)
+    if img.mode == 'RGBA' or img.mode == 'P':
+        img = img.convert("RGB")
+    temp_pdf_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+    img.save(temp_pdf_file.name)
+    temp_pdf_file.close()
+    return temp_pdf_file.name
+
+
+def make_scans(directory, count, width, height, dpi, png_every):
+    paths = []
+    for index in range(count):
+        image = Image.effect_noise((width // 4, height // 4), 40).convert("RGB").resize((width, height))
+        if png_every and index % png_every == png_every - 1:
+            path = os.path.join(directory, f"scan{index}.png")
+            image.save(path, dpi=(dpi, dpi))
+        else:
+            path = os.path.join(directory, f"scan{index}.jpg")
+            image.save(path, quality=85, dpi=(dpi, dpi))
+        paths.append(path)
+    return paths
+
+
+def timed_merge(converted_paths):
+    merger = PdfMerger()
+    for path in converted_paths:
+        merger.append(path)
+    output = io.BytesIO()
+    merger.write(output)
+    merger.close()
+    return output.getbuffer().nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--width", type=int, default=2480)
+    parser.add_argument("--height", type=int, default=3508)
+    parser.add_argument("--dpi", type=int, default=300, help="DPI recorded in the generated scans")
+    parser.add_argument("--png-every", type=int, default=0, help="make every Nth image a PNG (0: all JPEG)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_scans(directory, args.images, args.width, args.height, args.dpi, args.png_every)
+        input_bytes = sum(os.path.getsize(path) for path in paths)
+
+        started = time.perf_counter()
+        legacy_pdfs = [legacy_convert_image_to_pdf(path) for path in paths]
+        legacy_convert = time.perf_counter() - started
+        legacy_size = timed_merge(legacy_pdfs)
+        legacy_total = time.perf_counter() - started
+        for path in legacy_pdfs:
+            os.unlink(path)
+
+        started = time.perf_counter()
+        fast_pdf = convert_images_to_pdf(paths)
+        fast_convert = time.perf_counter() - started
+        fast_size = timed_merge([fast_pdf])
+        fast_total = time.perf_counter() - started
+        os.unlink(fast_pdf)
+
+    print(f"images={args.images} {args.width}x{args.height}@{args.dpi}dpi input={input_bytes / 1e6:.1f}MB "
+          f"max_dpi={IMAGE_MAX_DPI}")
+    print(f"{'path':8} {'convert':>10} {'total':>10} {'output':>10}")
+    print(f"{'legacy':8} {legacy_convert:9.2f}s {legacy_total:9.2f}s {legacy_size / 1e6:8.1f}MB")
+    print(f"{'fast':8} {fast_convert:9.2f}s {fast_total:9.2f}s {fast_size / 1e6:8.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""Benchmark harness for the /upload pipeline over growing synthetic corpora.
+
+For every corpus size it runs, each in a fresh interpreter so peak RSS is
+per-run:
+  * direct - the pipeline stages called one by one: ingest (multipart
+             parsing into a job directory), convert, merge (append() on the
+             TENDER_MERGE_ENGINE merger), write and, with --optimize,
+             optimize (the post-merge size pass);
+  * client - a full POST /upload through FastAPI's TestClient, with
+             TENDER_SERVER_TIMING=1 so the stage durations the server
+             reports in Server-Timing are recorded next to the wall time.
+
+Results go to stdout and, with --output, to a JSON file that --compare can
+diff against a run from another commit:
+
+    python benchmarks/bench_pipeline.py --sizes 1,10,100,500 --output head.json
+    python benchmarks/bench_pipeline.py --compare base.json head.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, "..", "api")
+STAGES = ("ingest", "convert", "merge", "write", "optimize")
+BOUNDARY = "tenderflow-bench-boundary"
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process and its reaped children (the conversion pools)."""
+    if resource is None:
+        return float("nan")
+    # ru_maxrss survives exec, so a child started by a large parent would report
+    # the parent's peak; VmHWM is tracked per address space.
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            own = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+    except (OSError, StopIteration):
+        pass
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024.0 # ru_maxrss is in KiB on Linux
+
+
+def multipart_chunks(master_path, lot_paths, chunk_size=256 * 1024):
+    """Yield a multipart/form-data body for the files without loading them whole."""
+    parts = [("master_file", master_path)] + [("lot_files", path) for path in lot_paths]
+    for field, path in parts:
+        yield (
+            f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{field}\"; "
+            f"filename=\"{os.path.basename(path)}\"\r\nContent-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+        yield b"\r\n"
+    yield f"--{BOUNDARY}--\r\n".encode()
+
+
+class FakeRequest:
+    """Just enough of starlette's Request for MultipartIngest.consume()."""
+    def __init__(self, master_path, lot_paths):
+        self.headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+        self._chunks = multipart_chunks(master_path, lot_paths)
+
+    async def stream(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+def run_direct(tender, master_path, lot_paths, work_dir):
+    from tenderflow.merge import new_merger
+    from tenderflow.optimize import optimize_tender_pdf
+    timings = {}
+    job_dir = tempfile.mkdtemp(dir=work_dir)
+    started = time.perf_counter()
+    ingest = tender.MultipartIngest(job_dir, BOUNDARY.encode())
+    asyncio.run(ingest.consume(FakeRequest(master_path, lot_paths)))
+    timings["ingest"] = time.perf_counter() - started
+
+    master = ingest.files_for("master_file")[0].path
+    lots = [(lot.filename, lot.path, lot.sha256) for lot in ingest.files_for("lot_files")]
+
+    started = time.perf_counter()
+    converted = list(tender.conversion_scheduler.convert_lots(lots))
+    timings["convert"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    merger = new_merger() # follows TENDER_MERGE_ENGINE
+    merger.append(master)
+    for _, pdf_path, _ in converted:
+        merger.append(pdf_path)
+    timings["merge"] = time.perf_counter() - started
+
+    output_path = os.path.join(job_dir, "Tender.pdf")
+    started = time.perf_counter()
+    merger.write(output_path)
+    merger.close()
+    timings["write"] = time.perf_counter() - started
+
+    if tender.OPTIMIZE_OUTPUT:
+        started = time.perf_counter()
+        optimize_tender_pdf(output_path)
+        timings["optimize"] = time.perf_counter() - started
+
+    output_bytes = os.path.getsize(output_path)
+    for _, pdf_path, was_converted in converted:
+        if was_converted:
+            os.unlink(pdf_path)
+    shutil.rmtree(job_dir)
+    return timings, output_bytes
+
+
+def server_timing_seconds(header: str) -> dict:
+    """{stage: seconds} from a Server-Timing header such as "ingest;dur=12.5, merge;dur=80.1"."""
+    seconds = {}
+    for entry in filter(None, (part.strip() for part in header.split(","))):
+        name, *params = entry.split(";")
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                seconds[name.strip()] = float(value) / 1000
+    return seconds
+
+
+def run_client(tender, master_path, lot_paths):
+    from fastapi.testclient import TestClient
+
+    files = [("master_file", (os.path.basename(master_path), open(master_path, "rb"), "application/pdf"))]
+    files += [("lot_files", (os.path.basename(path), open(path, "rb"), "application/octet-stream")) for path in lot_paths]
+    try:
+        with TestClient(tender.app) as client:
+            client.cookies.set("authenticated", "true")
+            started = time.perf_counter()
+            response = client.post("/upload", files=files)
+            elapsed = time.perf_counter() - started
+    finally:
+        for _, (_, handle, _) in files:
+            handle.close()
+    if response.status_code != 200:
+        raise RuntimeError(f"/upload answered {response.status_code}: {response.text[:200]}")
+    return {**server_timing_seconds(response.headers.get("server-timing", "")), "total": elapsed}, len(response.content)
+
+
+def run_one(args):
+    """Child process: run one (mode, size) point and print a JSON line."""
+    import logging
+    logging.disable(logging.INFO)
+    sys.path.insert(0, API_DIR)
+    import tender
+
+    with open(os.path.join(args.corpus, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    master_path = manifest["master"]
+    lot_paths = manifest["lots"][:args.run_one]
+    input_bytes = sum(os.path.getsize(path) for path in [master_path] + lot_paths)
+
+    runs = []
+    for _ in range(args.repeat):
+        if args.mode == "direct":
+            timings, output_bytes = run_direct(tender, master_path, lot_paths, args.work_dir)
+        else:
+            timings, output_bytes = run_client(tender, master_path, lot_paths)
+        runs.append(timings)
+    tender.conversion_scheduler.shutdown()
+    tender.pandoc_service.shutdown()
+
+    timings = {key: statistics.median(run.get(key, 0.0) for run in runs) for key in runs[0]}
+    total = timings.get("total", sum(timings.get(stage, 0.0) for stage in STAGES))
+    result = {
+        "mode": args.mode,
+        "lots": len(lot_paths),
+        "input_mb": input_bytes / 1e6,
+        "output_mb": output_bytes / 1e6,
+        "seconds": timings,
+        "total_seconds": total,
+        "lots_per_second": len(lot_paths) / total if total else None,
+        "mb_per_second": input_bytes / 1e6 / total if total else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print(json.dumps(result))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_result(result):
+    stages = " ".join(f"{stage}={result['seconds'][stage]:7.3f}s" for stage in STAGES if stage in result["seconds"])
+    print(
+        f"{result['mode']:6} lots={result['lots']:4d} in={result['input_mb']:8.1f}MB out={result['output_mb']:8.1f}MB "
+        f"total={result['total_seconds']:8.3f}s {result['lots_per_second']:7.1f} lots/s "
+        f"rss={result['peak_rss_mb']:7.1f}MB {stages}"
+    )
+
+
+def compare(base_path, head_path):
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(head_path, encoding="utf-8") as f:
+        head = json.load(f)
+    base_results = {(r["mode"], r["lots"]): r for r in base["results"]}
+    print(f"base {base['commit']} -> head {head['commit']} (ratio head/base, <1 is better)")
+    for result in head["results"]:
+        before = base_results.get((result["mode"], result["lots"]))
+        if before is None:
+            continue
+        metrics = [("total", before["total_seconds"], result["total_seconds"]),
+                   ("rss", before["peak_rss_mb"], result["peak_rss_mb"])]
+        metrics += [(stage, before["seconds"].get(stage), result["seconds"].get(stage)) for stage in STAGES]
+        cells = " ".join(f"{name}={new / old:5.2f}" for name, old, new in metrics if old and new is not None)
+        print(f"{result['mode']:6} lots={result['lots']:4d} {cells}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1,10,50", help="comma separated lot counts")
+    parser.add_argument("--modes", default="direct,client")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per point; the median is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--master-pages", type=int, default=100)
+    parser.add_argument("--docx-every", type=int, default=None,
+                        help="every Nth lot is a DOCX (default: 5 if pandoc is installed, else none)")
+    parser.add_argument("--with-cache", action="store_true", help="keep the conversion and result caches enabled")
+    parser.add_argument("--optimize", action="store_true", help="run the output optimization pass (TENDER_OPTIMIZE=1)")
+    parser.add_argument("--output", help="write machine-readable results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"), help="compare two result files and exit")
+    parser.add_argument("--run-one", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.run_one is not None:
+        run_one(args)
+        return
+
+    sys.path.insert(0, BENCH_DIR)
+    from corpus import generate_corpus
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    docx_every = args.docx_every if args.docx_every is not None else (5 if shutil.which("pandoc") else 0)
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        corpus_dir = os.path.join(work_dir, "corpus")
+        master_path, lot_paths = generate_corpus(
+            corpus_dir, max(sizes), seed=args.seed, master_pages=args.master_pages, docx_every=docx_every,
+        )
+        with open(os.path.join(corpus_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"master": master_path, "lots": lot_paths}, f)
+
+        env = dict(os.environ)
+        env.setdefault("TENDER_MASTERS_DIR", os.path.join(work_dir, "masters"))
+        env.setdefault("TENDER_JOBS_DIR", os.path.join(work_dir, "jobs"))
+        if not args.with_cache:
+            env["TENDER_CACHE_MAX_BYTES"] = "0"
+            env["TENDER_RESULT_CACHE_MAX_BYTES"] = "0"
+        if args.optimize:
+            env["TENDER_OPTIMIZE"] = "1"
+        for mode in args.modes.split(","):
+            for size in sizes:
+                output = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__), "--run-one", str(size), "--mode", mode,
+                     "--corpus", corpus_dir, "--work-dir", work_dir, "--repeat", str(args.repeat)],
+                    env=dict(env, TENDER_SERVER_TIMING="1") if mode == "client" else env, cwd=API_DIR, text=True,
+                )
+                result = json.loads(output.strip().splitlines()[-1])
+                print_result(result)
+                results.append(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": git_commit(),
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": {
+                    "seed": args.seed,
+                    "master_pages": args.master_pages,
+                    "docx_every": docx_every,
+                    "repeat": args.repeat,
+                    "with_cache": args.with_cache,
+                    "env": {key: value for key, value in env.items() if key.startswith("TENDER_")},
+                },
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
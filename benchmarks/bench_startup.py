@@ -0,0 +1,200 @@
+"""Benchmark: import time and cold start of the app.
+
+Each run is a fresh interpreter with empty storage directories and
+TENDER_LAZY_STARTUP=1, like a new serverless instance. It reports
+  * process - wall time of the whole child process (interpreter included);
+  * import  - `import tender`;
+  * login   - first GET / straight through the ASGI app, without lifespan
+              events, as a serverless handler would call it;
+  * static  - first GET /static/styles.css;
+  * warmup  - tender.warmup() afterwards (the PDF/image/DOCX imports);
+and which of PIL, PyPDF2 and pypandoc were loaded before warmup. The
+heaviest top-level imports come from one `python -X importtime` run.
+
+    python benchmarks/bench_startup.py --repeat 10 --output head.json
+    python benchmarks/bench_startup.py --compare base.json head.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, "..", "api")
+HEAVY_MODULES = ("PIL.Image", "PyPDF2", "pypandoc")
+STAGES = ("import", "login", "static", "warmup")
+STORAGE_VARIABLES = (
+    "TENDER_MASTERS_DIR", "TENDER_JOBS_DIR", "TENDER_PROJECTS_DIR", "TENDER_BATCHES_DIR",
+    "TENDER_UPLOAD_SESSIONS_DIR", "TENDER_TEMP_DIR", "TENDER_CACHE_DIR", "TENDER_RESULT_CACHE_DIR",
+)
+
+
+async def asgi_get(app, path: str) -> int:
+    """One GET through the ASGI interface; returns the status code."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"localhost"), (b"accept-encoding", b"gzip, br")],
+        "client": ("127.0.0.1", 50000), "server": ("localhost", 80),
+    }
+    response = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+
+    await app(scope, receive, send)
+    return response["status"]
+
+
+def run_one():
+    """Child process: one cold start, printed as a JSON line."""
+    import logging
+    logging.disable(logging.INFO)
+    sys.path.insert(0, API_DIR)
+    timings = {}
+    started = time.perf_counter()
+    import tender
+    timings["import"] = time.perf_counter() - started
+
+    async def first_requests():
+        for stage, path in (("login", "/"), ("static", "/static/styles.css")):
+            started = time.perf_counter()
+            status = await asgi_get(tender.app, path)
+            timings[stage] = time.perf_counter() - started
+            if status != 200:
+                raise RuntimeError(f"GET {path} answered {status}")
+
+    asyncio.run(first_requests())
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    started = time.perf_counter()
+    if hasattr(tender, "warmup"):
+        tender.warmup()
+    else: # commits before the warmup hook
+        for name in HEAVY_MODULES:
+            __import__(name)
+    timings["warmup"] = time.perf_counter() - started
+    print(json.dumps({"seconds": timings, "loaded_before_warmup": loaded}))
+
+
+def child_env(storage_dir: str) -> dict:
+    env = dict(os.environ)
+    env["TENDER_LAZY_STARTUP"] = "1"
+    env["TENDER_PANDOC_SERVICE"] = "0" # warmup would otherwise include starting pandoc
+    for variable in STORAGE_VARIABLES:
+        env[variable] = os.path.join(storage_dir, variable.lower())
+    env["TENDER_TEMP_RAM_DIR"] = ""
+    return env
+
+
+def measure(repeat: int) -> dict:
+    process_seconds, runs = [], []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as storage_dir:
+            started = time.perf_counter()
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), "--run-one"],
+                env=child_env(storage_dir), cwd=API_DIR, text=True,
+            )
+            process_seconds.append(time.perf_counter() - started)
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    seconds = {stage: statistics.median(run["seconds"][stage] for run in runs) for stage in STAGES}
+    seconds["process"] = statistics.median(process_seconds)
+    return {"seconds": seconds, "loaded_before_warmup": runs[-1]["loaded_before_warmup"]}
+
+
+def interpreter_seconds(repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", "pass"])
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def top_imports(count: int) -> list:
+    """(module, cumulative ms) of the slowest modules that tender.py imports directly."""
+    with tempfile.TemporaryDirectory() as storage_dir:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import tender"],
+            env=child_env(storage_dir), cwd=API_DIR, capture_output=True, text=True, check=True,
+        )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if len(name) - len(name.lstrip()) == 3: # " " plus two spaces per nesting level
+            modules.append((name.strip(), int(cumulative) / 1000.0))
+    return sorted(modules, key=lambda module: -module[1])[:count]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_result(result):
+    stages = " ".join(f"{stage}={result['seconds'][stage] * 1000:7.1f}ms" for stage in ("process",) + STAGES)
+    loaded = ",".join(result["loaded_before_warmup"]) or "-"
+    print(f"{stages} loaded-before-warmup={loaded}")
+    print("slowest imports: " + ", ".join(f"{name} {ms:.1f}ms" for name, ms in result["top_imports"]))
+
+
+def compare(base_path, head_path):
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(head_path, encoding="utf-8") as f:
+        head = json.load(f)
+    before, after = base["result"]["seconds"], head["result"]["seconds"]
+    print(f"base {base['commit']} -> head {head['commit']} (ratio head/base, <1 is better)")
+    print(" ".join(f"{stage}={after[stage] / before[stage]:5.2f}" for stage in ("process",) + STAGES if before.get(stage, 0) >= 0.001))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="cold starts to run; medians are reported")
+    parser.add_argument("--top", type=int, default=8, help="slowest top-level imports to list")
+    parser.add_argument("--output", help="write machine-readable results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"), help="compare two result files and exit")
+    parser.add_argument("--run-one", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.run_one:
+        run_one()
+        return
+
+    interpreter = interpreter_seconds(args.repeat)
+    print(f"bare interpreter {interpreter * 1000:.1f}ms")
+    result = measure(args.repeat)
+    result["top_imports"] = top_imports(args.top)
+    print_result(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": git_commit(),
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": {"repeat": args.repeat, "interpreter_seconds": interpreter},
+                "result": result,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Load benchmark: latency of `/upload` and `/` while N merges run concurrently.
+
+Starts the app under uvicorn in a subprocess, fires `--merges` concurrent
+tender uploads and keeps probing the login page while they run, then prints
+p50/p99 latencies for both endpoints.
+
+    python benchmarks/bench_upload_load.py --merges 8 --lots 20 --pages 200
+
+Requires httpx (already pulled in by FastAPI's TestClient).
+"""
+import argparse
+import io
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+from PIL import Image
+from PyPDF2 import PdfWriter
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+
+
+def make_pdf(pages: int) -> bytes:
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=595, height=842)
+    buf = io.BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+
+def make_jpeg(width: int = 1240, height: int = 1754) -> bytes:
+    buf = io.BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def percentile(samples, pct):
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(base_url: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(base_url + "/", timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def run_merge(base_url, files, upload_latencies, statuses):
+    started = time.perf_counter()
+    with httpx.Client(base_url=base_url, cookies={"authenticated": "true"}, timeout=600) as client:
+        response = client.post("/upload", files=files)
+    upload_latencies.append(time.perf_counter() - started)
+    statuses.append(response.status_code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--merges", type=int, default=4, help="concurrent /upload requests")
+    parser.add_argument("--lots", type=int, default=10, help="lot files per upload (half PDF, half JPEG)")
+    parser.add_argument("--pages", type=int, default=100, help="pages in the master PDF")
+    parser.add_argument("--probe-interval", type=float, default=0.05, help="seconds between GET / probes")
+    args = parser.parse_args()
+
+    master = make_pdf(args.pages)
+    lot_pdf = make_pdf(5)
+    lot_jpeg = make_jpeg()
+    files = [("master_file", ("master.pdf", master, "application/pdf"))]
+    for i in range(args.lots):
+        if i % 2:
+            files.append(("lot_files", (f"lot{i}.jpg", lot_jpeg, "image/jpeg")))
+        else:
+            files.append(("lot_files", (f"lot{i}.pdf", lot_pdf, "application/pdf")))
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "tender:app", "--port", str(port), "--log-level", "warning"],
+        cwd=API_DIR,
+        # Every merge uploads the same files; measure the pipeline, not the result cache.
+        env={**os.environ, "TENDER_RESULT_CACHE_MAX_BYTES": "0"},
+    )
+    try:
+        wait_until_up(base_url)
+        upload_latencies, statuses, probe_latencies = [], [], []
+        merges = [
+            threading.Thread(target=run_merge, args=(base_url, files, upload_latencies, statuses))
+            for _ in range(args.merges)
+        ]
+        for thread in merges:
+            thread.start()
+        with httpx.Client(base_url=base_url, timeout=60) as probe:
+            while any(thread.is_alive() for thread in merges):
+                started = time.perf_counter()
+                probe.get("/")
+                probe_latencies.append(time.perf_counter() - started)
+                time.sleep(args.probe_interval)
+        for thread in merges:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"merges={args.merges} lots={args.lots} master_pages={args.pages}")
+    print(f"/upload statuses: {dict((code, statuses.count(code)) for code in set(statuses))}")
+    for name, samples in (("/upload", upload_latencies), ("/", probe_latencies)):
+        print(
+            f"{name:8} n={len(samples):4d} "
+            f"p50={percentile(samples, 50) * 1000:8.1f}ms "
+            f"p99={percentile(samples, 99) * 1000:8.1f}ms "
+            f"mean={statistics.fmean(samples) * 1000 if samples else float('nan'):8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Synthetic tender corpus: a master PDF plus PDF, JPG, PNG and DOCX lots.
+
+Used by the benchmarks, or on its own to write a corpus to disk:
+
+    python benchmarks/corpus.py /tmp/corpus --lots 100 --master-pages 200
+
+All content is derived from --seed, so runs with the same seed are comparable.
+"""
+import argparse
+import io
+import os
+import random
+import zipfile
+
+from PIL import Image
+from PyPDF2 import PdfReader, PdfWriter
+
+A4_POINTS = (595, 842)
+
+DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+
+DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+WORDS = ("tender", "lot", "supply", "delivery", "warranty", "clause", "schedule", "price", "bidder", "award")
+
+
+def scan_image(rng: random.Random, width: int, height: int) -> Image.Image:
+    """A scan-like RGB image: low-frequency noise that compresses like a photo."""
+    size = (max(1, width // 8), max(1, height // 8))
+    noise = Image.frombytes("L", size, rng.getrandbits(8 * size[0] * size[1]).to_bytes(size[0] * size[1], "little"))
+    tint = Image.new("RGB", noise.size, tuple(rng.randint(150, 255) for _ in range(3)))
+    return Image.blend(noise.convert("RGB"), tint, 0.5).resize((width, height))
+
+
+def image_pdf_bytes(rng: random.Random, pages: int, image_size) -> bytes:
+    images = [scan_image(rng, *image_size) for _ in range(pages)]
+    buffer = io.BytesIO()
+    images[0].save(buffer, "PDF", save_all=True, append_images=images[1:], resolution=150)
+    return buffer.getvalue()
+
+
+def pdf_bytes(rng: random.Random, pages: int, image_every: int, image_size) -> bytes:
+    """A PDF of `pages` pages where every `image_every`-th page is a full-page scan."""
+    image_pages = pages // image_every if image_every else 0
+    images = PdfReader(io.BytesIO(image_pdf_bytes(rng, image_pages, image_size))) if image_pages else None
+    writer = PdfWriter()
+    for index in range(pages):
+        if images is not None and index % image_every == image_every - 1 and index // image_every < image_pages:
+            writer.add_page(images.pages[index // image_every])
+        else:
+            writer.add_blank_page(*A4_POINTS)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def docx_bytes(rng: random.Random, paragraphs: int) -> bytes:
+    body = "".join(
+        "<w:p><w:r><w:t>{}</w:t></w:r></w:p>".format(" ".join(rng.choice(WORDS) for _ in range(40)))
+        for _ in range(paragraphs)
+    )
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{body}</w:body></w:document>"
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", DOCX_CONTENT_TYPES)
+        archive.writestr("_rels/.rels", DOCX_RELS)
+        archive.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+def generate_corpus(directory: str, lots: int, seed: int = 0, master_pages: int = 100, lot_pages: int = 5,
+                    image_size=(1240, 1754), image_every: int = 10, docx_every: int = 0, png_every: int = 4):
+    """Write master.pdf and `lots` lot files into directory; returns (master, [lots]).
+
+    Lots cycle through PDF and JPG scans, with every `png_every`-th image a
+    PNG and every `docx_every`-th lot a DOCX (0 disables either).
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    master_path = os.path.join(directory, "master.pdf")
+    with open(master_path, "wb") as f:
+        f.write(pdf_bytes(rng, master_pages, image_every, image_size))
+
+    lot_paths = []
+    for index in range(lots):
+        if docx_every and index % docx_every == docx_every - 1:
+            name, data = f"lot{index:03d}.docx", docx_bytes(rng, rng.randint(5, 30))
+        elif index % 2 == 0:
+            name, data = f"lot{index:03d}.pdf", pdf_bytes(rng, lot_pages, 2, image_size)
+        else:
+            image = scan_image(rng, *image_size)
+            buffer = io.BytesIO()
+            if png_every and (index // 2) % png_every == png_every - 1:
+                name = f"lot{index:03d}.png"
+                image.save(buffer, "PNG", dpi=(150, 150))
+            else:
+                name = f"lot{index:03d}.jpg"
+                image.save(buffer, "JPEG", quality=85, dpi=(150, 150))
+            data = buffer.getvalue()
+        path = os.path.join(directory, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        lot_paths.append(path)
+    return master_path, lot_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--lots", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--master-pages", type=int, default=100)
+    parser.add_argument("--docx-every", type=int, default=0)
+    args = parser.parse_args()
+    master_path, lot_paths = generate_corpus(
+        args.directory, args.lots, seed=args.seed, master_pages=args.master_pages, docx_every=args.docx_every,
+    )
+    total = sum(os.path.getsize(path) for path in [master_path] + lot_paths)
+    print(f"wrote {len(lot_paths)} lots + master to {args.directory} ({total / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
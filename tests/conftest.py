@@ -0,0 +1,42 @@
+"""Shared fixtures: the app imported with every storage directory in a throwaway location."""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+STORAGE_ROOT = tempfile.mkdtemp(prefix="tenderflow-tests-")
+for variable, name in (
+    ("TENDER_MASTERS_DIR", "masters"), ("TENDER_JOBS_DIR", "jobs"), ("TENDER_PROJECTS_DIR", "projects"),
+    ("TENDER_BATCHES_DIR", "batches"), ("TENDER_UPLOAD_SESSIONS_DIR", "sessions"), ("TENDER_TEMP_DIR", "work"),
+    ("TENDER_CACHE_DIR", "conversions"), ("TENDER_RESULT_CACHE_DIR", "results"),
+):
+    os.environ[variable] = os.path.join(STORAGE_ROOT, name)
+os.environ["TENDER_TEMP_RAM_DIR"] = ""
+os.environ["TENDER_PANDOC_SERVICE"] = "0"
+os.environ["TENDER_WARMUP"] = "0"
+os.environ["TENDER_CONVERSION_WORKERS"] = "2"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import tender # pylint: disable=wrong-import-position
+from fastapi.testclient import TestClient # pylint: disable=wrong-import-position
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(STORAGE_ROOT, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def app_client():
+    with TestClient(tender.app) as client:
+        yield client
+
+
+@pytest.fixture
+def client(app_client):
+    """A logged-in client; the pipeline is back to idle after every test."""
+    app_client.cookies.set("authenticated", "true")
+    yield app_client
+    app_client.cookies.clear()
+    assert tender.pipeline.admitted == 0
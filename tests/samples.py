@@ -0,0 +1,79 @@
+"""Small input files for the tests. Every call returns new content, so nothing is served from a cache by accident."""
+import io
+import random
+import secrets
+
+from PIL import Image
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, DictionaryObject, FloatObject, NameObject, NumberObject, TextStringObject
+
+
+def pdf_bytes(*widths: int, height: int = 200) -> bytes:
+    """A PDF with one blank page per width; widths tell pages apart after a merge."""
+    writer = PdfWriter()
+    for width in widths or (200,):
+        writer.add_blank_page(width, height)
+    writer.add_metadata({"/Title": secrets.token_hex(8)})
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def jpeg_bytes(size=(60, 40)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, tuple(random.randrange(256) for _ in range(3))).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def png_bytes(size=(40, 60)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGBA", size, tuple(random.randrange(256) for _ in range(3)) + (128,)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def page_widths(pdf: bytes) -> list:
+    return [round(float(page.mediabox.width)) for page in PdfReader(io.BytesIO(pdf)).pages]
+
+
+def tender_files(master: bytes, *lots):
+    """Multipart parts for /upload: a master_file and (filename, bytes) lots."""
+    return [("master_file", ("master.pdf", master, "application/pdf"))] + [
+        ("lot_files", (filename, data, "application/octet-stream")) for filename, data in lots
+    ]
+
+
+def write_linked_pdf(path, width, field_name="name"):
+    """Two pages: a link on the first to the named destination "chapter" on the second, and a text field."""
+    writer = PdfWriter()
+    writer.add_blank_page(width, 100)
+    writer.add_blank_page(width + 1, 100)
+    writer.add_named_destination("chapter", 1)
+    link = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Annot"),
+        NameObject("/Subtype"): NameObject("/Link"),
+        NameObject("/Rect"): ArrayObject([FloatObject(0), FloatObject(0), FloatObject(50), FloatObject(50)]),
+        NameObject("/Dest"): TextStringObject("chapter"),
+    }))
+    writer.pages[0][NameObject("/Annots")] = ArrayObject([link])
+    field = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Annot"),
+        NameObject("/Subtype"): NameObject("/Widget"),
+        NameObject("/FT"): NameObject("/Tx"),
+        NameObject("/T"): TextStringObject(field_name),
+        NameObject("/Rect"): ArrayObject([FloatObject(0), FloatObject(60), FloatObject(90), FloatObject(80)]),
+        NameObject("/F"): NumberObject(4),
+    }))
+    writer.pages[1][NameObject("/Annots")] = ArrayObject([field])
+    writer._root_object[NameObject("/AcroForm")] = DictionaryObject({
+        NameObject("/Fields"): ArrayObject([field]),
+        NameObject("/DA"): TextStringObject("/Helv 0 Tf 0 g"),
+    })
+    with open(path, "wb") as f:
+        writer.write(f)
+    return str(path)
+
+
+def link_target(reader, page_number: int) -> int:
+    """Page number the first link on a page leads to, through the named destination tree."""
+    link = reader.pages[page_number]["/Annots"][0].get_object()
+    return reader.get_destination_page_number(reader.named_destinations[link["/Dest"]])
@@ -0,0 +1,146 @@
+import asyncio
+import io
+import json
+import threading
+import time
+import zipfile
+
+import tender
+from tenderflow import merge
+from samples import jpeg_bytes, page_widths, pdf_bytes
+
+
+def batch_request(common_image: bytes):
+    manifest = {"outputs": [
+        {"name": "A", "master": "m.pdf", "lots": ["common.jpg", "a.pdf"]},
+        {"name": "B.pdf", "master": "m.pdf", "lots": ["copy.jpg", "b.jpg"]},
+        {"name": "Broken", "master": "m.pdf", "lots": ["broken.pdf"]},
+    ]}
+    files = [
+        ("files", ("m.pdf", pdf_bytes(500), "application/pdf")),
+        ("files", ("common.jpg", common_image, "image/jpeg")),
+        ("files", ("copy.jpg", common_image, "image/jpeg")),
+        ("files", ("a.pdf", pdf_bytes(510), "application/pdf")),
+        ("files", ("b.jpg", jpeg_bytes((52, 52)), "image/jpeg")),
+        ("files", ("broken.pdf", b"%PDF-1.4\nnot really a pdf", "application/pdf")),
+    ]
+    return {"data": {"manifest": json.dumps(manifest)}, "files": files}
+
+
+def test_zip_delivery_streams_every_output_and_a_report(client, monkeypatch):
+    converted = []
+    convert_batch_lots = tender.convert_batch_lots
+    monkeypatch.setattr(tender, "convert_batch_lots", lambda lots, dest: converted.append(lots) or convert_batch_lots(lots, dest))
+
+    response = client.post("/batches", **batch_request(jpeg_bytes((51, 51))))
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert sorted(archive.namelist()) == ["A.pdf", "B.pdf", "batch.json"]
+    assert page_widths(archive.read("A.pdf")) == [500, 51, 510]
+    assert page_widths(archive.read("B.pdf")) == [500, 51, 52]
+    outputs = json.loads(archive.read("batch.json"))["outputs"]
+    assert [output["status"] for output in outputs] == ["done", "done", "failed"]
+    # common.jpg and copy.jpg have the same bytes, so they are converted once.
+    assert len(converted) == 1
+    assert sorted(filename for filename, _, _ in converted[0]) == ["a.pdf", "b.jpg", "broken.pdf", "common.jpg"]
+
+
+def test_zip_is_written_off_the_event_loop(client, monkeypatch):
+    writers = []
+    write = tender.ZipStreamBuffer.write
+
+    def spy(self, data):
+        try:
+            asyncio.get_running_loop()
+            writers.append("event loop")
+        except RuntimeError:
+            writers.append("thread")
+        return write(self, data)
+
+    monkeypatch.setattr(tender.ZipStreamBuffer, "write", spy)
+    response = client.post("/batches", **batch_request(jpeg_bytes((54, 54))))
+    assert response.status_code == 200
+    assert sorted(zipfile.ZipFile(io.BytesIO(response.content)).namelist()) == ["A.pdf", "B.pdf", "batch.json"]
+    assert writers and set(writers) == {"thread"}
+
+
+def test_links_delivery_keeps_outputs_for_download(client):
+    response = client.post("/batches?delivery=links", **batch_request(jpeg_bytes((53, 53))))
+    assert response.status_code == 200
+    batch = response.json()
+    assert batch["outputs"][2]["status"] == "failed" and "url" not in batch["outputs"][2]
+    download = client.get(batch["outputs"][1]["url"])
+    assert download.status_code == 200
+    assert 'filename="B.pdf"' in download.headers["content-disposition"]
+    assert page_widths(download.content) == [500, 53, 52]
+
+    assert client.get(f"/batches/{batch['batch_id']}").json()["outputs"] == batch["outputs"]
+    assert client.delete(f"/batches/{batch['batch_id']}").status_code == 200
+    assert client.get(f"/batches/{batch['batch_id']}").status_code == 404
+
+
+def test_invalid_manifests_are_rejected(client):
+    request = batch_request(jpeg_bytes())
+    for manifest in ("nope", {"outputs": []}, {"outputs": [{"name": "x", "master": "missing.pdf", "lots": ["a.pdf"]}]},
+                     {"outputs": [{"name": "x", "master": "b.jpg", "lots": ["a.pdf"]}]}):
+        request["data"]["manifest"] = manifest if isinstance(manifest, str) else json.dumps(manifest)
+        assert client.post("/batches", **request).status_code == 400
+
+
+def spy_on_outputs(monkeypatch):
+    """Record how many outputs merge at once, and the pipeline slots taken meanwhile."""
+    state = {"running": 0, "peak": 0, "admitted": []}
+    lock = threading.Lock()
+    build_tender_pdf = tender.build_tender_pdf
+
+    def spy(*args):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+            state["admitted"].append((state["running"], tender.pipeline.admitted))
+        time.sleep(0.05)
+        try:
+            return build_tender_pdf(*args)
+        finally:
+            with lock:
+                state["running"] -= 1
+
+    monkeypatch.setattr(tender, "build_tender_pdf", spy)
+    return state
+
+
+def many_outputs_request(count: int):
+    manifest = {"outputs": [{"name": f"T{index}", "master": "m.pdf", "lots": [f"{index}.pdf"]} for index in range(count)]}
+    files = [("files", ("m.pdf", pdf_bytes(600), "application/pdf"))] + [
+        ("files", (f"{index}.pdf", pdf_bytes(610 + index), "application/pdf")) for index in range(count)
+    ]
+    return {"data": {"manifest": json.dumps(manifest)}, "files": files}
+
+
+def test_outputs_only_run_on_idle_workers(client, monkeypatch):
+    state = spy_on_outputs(monkeypatch)
+    response = client.post("/batches?delivery=links", **many_outputs_request(6))
+    assert [output["status"] for output in response.json()["outputs"]] == ["done"] * 6
+    assert 1 < state["peak"] <= tender.pipeline.workers
+    # Every running output holds a pipeline slot of its own.
+    assert all(admitted >= running for running, admitted in state["admitted"])
+
+
+def test_busy_pipeline_runs_outputs_one_at_a_time(client, monkeypatch):
+    state = spy_on_outputs(monkeypatch)
+    monkeypatch.setattr(tender.pipeline, "_admitted", tender.pipeline.workers - 1) # other tenders hold the rest
+    response = client.post("/batches?delivery=links", **many_outputs_request(3))
+    assert [output["status"] for output in response.json()["outputs"]] == ["done"] * 3
+    assert state["peak"] == 1
+    monkeypatch.setattr(tender.pipeline, "_admitted", 0)
+
+
+def test_master_is_parsed_once_per_batch(client, monkeypatch):
+    appended = []
+    append = merge.PagedMerger.append
+    monkeypatch.setattr(merge.PagedMerger, "append", lambda merger, path: appended.append(path) or append(merger, path))
+    response = client.post("/batches?delivery=links", **many_outputs_request(4))
+    assert [output["status"] for output in response.json()["outputs"]] == ["done"] * 4
+    assert len([path for path in appended if path.endswith("-m.pdf")]) == 1
+    for index in range(4):
+        assert page_widths(client.get(f"/batches/{response.json()['batch_id']}/outputs/{index}").content) == [600, 610 + index]
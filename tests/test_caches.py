@@ -0,0 +1,74 @@
+import tender
+from tenderflow.cache import ConversionCache, conversion_cache
+from samples import jpeg_bytes, page_widths, pdf_bytes, tender_files
+
+
+def test_identical_lots_are_converted_once(client):
+    image = jpeg_bytes((70, 70))
+    hits = conversion_cache.stats()["hits"]
+    first = client.post("/upload", files=tender_files(pdf_bytes(), ("a.jpg", image)))
+    second = client.post("/upload", files=tender_files(pdf_bytes(), ("renamed.jpg", image)))
+    assert first.status_code == second.status_code == 200
+    assert conversion_cache.stats()["hits"] == hits + 1
+    assert page_widths(second.content) == [200, 70]
+
+
+def test_repeated_tender_is_answered_from_the_result_cache(client):
+    files = tender_files(pdf_bytes(150), ("a.pdf", pdf_bytes(160)), ("b.jpg", jpeg_bytes()))
+    first = client.post("/upload", files=files)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    hits = tender.result_cache.stats()["hits"]
+    second = client.post("/upload", files=files)
+    assert second.status_code == 200
+    assert second.headers["etag"] == etag
+    assert second.content == first.content
+    assert tender.result_cache.stats()["hits"] == hits + 1
+
+    already_held = client.post("/upload", files=files, headers={"If-None-Match": etag})
+    assert already_held.status_code == 412 # 304 is only for GET and HEAD
+    assert already_held.headers["etag"] == etag
+    assert already_held.content == b""
+
+
+def test_result_cache_key_follows_lot_order(client):
+    lot_a, lot_b = ("a.pdf", pdf_bytes(161)), ("b.pdf", pdf_bytes(162))
+    master = pdf_bytes()
+    first = client.post("/upload", files=tender_files(master, lot_a, lot_b))
+    swapped = client.post("/upload", files=tender_files(master, lot_b, lot_a))
+    assert first.headers["etag"] != swapped.headers["etag"]
+    assert page_widths(swapped.content) == [200, 162, 161]
+
+
+def test_conversion_cache_evicts_oldest_entries(tmp_path):
+    cache = ConversionCache(str(tmp_path / "cache"), max_bytes=250)
+    for index in range(3):
+        source = tmp_path / f"{index}.pdf"
+        source.write_bytes(bytes(100))
+        cache.store(f"{index:064x}", str(source))
+    assert cache.fetch(f"{0:064x}", str(tmp_path)) is None
+    assert cache.fetch(f"{2:064x}", str(tmp_path)) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_streamed_tender_is_cached_with_its_etag(client):
+    files = tender_files(pdf_bytes(155), ("a.pdf", pdf_bytes(165)))
+    streamed = client.post("/upload?stream=true", files=files)
+    assert streamed.status_code == 200
+    assert streamed.headers["etag"]
+
+    hits = tender.result_cache.stats()["hits"]
+    buffered = client.post("/upload", files=files)
+    assert buffered.headers["etag"] == streamed.headers["etag"]
+    assert buffered.content == streamed.content
+    assert tender.result_cache.stats()["hits"] == hits + 1
+
+
+def test_etag_matching_is_weak_and_ignores_wildcards():
+    assert tender.etag_matches('W/"abc"', '"abc"')
+    assert tender.etag_matches('"x", W/"abc"', 'W/"abc"')
+    assert tender.etag_matches('"a,b"', '"a,b"')
+    assert not tender.etag_matches("*", '"abc"')
+    assert not tender.etag_matches('"abcd", "ab"', '"abc"')
+    assert not tender.etag_matches(None, '"abc"')
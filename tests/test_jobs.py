@@ -0,0 +1,73 @@
+import time
+
+import tender
+from tenderflow import jobs
+from samples import jpeg_bytes, page_widths, pdf_bytes, tender_files
+
+
+def wait_for_job(client, job_id: str, timeout: float = 30.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
+
+
+def test_job_runs_in_the_background(client):
+    files = tender_files(pdf_bytes(240), ("a.pdf", pdf_bytes(250)), ("b.jpg", jpeg_bytes((30, 30))))
+    response = client.post("/jobs", files=files)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    job = wait_for_job(client, job_id)
+    assert job["status"] == "done"
+    assert [lot["state"] for lot in job["lots"]] == ["merged", "merged"]
+    result = client.get(job["result_url"])
+    assert result.status_code == 200
+    assert page_widths(result.content) == [240, 250, 30]
+
+
+def test_failed_job_reports_its_error(client):
+    response = client.post("/jobs", files=tender_files(pdf_bytes(), ("broken.pdf", b"%PDF-1.4\nnot really a pdf")))
+    job = wait_for_job(client, response.json()["job_id"])
+    assert job["status"] == "failed"
+    assert job["error"]
+    assert client.get(f"/jobs/{job['job_id']}/result").status_code == 409
+
+
+def test_unknown_job_is_404(client):
+    assert client.get("/jobs/" + "0" * 32).status_code == 404
+
+
+def test_long_running_job_is_not_claimed_twice(client, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 0.3)
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_SECONDS", 0.05)
+    build_tender_pdf = jobs.build_tender_pdf
+    claims = []
+
+    def slow_build(*args, **kwargs):
+        time.sleep(1.0) # one lot taking longer than JOB_STALE_SECONDS
+        claims.append(tender.job_store.claim())
+        return build_tender_pdf(*args, **kwargs)
+
+    monkeypatch.setattr(jobs, "build_tender_pdf", slow_build)
+    response = client.post("/jobs", files=tender_files(pdf_bytes(260), ("a.pdf", pdf_bytes(270))))
+    job = wait_for_job(client, response.json()["job_id"])
+    assert job["status"] == "done"
+    assert claims == [None]
+
+
+def test_job_waits_for_an_idle_pipeline_worker(client):
+    taken = 0
+    try:
+        while tender.pipeline.try_acquire_idle():
+            taken += 1
+        response = client.post("/jobs", files=tender_files(pdf_bytes(280), ("a.pdf", pdf_bytes(290))))
+        time.sleep(0.5)
+        assert client.get(f"/jobs/{response.json()['job_id']}").json()["status"] == "queued"
+    finally:
+        for _ in range(taken):
+            tender.pipeline.release()
+    job = wait_for_job(client, response.json()["job_id"])
+    assert job["status"] == "done"
@@ -0,0 +1,40 @@
+from samples import page_widths, pdf_bytes
+from tenderflow.merge import PagedMerger
+
+
+def test_registered_master_is_reused_by_id(client):
+    master = pdf_bytes(210, 220)
+    response = client.post("/masters", files=[("master_file", ("master.pdf", master, "application/pdf"))])
+    assert response.status_code == 200
+    registered = response.json()
+    assert registered["pages"] == 2
+    assert client.post("/masters", files=[("master_file", ("again.pdf", master, "application/pdf"))]).json() == registered
+    assert registered["master_id"] in [entry["master_id"] for entry in client.get("/masters").json()]
+
+    response = client.post("/upload", data={"master_id": registered["master_id"]},
+                           files=[("lot_files", ("a.pdf", pdf_bytes(230), "application/pdf"))])
+    assert response.status_code == 200
+    assert page_widths(response.content) == [210, 220, 230]
+
+    assert client.delete(f"/masters/{registered['master_id']}").status_code == 200
+    assert client.get(f"/masters/{registered['master_id']}").status_code == 404
+
+
+def test_unknown_master_id_is_404(client):
+    response = client.post("/upload", data={"master_id": "0" * 64},
+                           files=[("lot_files", ("a.pdf", pdf_bytes(), "application/pdf"))])
+    assert response.status_code == 404
+
+
+def test_upload_starts_from_the_registered_snapshot(client, monkeypatch):
+    registered = client.post("/masters", files=[("master_file", ("master.pdf", pdf_bytes(210), "application/pdf"))]).json()
+    assert set(client.get(f"/masters/{registered['master_id']}").json()) == {"master_id", "filename", "size", "pages"}
+
+    appended = []
+    append = PagedMerger.append
+    monkeypatch.setattr(PagedMerger, "append", lambda self, fileobj: appended.append(fileobj) or append(self, fileobj))
+    response = client.post("/upload", data={"master_id": registered["master_id"]},
+                           files=[("lot_files", ("a.pdf", pdf_bytes(230), "application/pdf"))])
+    assert response.status_code == 200
+    assert page_widths(response.content) == [210, 230]
+    assert len(appended) == 1 # the lot; the master was parsed at registration
@@ -0,0 +1,104 @@
+import io
+
+from PyPDF2 import PdfReader, PdfWriter
+
+from tenderflow import convert, merge
+from samples import jpeg_bytes, link_target, write_linked_pdf
+
+
+def write_pdf(path, *widths, outline=None):
+    writer = PdfWriter()
+    for width in widths:
+        writer.add_blank_page(width, 100)
+    for title, page in outline or ():
+        writer.add_outline_item(title, page)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return str(path)
+
+
+def test_paged_merger_keeps_pages_and_bookmarks(tmp_path):
+    merger = merge.PagedMerger(spool_dir=str(tmp_path))
+    merger.append(write_pdf(tmp_path / "a.pdf", 10, 20, outline=[("First", 0), ("Second", 1)]))
+    merger.append(write_pdf(tmp_path / "b.pdf", 30, outline=[("Third", 0)]))
+    output = io.BytesIO()
+    merger.write(output)
+    merger.close()
+
+    reader = PdfReader(output)
+    assert [round(float(page.mediabox.width)) for page in reader.pages] == [10, 20, 30]
+    assert [(item.title, reader.get_destination_page_number(item)) for item in reader.outline] == [
+        ("First", 0), ("Second", 1), ("Third", 2),
+    ]
+
+
+def test_paged_merger_writes_shared_resources_once(tmp_path):
+    image = tmp_path / "lot.jpg"
+    image.write_bytes(jpeg_bytes((80, 80)))
+    lot_pdf = convert.convert_images_to_pdf([str(image)])
+    merger = merge.PagedMerger(spool_dir=str(tmp_path))
+    merger.append(lot_pdf)
+    merger.append(lot_pdf)
+    output = io.BytesIO()
+    merger.write(output)
+    merger.close()
+
+    assert merger.duplicates >= 1
+    assert output.getvalue().count(b"/Subtype /Image") == 1
+    assert len(PdfReader(output).pages) == 2
+
+
+def test_paged_merger_update_is_incremental(tmp_path):
+    merger = merge.PagedMerger(spool_dir=str(tmp_path))
+    merger.append(write_pdf(tmp_path / "a.pdf", 10))
+    output = tmp_path / "out.pdf"
+    xref = merger.write(str(output))
+    merger.close()
+    size = output.stat().st_size
+
+    update = merge.PagedMerger(spool_dir=str(tmp_path), first_id=merger.next_id)
+    update.append(write_pdf(tmp_path / "b.pdf", 20))
+    update.write_update(str(output), xref, merger.documents + update.documents)
+    update.close()
+
+    data = output.read_bytes()
+    assert data.count(b"%%EOF") == 2
+    assert [round(float(page.mediabox.width)) for page in PdfReader(io.BytesIO(data)).pages] == [10, 20]
+    assert output.stat().st_size > size
+
+
+def test_paged_merger_keeps_named_destinations_and_forms(tmp_path):
+    merger = merge.PagedMerger(spool_dir=str(tmp_path))
+    merger.append(write_linked_pdf(tmp_path / "a.pdf", 10))
+    merger.append(write_pdf(tmp_path / "plain.pdf", 30))
+    merger.append(write_linked_pdf(tmp_path / "b.pdf", 20))
+    output = io.BytesIO()
+    merger.write(output)
+    merger.close()
+
+    reader = PdfReader(output)
+    assert sorted(reader.named_destinations) == ["chapter", "chapter-2"]
+    # Each document's link still leads to its own chapter page.
+    assert link_target(reader, 0) == 1
+    assert link_target(reader, 3) == 4
+    assert reader.pages[3]["/Annots"][0].get_object()["/Dest"] == "chapter-2"
+    assert sorted(reader.get_fields()) == ["name", "name-2"]
+    assert reader.trailer["/Root"]["/AcroForm"]["/DA"] == "/Helv 0 Tf 0 g"
+
+
+def test_incremental_update_keeps_names_unique(tmp_path):
+    merger = merge.PagedMerger(spool_dir=str(tmp_path))
+    merger.append(write_linked_pdf(tmp_path / "a.pdf", 10))
+    output = tmp_path / "out.pdf"
+    xref = merger.write(str(output))
+    merger.close()
+
+    update = merge.PagedMerger(spool_dir=str(tmp_path), first_id=merger.next_id, reserved=merger.documents)
+    update.append(write_linked_pdf(tmp_path / "b.pdf", 20))
+    update.write_update(str(output), xref, merger.documents + update.documents)
+    update.close()
+
+    reader = PdfReader(str(output))
+    assert link_target(reader, 0) == 1
+    assert link_target(reader, 2) == 3
+    assert sorted(reader.get_fields()) == ["name", "name-2"]
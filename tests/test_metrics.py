@@ -0,0 +1,39 @@
+from samples import pdf_bytes, tender_files
+
+
+def metric_value(body: str, series: str) -> float:
+    for line in body.splitlines():
+        if line.startswith(series + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_upload_is_counted_and_timed(client):
+    series = 'tender_requests_total{entry_point="upload",outcome="ok"}'
+    before = metric_value(client.get("/metrics").text, series)
+    assert client.post("/upload", files=tender_files(pdf_bytes(), ("a.pdf", pdf_bytes()))).status_code == 200
+
+    body = client.get("/metrics").text
+    assert metric_value(body, series) == before + 1
+    assert 'tender_stage_seconds_bucket{stage="merge",le="+Inf"}' in body
+    assert "tender_pipeline_capacity" in body
+
+
+def test_cached_uploads_are_counted(client):
+    files = tender_files(pdf_bytes(), ("a.pdf", pdf_bytes()))
+    first = client.post("/upload", files=files)
+    body = client.get("/metrics").text
+    hits = metric_value(body, 'tender_requests_total{entry_point="upload",outcome="cache_hit"}')
+    not_modified = metric_value(body, 'tender_requests_total{entry_point="upload",outcome="not_modified"}')
+
+    assert client.post("/upload", files=files).status_code == 200
+    assert client.post("/upload", files=files, headers={"If-None-Match": first.headers["etag"]}).status_code == 412
+    body = client.get("/metrics").text
+    assert metric_value(body, 'tender_requests_total{entry_point="upload",outcome="cache_hit"}') == hits + 1
+    assert metric_value(body, 'tender_requests_total{entry_point="upload",outcome="not_modified"}') == not_modified + 1
+
+
+def test_metrics_need_no_login(app_client):
+    response = app_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
@@ -0,0 +1,61 @@
+import io
+
+from PIL import Image
+from PyPDF2 import PdfReader
+
+from tenderflow import merge, optimize
+from samples import link_target, page_widths, pdf_bytes, tender_files, write_linked_pdf
+
+
+def scanned_pdf_bytes() -> bytes:
+    """A 600 dpi scan on a 144 point wide page, as a scanner's own PDF would hold it."""
+    buffer = io.BytesIO()
+    Image.effect_noise((1200, 1200), 64).convert("RGB").save(buffer, "PDF", resolution=600.0, quality=95)
+    return buffer.getvalue()
+
+
+def first_image_width(pdf: bytes, page: int) -> int:
+    xobjects = PdfReader(io.BytesIO(pdf)).pages[page]["/Resources"]["/XObject"]
+    return int(next(iter(xobjects.values())).get_object()["/Width"])
+
+
+def test_optimize_downsamples_oversized_images(client):
+    files = tender_files(pdf_bytes(), ("scan.pdf", scanned_pdf_bytes()))
+    plain = client.post("/upload?optimize=false", files=files)
+    optimized = client.post("/upload?optimize=true", files=files)
+    assert plain.status_code == optimized.status_code == 200
+    assert "x-tender-optimization" not in plain.headers
+    assert "x-tender-optimization" in optimized.headers
+    assert len(optimized.content) < len(plain.content)
+    assert page_widths(optimized.content) == page_widths(plain.content) == [200, 144]
+    assert first_image_width(plain.content, 1) == 1200
+    assert first_image_width(optimized.content, 1) < 1200
+
+
+def test_optimized_and_plain_tenders_are_cached_apart(client):
+    files = tender_files(pdf_bytes(), ("a.pdf", pdf_bytes()))
+    plain = client.post("/upload", files=files)
+    optimized = client.post("/upload?optimize=true", files=files)
+    assert plain.headers["etag"] != optimized.headers["etag"]
+
+
+def test_optimize_rewrites_the_file_in_place(tmp_path):
+    path = write_linked_pdf(tmp_path / "linked.pdf", 100)
+    with open(tmp_path / "scan.pdf", "wb") as f:
+        f.write(scanned_pdf_bytes())
+    merged = tmp_path / "Tender.pdf"
+    merger = merge.PagedMerger(spool_dir=str(tmp_path))
+    merger.append(path)
+    merger.append(str(tmp_path / "scan.pdf"))
+    merger.write(str(merged))
+    merger.close()
+    before = merged.read_bytes()
+
+    report = optimize.optimize_tender_pdf(str(merged))
+    assert report["tool"] == "pikepdf"
+    assert report["images_downsampled"] == 1
+    assert report["bytes_after"] == merged.stat().st_size < len(before)
+    reader = PdfReader(str(merged))
+    assert link_target(reader, 0) == 1
+    assert list(reader.get_fields()) == ["name"]
+    assert first_image_width(merged.read_bytes(), 2) < 1200
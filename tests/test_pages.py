@@ -0,0 +1,58 @@
+import gzip
+
+import tender
+from tenderflow import frontend
+
+
+def test_login_page_is_cached_and_revalidated(app_client):
+    response = app_client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["cache-control"] == f"public, max-age={tender.PAGE_MAX_AGE}"
+    assert "accept-encoding" in response.headers["vary"].lower()
+    etag = response.headers["etag"]
+
+    revalidated = app_client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == etag
+
+    plain = app_client.get("/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["etag"] != etag
+    assert plain.content == gzip.decompress(tender.pages.get("login").variants["gzip"][0])
+
+
+def test_failed_login_is_not_cached(app_client):
+    response = app_client.post("/login", data={"username": "crm", "password": "wrong"})
+    assert response.status_code == 401
+    assert response.headers["cache-control"] == "no-store"
+    assert "Invalid username or password" in response.text
+
+
+def test_upload_page_needs_login(app_client):
+    assert app_client.get("/upload", follow_redirects=False).status_code == 303
+    app_client.cookies.set("authenticated", "true")
+    try:
+        response = app_client.get("/upload")
+    finally:
+        app_client.cookies.clear()
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "private, no-cache"
+
+
+def test_versioned_static_assets_are_immutable(app_client):
+    url = tender.pages.static_url("styles.css")
+    assert url in app_client.get("/", headers={"Accept-Encoding": "identity"}).text
+    assert "immutable" in app_client.get(url).headers["cache-control"]
+    assert app_client.get("/static/styles.css").headers["cache-control"] == "public, no-cache"
+    for query in ("nov=1", "v=0123456789ab", "v=&x=1"):
+        assert app_client.get(f"/static/styles.css?{query}").headers["cache-control"] == "public, no-cache"
+
+
+def test_preferred_encoding_follows_q_values():
+    available = {"identity": None, "gzip": None, "br": None}
+    assert frontend.preferred_encoding("gzip, br", available) == "br"
+    assert frontend.preferred_encoding("br;q=0.5, gzip", available) == "gzip"
+    assert frontend.preferred_encoding("gzip;q=0.8", available) == "gzip"
+    assert frontend.preferred_encoding("gzip;q=0, identity", available) == "identity"
+    assert frontend.preferred_encoding("", available) == "identity"
@@ -0,0 +1,88 @@
+import time
+
+from tenderflow import pandoc
+
+
+class FlakyWorker:
+    """Stands in for PandocWorker; the first start fails like a missing pandoc would."""
+    starts = 0
+
+    def __init__(self, prime_caches):
+        FlakyWorker.starts += 1
+        self.first = FlakyWorker.starts == 1
+
+    def wait_ready(self, timeout):
+        if self.first:
+            raise pandoc.PandocWorkerError("pandoc is missing")
+
+
+def test_failed_worker_start_backs_off_and_retries(monkeypatch):
+    monkeypatch.setattr(pandoc, "PandocWorker", FlakyWorker)
+    monkeypatch.setattr(FlakyWorker, "starts", 0)
+    service = pandoc.PandocService(True, 1, 10.0, 5, False)
+    service.RETRY_MIN_SECONDS = 0.2
+
+    assert service._checkout() is None
+    assert service.enabled and not service.available
+    assert service._checkout() is None # no new start during the backoff
+    assert FlakyWorker.starts == 1
+
+    time.sleep(0.25)
+    assert service.available
+    assert isinstance(service._checkout(), FlakyWorker)
+    assert FlakyWorker.starts == 2
+    assert service._retry_seconds == 0.0
+
+
+class FakeWorker:
+    """Stands in for PandocWorker; converts instantly and remembers how it was stopped."""
+    started = []
+
+    def __init__(self, prime_caches):
+        self.jobs_done = 0
+        self.alive = True
+        self.stopped = None
+        FakeWorker.started.append(self)
+
+    def wait_ready(self, timeout):
+        pass
+
+    def convert(self, source_path, output_path, timeout):
+        self.jobs_done += 1
+        return {"ok": True, "seconds": 0.01}
+
+    def close(self):
+        self.stopped = "closed"
+
+    def kill(self):
+        self.stopped = "killed"
+
+
+def test_shutdown_kills_busy_workers(monkeypatch):
+    monkeypatch.setattr(pandoc, "PandocWorker", FakeWorker)
+    monkeypatch.setattr(FakeWorker, "started", [])
+    service = pandoc.PandocService(True, 2, 10.0, 5, False)
+    busy = service._checkout()
+    service._checkin(service._checkout())
+    idle = FakeWorker.started[1]
+
+    service.shutdown()
+    assert (busy.stopped, idle.stopped) == ("killed", "closed")
+    assert not service.available
+    assert service.convert("a.docx", "a.pdf") is False
+
+
+def test_other_processes_convert_on_the_listening_service(monkeypatch):
+    monkeypatch.setattr(pandoc, "PandocWorker", FakeWorker)
+    monkeypatch.setattr(FakeWorker, "started", [])
+    service = pandoc.PandocService(True, 1, 10.0, 5, False)
+    # A pipeline process's copy of the service, connected the way _mark_pipeline_process does it.
+    remote = pandoc.PandocService(True, 1, 10.0, 5, False)
+    remote.connect(*service.listen())
+    try:
+        assert remote.convert("a.docx", "a.pdf") is True
+        assert remote.convert("b.docx", "b.pdf") is True
+        assert len(FakeWorker.started) == 1
+        assert service.stats()["conversions"] == 2
+    finally:
+        service.shutdown()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tender
+from tenderflow import pipeline, projects
+from samples import jpeg_bytes, page_widths, pdf_bytes, tender_files
+
+
+@pytest.fixture
+def project(client):
+    files = tender_files(pdf_bytes(400), ("a.pdf", pdf_bytes(410)), ("b.jpg", jpeg_bytes((42, 42))))
+    response = client.post("/projects", files=files)
+    assert response.status_code == 201
+    return response.json()
+
+
+def project_pdf(client, project_id: str) -> bytes:
+    response = client.get(f"/projects/{project_id}/pdf")
+    assert response.status_code == 200
+    return response.content
+
+
+def test_lot_changes_are_appended_as_incremental_updates(client, project):
+    project_id = project["project_id"]
+    original = project_pdf(client, project_id)
+    assert page_widths(original) == [400, 410, 42]
+    assert original.count(b"%%EOF") == 1
+
+    response = client.post(f"/projects/{project_id}/lots", data={"position": "1"},
+                           files=[("lot_files", ("c.pdf", pdf_bytes(420, 430), "application/pdf"))])
+    assert response.status_code == 200
+    assert [(lot["first_page"], lot["last_page"]) for lot in response.json()["lots"]] == [(2, 2), (3, 4), (5, 5)]
+    updated = project_pdf(client, project_id)
+    assert updated.startswith(original) # the earlier revision is left untouched
+    assert updated.count(b"%%EOF") == 2
+    assert page_widths(updated) == [400, 410, 420, 430, 42]
+
+    lot_ids = [lot["lot_id"] for lot in response.json()["lots"]]
+    response = client.put(f"/projects/{project_id}/lots/{lot_ids[1]}", files=[("lot_files", ("d.jpg", jpeg_bytes((43, 43)), "image/jpeg"))])
+    assert response.json()["lots"][1]["lot_id"] == lot_ids[1]
+    assert client.put(f"/projects/{project_id}/order", json={"lot_ids": lot_ids[::-1]}).status_code == 200
+    assert client.delete(f"/projects/{project_id}/lots/{lot_ids[0]}").json()["revision"] == 5
+    assert page_widths(project_pdf(client, project_id)) == [400, 42, 43]
+
+
+def test_project_is_rebuilt_after_max_updates(client, project, monkeypatch):
+    monkeypatch.setattr(tender.tender_projects, "max_updates", 1)
+    project_id = project["project_id"]
+    lot_ids = [lot["lot_id"] for lot in project["lots"]]
+    client.put(f"/projects/{project_id}/order", json={"lot_ids": lot_ids[::-1]})
+    assert project_pdf(client, project_id).count(b"%%EOF") == 2
+    client.put(f"/projects/{project_id}/order", json={"lot_ids": lot_ids})
+    rebuilt = project_pdf(client, project_id)
+    assert rebuilt.count(b"%%EOF") == 1
+    assert page_widths(rebuilt) == [400, 410, 42]
+
+
+def test_project_pdf_etag_follows_the_revision(client, project):
+    project_id = project["project_id"]
+    etag = client.get(f"/projects/{project_id}/pdf").headers["etag"]
+    assert client.get(f"/projects/{project_id}/pdf", headers={"If-None-Match": etag}).status_code == 304
+    client.put(f"/projects/{project_id}/order", json={"lot_ids": [lot["lot_id"] for lot in project["lots"]][::-1]})
+    assert client.get(f"/projects/{project_id}/pdf", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_project_errors(client, project):
+    project_id = project["project_id"]
+    assert client.put(f"/projects/{project_id}/order", json={"lot_ids": ["nope"]}).status_code == 400
+    assert client.delete(f"/projects/{project_id}/lots/nope").status_code == 404
+    assert client.delete(f"/projects/{project_id}").status_code == 200
+    assert client.get(f"/projects/{project_id}").status_code == 404
+    assert client.delete(f"/projects/{project_id}/lots/nope").status_code == 404
+
+
+@pytest.mark.skipif(projects.fcntl is None, reason="projects are only locked where flock exists")
+def test_change_waiting_on_a_deleted_project_is_404(client, project):
+    project_id, lot_id = project["project_id"], project["lots"][0]["lot_id"]
+    with open(os.path.join(tender.tender_projects.directory, project_id, ".lock"), "a", encoding="utf-8") as lock_file:
+        projects.fcntl.flock(lock_file, projects.fcntl.LOCK_EX)
+        with ThreadPoolExecutor(1) as executor:
+            removal = executor.submit(tender.tender_projects.remove_lot, project_id, lot_id)
+            time.sleep(0.2) # let it block on the lock
+            shutil.rmtree(os.path.join(tender.tender_projects.directory, project_id))
+            projects.fcntl.flock(lock_file, projects.fcntl.LOCK_UN)
+            with pytest.raises(pipeline.PipelineError) as error:
+                removal.result(timeout=10)
+    assert error.value.status_code == 404
+    assert client.delete(f"/projects/{project_id}/lots/{lot_id}").status_code == 404
@@ -0,0 +1,91 @@
+import asyncio
+import base64
+import hashlib
+
+from tenderflow import uploads
+from samples import jpeg_bytes, page_widths, pdf_bytes
+
+
+def create_upload(client, filename: str, data: bytes) -> str:
+    response = client.post("/uploads", json={"filename": filename, "size": len(data), "sha256": hashlib.sha256(data).hexdigest()})
+    assert response.status_code == 201
+    return response.json()["upload_id"]
+
+
+def put_chunk(client, upload_id: str, offset: int, chunk: bytes, checksum: bytes = None):
+    headers = {"Upload-Offset": str(offset)}
+    if checksum is not None:
+        headers["Upload-Checksum"] = "sha256 " + base64.b64encode(checksum).decode()
+    return client.put(f"/uploads/{upload_id}", content=chunk, headers=headers)
+
+
+def test_chunks_resume_from_the_committed_offset(client):
+    master = pdf_bytes(310, 320)
+    upload_id = create_upload(client, "master.pdf", master)
+    half = len(master) // 2
+
+    response = put_chunk(client, upload_id, 0, master[:half], hashlib.sha256(b"something else").digest())
+    assert response.status_code == 400
+    assert client.head(f"/uploads/{upload_id}").headers["upload-offset"] == "0"
+
+    response = put_chunk(client, upload_id, 0, master[:half], hashlib.sha256(master[:half]).digest())
+    assert response.status_code == 204
+    assert response.headers["upload-offset"] == str(half)
+
+    response = put_chunk(client, upload_id, 5, master[half:])
+    assert response.status_code == 409
+    assert response.headers["upload-offset"] == str(half)
+    assert client.post(f"/uploads/{upload_id}/finalize").status_code == 409
+
+    assert put_chunk(client, upload_id, half, master[half:] + b"extra").status_code == 413
+    assert put_chunk(client, upload_id, half, master[half:]).status_code == 204
+    finalized = client.post(f"/uploads/{upload_id}/finalize").json()
+    assert finalized["finalized"] and finalized["kind"] == "pdf"
+
+    lot = jpeg_bytes((45, 45))
+    lot_id = create_upload(client, "lot.jpg", lot)
+    assert put_chunk(client, lot_id, 0, lot).status_code == 204
+    assert client.post(f"/uploads/{lot_id}/finalize").status_code == 200
+
+    response = client.post("/upload", files=[
+        ("master_upload_id", (None, upload_id)),
+        ("lot_files", ("a.pdf", pdf_bytes(330), "application/pdf")),
+        ("lot_upload_id", (None, lot_id)),
+    ])
+    assert response.status_code == 200
+    assert page_widths(response.content) == [310, 320, 330, 45]
+
+
+def test_finalize_checks_the_whole_file_hash(client):
+    data = pdf_bytes()
+    response = client.post("/uploads", json={"filename": "m.pdf", "size": len(data), "sha256": "0" * 64})
+    upload_id = response.json()["upload_id"]
+    assert put_chunk(client, upload_id, 0, data).status_code == 204
+    response = client.post(f"/uploads/{upload_id}/finalize")
+    assert response.status_code == 400
+    assert "checksum" in response.json()["detail"]
+
+
+def test_unknown_upload_is_404(client):
+    assert client.get("/uploads/" + "0" * 32).status_code == 404
+    assert client.post("/uploads", json={"filename": "x.exe", "size": 3}).status_code == 400
+
+
+def test_chunks_are_written_off_the_event_loop(client, monkeypatch):
+    writers = []
+    append = uploads.UploadSessions._append
+
+    def spy(f, digest, chunks):
+        try:
+            asyncio.get_running_loop()
+            writers.append("event loop")
+        except RuntimeError:
+            writers.append("thread")
+        append(f, digest, chunks)
+
+    monkeypatch.setattr(uploads.UploadSessions, "_append", staticmethod(spy))
+    data = pdf_bytes(330)
+    upload_id = create_upload(client, "lot.pdf", data)
+    assert put_chunk(client, upload_id, 0, data, hashlib.sha256(data).digest()).status_code == 204
+    assert writers and set(writers) == {"thread"}
+    assert client.post(f"/uploads/{upload_id}/finalize").json()["sha256"] == hashlib.sha256(data).hexdigest()
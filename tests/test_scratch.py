@@ -0,0 +1,73 @@
+import os
+
+import pytest
+from fastapi import HTTPException
+
+import tender
+from tenderflow import scratch
+from samples import jpeg_bytes, pdf_bytes, tender_files
+
+
+def storage(tmp_path, **limits):
+    settings = {"ram_job_bytes": 1000, "ram_max_bytes": 1500, "quota_bytes": 0}
+    settings.update(limits)
+    return scratch.TempStorage(str(tmp_path / "disk"), str(tmp_path / "ram"), **settings)
+
+
+def test_small_requests_start_in_ram_and_spill_to_disk(tmp_path):
+    temp_storage = storage(tmp_path)
+    scratch = temp_storage.create(500)
+    assert scratch.ram and os.path.islink(scratch.path)
+    with open(os.path.join(scratch.path, "lot.pdf"), "wb") as f:
+        f.write(b"x" * 10)
+
+    scratch.fit(5000)
+    assert not scratch.ram and not os.path.islink(scratch.path)
+    with open(os.path.join(scratch.path, "lot.pdf"), "rb") as f:
+        assert f.read() == b"x" * 10
+
+    scratch.release()
+    assert not os.path.exists(scratch.path)
+
+
+def test_unknown_sizes_and_a_full_ram_budget_use_disk(tmp_path):
+    temp_storage = storage(tmp_path)
+    assert not temp_storage.create(0).ram
+    assert temp_storage.create(1000).ram
+    assert not temp_storage.create(1000).ram # 2000 would exceed ram_max_bytes
+
+
+def test_disk_quota_answers_503(tmp_path):
+    temp_storage = storage(tmp_path, quota_bytes=3000)
+    scratch = temp_storage.create(2000)
+    with pytest.raises(HTTPException) as error:
+        temp_storage.create(2000)
+    assert error.value.status_code == 503
+    scratch.release()
+    temp_storage.create(2000).release()
+
+
+def test_sweep_trashes_directories_of_dead_processes(tmp_path):
+    temp_storage = storage(tmp_path)
+    orphan = os.path.join(temp_storage.root, f"{2 ** 22 + 1}-deadbeef")
+    os.mkdir(orphan)
+    temp_storage.sweep()
+    assert not os.path.exists(orphan)
+
+
+def test_uploads_spill_to_disk_before_converting(client, tmp_path, monkeypatch):
+    temp_storage = storage(tmp_path, ram_job_bytes=10 ** 6, ram_max_bytes=10 ** 6)
+    monkeypatch.setattr(tender, "temp_storage", temp_storage)
+    placements = []
+    fit = tender.ScratchDir.fit
+
+    def spy(scratch, total_bytes):
+        placements.append(scratch.ram)
+        fit(scratch, total_bytes)
+        placements.append(scratch.ram)
+
+    monkeypatch.setattr(tender.ScratchDir, "fit", spy)
+    monkeypatch.setattr(tender, "TEMP_CONVERTED_BYTES_PER_INPUT_BYTE", {"pdf": 1, "image": 1000})
+    response = client.post("/upload?stream=false", files=tender_files(pdf_bytes(), ("a.jpg", jpeg_bytes())))
+    assert response.status_code == 200
+    assert placements == [True, False] # the small body started in RAM, its conversions would not fit
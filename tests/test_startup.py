@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import tender
+from tenderflow import convert, lazy, merge
+
+API_DIR = os.path.dirname(os.path.abspath(tender.__file__))
+
+
+def test_import_leaves_the_pdf_and_image_stacks_unloaded():
+    script = (
+        "import json, sys, tender; "
+        "print(json.dumps([name for name in ('PIL.Image', 'PyPDF2', 'pypandoc') if name in sys.modules]))"
+    )
+    output = subprocess.check_output([sys.executable, "-c", script], cwd=API_DIR, env=dict(os.environ), text=True)
+    assert json.loads(output.strip().splitlines()[-1]) == []
+
+
+def test_warmup_loads_the_lazy_modules(app_client):
+    response = app_client.get("/warmup")
+    assert response.status_code == 200
+    assert set(response.json()) == {"imported", "seconds"}
+    loaded = (lazy.PyPDF2, lazy.Image, merge.PyPDF2, merge.generic, convert.Image)
+    assert all(not isinstance(module, lazy.LazyModule) for module in loaded)
+
+
+def test_warmup_does_nothing_once_warm(app_client, monkeypatch):
+    app_client.get("/warmup")
+    monkeypatch.setattr(tender, "_warmup", lambda: pytest.fail("warmed up twice"))
+    response = app_client.get("/warmup")
+    assert response.json() == {"imported": [], "seconds": 0.0}
+    assert tender.warmup() == {"imported": [], "seconds": 0.0}
+
+
+def test_import_leaves_the_storage_directories_alone(tmp_path):
+    env = dict(os.environ)
+    for variable in ("TENDER_MASTERS_DIR", "TENDER_JOBS_DIR", "TENDER_PROJECTS_DIR", "TENDER_BATCHES_DIR",
+                     "TENDER_UPLOAD_SESSIONS_DIR", "TENDER_TEMP_DIR", "TENDER_CACHE_DIR", "TENDER_RESULT_CACHE_DIR"):
+        env[variable] = str(tmp_path / variable.lower())
+    subprocess.check_call([sys.executable, "-c", "import tender"], cwd=API_DIR, env=env)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,175 @@
+import asyncio
+import io
+import threading
+from concurrent.futures import Future
+
+import httpx
+import pytest
+from PyPDF2 import PdfReader
+
+import tender
+from tenderflow import convert
+from tenderflow.pipeline import PipelineStage
+from samples import jpeg_bytes, page_widths, pdf_bytes, png_bytes, tender_files
+
+
+def test_upload_merges_lots_in_upload_order(client):
+    files = tender_files(
+        pdf_bytes(100, 100),
+        ("a.pdf", pdf_bytes(301)),
+        ("b.jpg", jpeg_bytes((60, 40))),
+        ("c.png", png_bytes((40, 60))),
+        ("d.pdf", pdf_bytes(302, 303)),
+    )
+    response = client.post("/upload", files=files)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/pdf"
+    assert page_widths(response.content) == [100, 100, 301, 60, 40, 302, 303]
+
+
+def test_upload_requires_login(app_client):
+    response = app_client.post("/upload", files=tender_files(pdf_bytes(), ("a.pdf", pdf_bytes())), follow_redirects=False)
+    assert response.status_code == 303
+    assert response.headers["location"] == "/"
+
+
+def test_saturated_pipeline_answers_503_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(tender.pipeline, "_admitted", tender.pipeline.capacity)
+    response = client.post("/upload", files=tender_files(pdf_bytes(), ("a.pdf", pdf_bytes())))
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(tender.PIPELINE_RETRY_AFTER)
+
+
+def test_shutdown_cancels_queued_work_only():
+    stage = PipelineStage("thread", 1, 0, 1)
+    release = threading.Event()
+    running = stage.submit_in_thread(release.wait)
+    queued = stage.submit_in_thread(lambda: None)
+    stage.shutdown()
+    assert queued.cancelled()
+    release.set()
+    assert running.result(timeout=5) is True
+
+
+def test_rejects_unsupported_and_mislabelled_files(client):
+    response = client.post("/upload", files=tender_files(pdf_bytes(), ("notes.txt", b"hello")))
+    assert response.status_code == 400
+    assert "Unsupported file type" in response.json()["detail"]
+
+    response = client.post("/upload", files=tender_files(pdf_bytes(), ("fake.pdf", jpeg_bytes())))
+    assert response.status_code == 400
+    assert "does not look like a PDF" in response.json()["detail"]
+
+    response = client.post("/upload", files=tender_files(jpeg_bytes(), ("a.pdf", pdf_bytes())))
+    assert response.status_code == 400
+
+
+def test_ingest_writes_parts_off_the_event_loop(client, monkeypatch):
+    writers = []
+    write = tender.MultipartIngest._write
+
+    def spy(self, pending):
+        try:
+            asyncio.get_running_loop()
+            writers.append("event loop")
+        except RuntimeError:
+            writers.append("thread")
+        write(self, pending)
+
+    monkeypatch.setattr(tender.MultipartIngest, "_write", spy)
+    response = client.post("/upload", files=tender_files(pdf_bytes(100), ("a.pdf", pdf_bytes(301)), ("b.jpg", jpeg_bytes())))
+    assert response.status_code == 200
+    assert page_widths(response.content) == [100, 301, 60]
+    assert writers and set(writers) == {"thread"}
+
+
+def test_upload_needs_a_lot(client):
+    response = client.post("/upload", files=tender_files(pdf_bytes()))
+    assert response.status_code == 400
+
+
+def test_streamed_upload_matches_the_buffered_one(client):
+    files = tender_files(pdf_bytes(110), ("a.pdf", pdf_bytes(120, 130)), ("b.jpg", jpeg_bytes((50, 50))))
+    response = client.post("/upload?stream=true", files=files)
+    assert response.status_code == 200
+    assert page_widths(response.content) == [110, 120, 130, 50]
+
+
+def test_stream_releases_its_slot_if_the_client_is_gone_before_the_body(client, tmp_path):
+    master = tmp_path / "master.pdf"
+    master.write_bytes(pdf_bytes(100))
+    scratch = tender.temp_storage.create()
+    tender.pipeline.acquire()
+    response = asyncio.run(tender.stream_tender_pdf(str(master), [], None, scratch, "Tender.pdf", tender.StageTimer()))
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("client went away")
+
+    scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "method": "POST", "headers": []}
+    with pytest.raises(Exception):
+        asyncio.run(response(scope, receive, send))
+    assert tender.pipeline.admitted == 0
+    assert scratch.released
+
+
+def test_stream_sends_earlier_inputs_while_the_last_lot_converts(client, monkeypatch):
+    received = []
+    lot_sent = threading.Event()
+    released_after_lot_sent = []
+    submit = tender.conversion_scheduler.submit
+
+    def gated_submit(kind, lot_file_paths, content_hashes):
+        # The image lot is only converted once the client has the PDF lot before it.
+        future = Future()
+
+        def convert_once_sent():
+            released_after_lot_sent.append(lot_sent.wait(10))
+            future.set_result(submit(kind, lot_file_paths, content_hashes).result())
+
+        threading.Thread(target=convert_once_sent, daemon=True).start()
+        return future
+
+    monkeypatch.setattr(tender.conversion_scheduler, "submit", gated_submit)
+    request = httpx.Request(
+        "POST", "http://testserver/upload?stream=true", cookies={"authenticated": "true"},
+        files=tender_files(pdf_bytes(110), ("a.pdf", pdf_bytes(120)), ("b.jpg", jpeg_bytes((50, 50)))),
+    )
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/upload", "raw_path": b"/upload", "query_string": b"stream=true", "root_path": "",
+        "headers": [(key.encode(), value.encode()) for key, value in request.headers.items()],
+        "client": ("testclient", 50000), "server": ("testserver", 80),
+    }
+    body = [request.read()]
+
+    async def receive():
+        if body:
+            return {"type": "http.request", "body": body.pop(), "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        received.append(message)
+        if b"/MediaBox [0 0 120 200]" in b"".join(m.get("body", b"") for m in received):
+            lot_sent.set()
+
+    asyncio.run(tender.app(scope, receive, send))
+    assert received[0]["status"] == 200
+    assert released_after_lot_sent == [True]
+    assert page_widths(b"".join(m.get("body", b"") for m in received)) == [110, 120, 50]
+
+
+def test_consecutive_images_share_one_converted_pdf(tmp_path):
+    paths = []
+    for index in range(3):
+        path = tmp_path / f"{index}.jpg"
+        path.write_bytes(jpeg_bytes((30 + index, 20)))
+        paths.append(str(path))
+    output = convert.convert_images_to_pdf(paths)
+    with open(output, "rb") as f:
+        data = f.read()
+    assert [round(float(page.mediabox.width)) for page in PdfReader(io.BytesIO(data)).pages] == [30, 31, 32]
+    with open(paths[0], "rb") as f:
+        assert f.read() in data # baseline JPEGs are embedded unchanged